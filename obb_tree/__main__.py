@@ -0,0 +1,5 @@
+import sys
+
+from obb_tree.cli import main
+
+sys.exit(main())
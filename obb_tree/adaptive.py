@@ -0,0 +1,128 @@
+import heapq
+import numpy as np
+
+from obb_tree.builder import _build_levels, _fit_boxes, _gather_segments, _segment_moments, _split_sides
+from obb_tree.tree import OBBTree, _level_order
+
+METRICS = ("fill", "boundary")
+
+
+def fit_errors(points, starts, counts, corners, width, height, metric="fill"):
+    """
+    Fit error of the boxes of several nodes.
+    "fill": 1 - fill ratio, the fraction of the box area (in pixels, box extents plus one) not covered by pixels of
+     the node. 0 for boxes that are completely filled, e.g. straight lines along the box axis.
+    "boundary": largest distance of a pixel of the node to the outline of its box, in pixels. Every pixel lies within
+     this distance of the box outline, so it bounds the error of the outline as a contour of the pixels.
+    :param points: (P, 2) pixel indices of all nodes, the points of each node are contiguous.
+    :param starts: (K,) start of each node in points.
+    :param counts: (K,) number of points of each node, all counts are > 0.
+    :return: (K,) float64 errors.
+    """
+    if metric == "fill":
+        return np.maximum(1 - counts / ((width + 1) * (height + 1)), 0)
+    if metric != "boundary":
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}.")
+
+    # coordinates of every point along the two box edges starting at its first corner
+    node_of_point = np.repeat(np.arange(len(counts)), counts)
+    edge_u = corners[:, 1] - corners[:, 0]
+    edge_v = corners[:, 3] - corners[:, 0]
+    length_u = np.hypot(edge_u[:, 0], edge_u[:, 1])
+    length_v = np.hypot(edge_v[:, 0], edge_v[:, 1])
+    # degenerate boxes are lines or points, all their pixels lie on the outline
+    unit_u = edge_u / np.where(length_u > 0, length_u, 1)[:, None]
+    unit_v = edge_v / np.where(length_v > 0, length_v, 1)[:, None]
+    dx = points[:, 0] - corners[:, 0, 0][node_of_point]
+    dy = points[:, 1] - corners[:, 0, 1][node_of_point]
+    u = dx * unit_u[:, 0][node_of_point] + dy * unit_u[:, 1][node_of_point]
+    v = dx * unit_v[:, 0][node_of_point] + dy * unit_v[:, 1][node_of_point]
+    distance = np.minimum(np.minimum(u, length_u[node_of_point] - u), np.minimum(v, length_v[node_of_point] - v))
+    return np.maximum(np.maximum.reduceat(distance, starts), 0)
+
+
+def build_adaptive_trees(segments, max_error=None, max_nodes=None, metric="fill", min_pixels=10, max_depth=32,
+                         labels=None):
+    """
+    Builds OBB trees that are refined where the boxes fit their pixels badly instead of down to a fixed depth.
+    Without max_nodes, all nodes with an error above max_error are split, level by level like build_obb_trees. With
+    max_nodes, the leaf with the largest error of all trees is split first until the forest has max_nodes nodes or no
+    leaf exceeds max_error, which trades accuracy against build time and memory explicitly. In both modes nodes with
+    fewer than min_pixels pixels or at max_depth are not split, and the splits are the same as in create_obb_tree.
+    :param segments: SegmentIndices as returned by group_indices_by_label.
+    :param max_error: Nodes with an error up to max_error are not split, see fit_errors. Defaults to 0, which splits
+     every imperfect box. Boxes without error, e.g. of filled rectangles, stay leaves also then, so the trees are
+     shallower than those of build_obb_trees with the same max_depth.
+    :param max_nodes: Optional budget of nodes for the whole forest. The roots are always built.
+    :param metric: "fill" or "boundary", see fit_errors.
+    :param labels: Labels of the segments to build. Defaults to all non-empty segments.
+    :return: OBBTree holding the trees of all segments as one forest, and the (N,) error of every node.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}.")
+    max_error = 0.0 if max_error is None else max_error
+    points, counts, labels = _gather_segments(segments, labels)
+    if max_nodes is None:
+        errors = []
+
+        def refine(level_points, starts, level_counts, corners, width, height):
+            errors.append(fit_errors(level_points, starts, level_counts, corners, width, height, metric))
+            return errors[-1] > max_error
+
+        tree = _build_levels(points, counts, labels, max_depth, min_pixels, refine=refine)
+        return tree, np.concatenate(errors) if len(errors) > 0 else np.zeros(0)
+    return _build_budget(points, counts, labels, max_error, max_nodes, metric, min_pixels, max_depth)
+
+
+def _fit_nodes(points, counts, metric):
+    # boxes and errors of nodes given by contiguous points
+    starts = np.cumsum(counts) - counts
+    moments = _segment_moments(points, starts)
+    corners, width, height = _fit_boxes(points, starts, counts, moments)
+    return corners, width, height, fit_errors(points, starts, counts, corners, width, height, metric)
+
+
+def _build_budget(points, counts, labels, max_error, max_nodes, metric, min_pixels, max_depth):
+    # nodes are collected in creation order and sorted into level order at the end
+    corners, width, height, errors = _fit_nodes(points, counts, metric)
+    nodes = {"corners": list(corners), "width": list(width), "height": list(height), "error": list(errors),
+             "depth": [0] * len(counts), "parent": [-1] * len(counts), "segment": list(labels),
+             "count": list(counts)}
+
+    # max-heap of the splittable leaves by error, ties are broken by node id to keep the result deterministic
+    starts = np.cumsum(counts) - counts
+    leaf_points = {}
+    heap = []
+    for node in range(len(counts)):
+        if counts[node] >= min_pixels and max_depth > 0 and errors[node] > max_error:
+            leaf_points[node] = points[starts[node]:starts[node] + counts[node]]
+            heap.append((-errors[node], node))
+    heapq.heapify(heap)
+
+    while len(heap) > 0 and len(nodes["depth"]) < max_nodes:
+        _, node = heapq.heappop(heap)
+        node_points = leaf_points.pop(node)
+        second = _split_sides(node_points, np.array([len(node_points)]), nodes["corners"][node][None])
+        parts = [part for part in (node_points[~second], node_points[second]) if len(part) > 0]
+        if len(nodes["depth"]) + len(parts) > max_nodes:
+            break
+        part_counts = np.array([len(part) for part in parts])
+        part_corners, part_width, part_height, part_errors = _fit_nodes(np.concatenate(parts), part_counts, metric)
+
+        depth = nodes["depth"][node] + 1
+        for i, part in enumerate(parts):
+            child = len(nodes["depth"])
+            for name, value in (("corners", part_corners[i]), ("width", part_width[i]), ("height", part_height[i]),
+                                ("error", part_errors[i]), ("depth", depth), ("parent", node),
+                                ("segment", nodes["segment"][node]), ("count", len(part))):
+                nodes[name].append(value)
+            if len(part) >= min_pixels and depth < max_depth and part_errors[i] > max_error:
+                leaf_points[child] = part
+                heapq.heappush(heap, (-part_errors[i], child))
+
+    # the children of a node split later are created behind those of nodes split before it, also when the node comes
+    # first in its level: the sibling groups of each level are sorted by parent
+    depth, parent = np.array(nodes["depth"], dtype=np.int32), np.array(nodes["parent"], dtype=np.int64)
+    tree = OBBTree.from_parents(nodes["corners"], nodes["width"], nodes["height"], depth, parent, nodes["segment"],
+                                nodes["count"])
+    return tree, np.array(nodes["error"], dtype=np.float64)[_level_order(depth, parent)[0]]
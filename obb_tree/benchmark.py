@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import sys
+import time
+import numpy as np
+
+from obb_tree.builder import build_obb_trees
+from obb_tree.jit import NUMBA_AVAILABLE, create_sub_parts_jit, oriented_bounding_box_jit
+from obb_tree.obb import create_sub_parts, group_indices_by_label, oriented_bounding_box_py
+from obb_tree.segment_count import count_pixels_per_segment
+
+# QApplication created for the rendering stage, it has to live as long as the process
+_app = None
+
+
+def make_scene(height=512, width=512, segments=40, segment_size=40, fill=True, seed=0):
+    """
+    Draws random triangles and quadrilaterals into a binary image, like the shapes of obb_tree_test. Overlapping shapes
+    merge, so the number of connected components may be lower than segments.
+    :param segment_size: Diameter of the shapes in pixels.
+    :param fill: Draw filled shapes, otherwise only their outlines.
+    :return: (height, width) uint8 foreground mask.
+    """
+    from skimage.draw import polygon, polygon_perimeter
+
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width), dtype=np.uint8)
+    radius = segment_size / 2
+    for _ in range(segments):
+        center = rng.uniform([radius, radius], [max(height - radius, radius), max(width - radius, radius)])
+        num_corners = rng.integers(3, 5)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, num_corners))
+        rows = center[0] + radius * np.sin(angles)
+        cols = center[1] + radius * np.cos(angles)
+        draw = polygon if fill else polygon_perimeter
+        rr, cc = draw(rows, cols, shape=image.shape)
+        image[rr, cc] = 1
+    return image
+
+
+def best_time(fn, repeats=3):
+    """
+    Best-of-repeats run time of fn() in seconds and the result of its last call.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def _render(forest, shape):
+    # draws the forest the way the GUI does, into an offscreen image
+    from PySide6.QtCore import QRectF
+    from PySide6.QtGui import QColor, QImage, QPainter
+    from PySide6.QtWidgets import QApplication, QGraphicsScene
+    from obb_tree.gui.obb_layer_item import OBBLayerItem
+
+    global _app
+    if QApplication.instance() is None:
+        _app = QApplication(["benchmark", "-platform", "offscreen"])
+    scene = QGraphicsScene()
+    for depth in range(forest.max_depth + 1):
+        scene.addItem(OBBLayerItem(forest.corners[forest.level(depth)][:, :, ::-1], QColor(0, 114, 189)))
+    image = QImage(shape[1], shape[0], QImage.Format_RGB32)
+    image.fill(QColor(255, 255, 255))
+    painter = QPainter(image)
+    scene.render(painter, QRectF(image.rect()), QRectF(0, 0, shape[1], shape[0]))
+    painter.end()
+    return image
+
+
+def _render_available():
+    try:
+        import PySide6.QtWidgets  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_scene(mask, max_depths=(3,), min_pixels=(10,), repeats=3, render=True):
+    """
+    Times every stage of the pipeline on one scene.
+    :return: dict with the number of segments and pixels, the time per stage and one entry per (max_depth, min_pixels)
+     combination of the build sweep. Stages that cannot run here are None.
+    """
+    from skimage import measure
+
+    stages = {}
+    stages["labeling"], labels = best_time(lambda: measure.label(mask, background=0, connectivity=2), repeats)
+    labels = labels.astype(np.int32)
+    stages["counting"], _ = best_time(lambda: count_pixels_per_segment(labels), repeats)
+    stages["indices"], segments = best_time(lambda: group_indices_by_label(labels), repeats)
+    segment_list = [segments.segment(label) for label in segments.labels()]
+    stages["obb"], obbs = best_time(lambda: [oriented_bounding_box_py(indices) for indices in segment_list], repeats)
+    stages["sub_parts"], _ = best_time(
+        lambda: [create_sub_parts(indices, obb.corners) for indices, obb in zip(segment_list, obbs)], repeats)
+    # the same per-node work with the compiled kernels, the first calls compile them and are not timed
+    stages["obb_numba"] = stages["sub_parts_numba"] = None
+    if NUMBA_AVAILABLE and len(segment_list) > 0:
+        create_sub_parts_jit(segment_list[0], oriented_bounding_box_jit(segment_list[0]).corners)
+        stages["obb_numba"], _ = best_time(lambda: [oriented_bounding_box_jit(indices) for indices in segment_list],
+                                           repeats)
+        stages["sub_parts_numba"], _ = best_time(
+            lambda: [create_sub_parts_jit(indices, obb.corners) for indices, obb in zip(segment_list, obbs)], repeats)
+
+    sweep = []
+    forest = None
+    for max_depth, min_pixel in itertools.product(max_depths, min_pixels):
+        seconds, tree = best_time(lambda: build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixel,
+                                                          backend="numpy"), repeats)
+        entry = {"max_depth": max_depth, "min_pixels": min_pixel, "seconds": seconds, "nodes": len(tree),
+                 "numba_seconds": None}
+        if NUMBA_AVAILABLE:
+            # the first call compiles the kernels (or loads them from the cache) and is not timed
+            build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixel, backend="numba")
+            entry["numba_seconds"], _ = best_time(
+                lambda: build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixel, backend="numba"), repeats)
+        sweep.append(entry)
+        if forest is None or len(tree) > len(forest):
+            forest = tree
+    # the build stage is the first configuration of the sweep, render draws the largest forest
+    stages["build"] = sweep[0]["seconds"] if sweep else None
+    stages["render"] = None
+    if render and forest is not None and _render_available():
+        stages["render"], _ = best_time(lambda: _render(forest, labels.shape), repeats)
+
+    return {"segments": len(segment_list), "pixels": len(segments.indices),
+            "nodes": len(forest) if forest is not None else 0, "stages": stages, "sweep": sweep}
+
+
+def scene_key(height, width, segments, segment_size, fill):
+    return f"{height}x{width}-n{segments}-s{segment_size}-{'fill' if fill else 'outline'}"
+
+
+def run_benchmarks(sizes=(256, 512), segments=(10, 100), segment_sizes=(40,), fills=(True, False),
+                   max_depths=(1, 3, 5), min_pixels=(10,), repeats=3, render=True, seed=0):
+    """
+    Runs run_scene on every combination of the scene parameters.
+    :param sizes: Square image sizes.
+    :return: JSON-serialisable dict with the scene results keyed by scene_key.
+    """
+    results = {}
+    for size, num_segments, segment_size, fill in itertools.product(sizes, segments, segment_sizes, fills):
+        mask = make_scene(size, size, num_segments, segment_size, fill, seed=seed)
+        result = run_scene(mask, max_depths=max_depths, min_pixels=min_pixels, repeats=repeats, render=render)
+        results[scene_key(size, size, num_segments, segment_size, fill)] = result
+    return {"version": 1, "repeats": repeats, "scenes": results}
+
+
+def flatten_timings(report):
+    """
+    Maps "scene/stage", "scene/build-d<max_depth>-m<min_pixels>" and "scene/build-numba-d<max_depth>-m<min_pixels>"
+    to seconds for all timings of a report.
+    """
+    timings = {}
+    for key, scene in report["scenes"].items():
+        for stage, seconds in scene["stages"].items():
+            if seconds is not None:
+                timings[f"{key}/{stage}"] = seconds
+        for entry in scene["sweep"]:
+            timings[f"{key}/build-d{entry['max_depth']}-m{entry['min_pixels']}"] = entry["seconds"]
+            if entry.get("numba_seconds") is not None:
+                timings[f"{key}/build-numba-d{entry['max_depth']}-m{entry['min_pixels']}"] = entry["numba_seconds"]
+    return timings
+
+
+def compare(report, baseline, tolerance=0.25, min_seconds=1e-3):
+    """
+    Compares the timings of a report against a baseline report. Timings present in only one of them are ignored.
+    :param tolerance: Relative slowdown above which a timing counts as regression.
+    :param min_seconds: Absolute slowdown below which differences are treated as noise.
+    :return: list of (timing name, baseline seconds, current seconds) of all regressions.
+    """
+    current = flatten_timings(report)
+    regressions = []
+    for name, base in flatten_timings(baseline).items():
+        if name in current and current[name] > base * (1 + tolerance) and current[name] - base > min_seconds:
+            regressions.append((name, base, current[name]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="obb_tree.benchmark",
+                                     description="Time labeling, tree building and rendering on synthetic scenes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512], help="square image sizes")
+    parser.add_argument("--segments", type=int, nargs="+", default=[10, 100], help="shapes drawn per scene")
+    parser.add_argument("--segment-sizes", type=int, nargs="+", default=[40], help="shape diameters in pixels")
+    parser.add_argument("--mode", choices=("fill", "outline", "both"), default="both")
+    parser.add_argument("--max-depth", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--min-pixels", type=int, nargs="+", default=[10])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-render", action="store_true", help="skip the rendering stage")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    fills = {"fill": (True,), "outline": (False,), "both": (True, False)}[args.mode]
+    report = run_benchmarks(sizes=args.sizes, segments=args.segments, segment_sizes=args.segment_sizes, fills=fills,
+                            max_depths=args.max_depth, min_pixels=args.min_pixels, repeats=args.repeats,
+                            render=not args.no_render)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(report, json.load(f), tolerance=args.tolerance)
+    for name, base, current in regressions:
+        print(f"regression {name}: {base * 1000:.3f} ms -> {current * 1000:.3f} ms ({current / base:.2f}x)",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,585 @@
+import numpy as np
+import time
+
+from obb_tree.jit import build_forest, get_backend
+from obb_tree.obb import CUT_TOLERANCE, boundary_pixels, group_indices_by_label, principal_axes
+from obb_tree.profiling import active, collect, stage
+from obb_tree.tree import OBBTree
+
+# corner offsets of the unit box around a single pixel
+_UNIT_BOX = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]])
+
+# number of points a pass over a tree level handles at once, which bounds the size of its temporaries
+_WINDOW = 1 << 16
+
+
+def _windows(starts, counts, size=None):
+    """
+    Splits consecutive point ranges into windows of at most size points, so that a pass over the points of a level
+    only allocates temporaries of the window size.
+    :param starts: (K,) start of each range, the ranges follow each other without gaps.
+    :param counts: (K,) number of points of each range, all counts are > 0.
+    :return: iterator of (begin, end, first, window_counts): the points [begin, end) belong to the ranges first,
+     first + 1, ..., which have window_counts points in the window.
+    """
+    if len(starts) == 0:
+        return
+    size = _WINDOW if size is None else size
+    ends = starts + counts
+    for begin in range(int(starts[0]), int(ends[-1]), size):
+        end = min(begin + size, int(ends[-1]))
+        first = int(np.searchsorted(ends, begin, side="right"))
+        last = int(np.searchsorted(starts, end, side="left"))
+        yield begin, end, first, np.minimum(ends[first:last], end) - np.maximum(starts[first:last], begin)
+
+
+def _segment_moments(points, starts):
+    """
+    Raw moments (n, sum x, sum y, sum xx, sum xy, sum yy) of consecutive point ranges, see compute_moments.
+    :param points: (P, 2) pixel indices.
+    :param starts: (K,) start of each range in points, ranges must not be empty.
+    :return: (K, 6) moments.
+    """
+    dtype = np.int64 if np.issubdtype(points.dtype, np.integer) else np.float64
+    counts = np.diff(np.append(starts, len(points)))
+    moments = np.zeros((len(starts), 6), dtype=dtype)
+    moments[:, 0] = counts
+    for begin, end, first, window_counts in _windows(starts, counts):
+        x = points[begin:end, 0].astype(dtype, copy=False)
+        y = points[begin:end, 1].astype(dtype, copy=False)
+        window_starts = np.cumsum(window_counts) - window_counts
+        window_moments = moments[first:first + len(window_counts)]
+        window_moments[:, 1] += np.add.reduceat(x, window_starts)
+        window_moments[:, 2] += np.add.reduceat(y, window_starts)
+        window_moments[:, 3] += np.add.reduceat(x * x, window_starts)
+        window_moments[:, 4] += np.add.reduceat(x * y, window_starts)
+        window_moments[:, 5] += np.add.reduceat(y * y, window_starts)
+    return moments
+
+
+def _fit_boxes(points, starts, counts, moments):
+    """
+    Fits the oriented bounding boxes of all nodes of one tree level at once.
+    :param points: (P, 2) pixel indices of all nodes, the points of each node are contiguous.
+    :param starts: (K,) start of each node in points.
+    :param counts: (K,) number of points of each node, all counts are > 0.
+    :param moments: (K, 6) raw moments of each node.
+    :return: corners (K, 4, 2), width (K,), height (K,)
+    """
+    # centroids and orientations of all nodes in closed form
+    centroids, cos, sin = principal_axes(moments)
+
+    # rotate the points of every node by the angle of its node and take the segmented extents, window by window
+    min_x, max_x, min_y, max_y = extents = np.empty((4, len(counts)))
+    extents[0::2] = np.inf
+    extents[1::2] = -np.inf
+    for begin, end, first, window_counts in _windows(starts, counts):
+        last = first + len(window_counts)
+        node_of_point = np.repeat(np.arange(first, last), window_counts)
+        # the coordinates are handled column by column, gathering (P, 2) rows is much slower than gathering (P,) values
+        dx = points[begin:end, 0] - centroids[:, 0][node_of_point]
+        dy = points[begin:end, 1] - centroids[:, 1][node_of_point]
+        point_cos = cos[node_of_point]
+        point_sin = sin[node_of_point]
+        rotated_x = point_cos * dx + point_sin * dy
+        rotated_y = point_cos * dy - point_sin * dx
+        window_starts = np.cumsum(window_counts) - window_counts
+        np.minimum(min_x[first:last], np.minimum.reduceat(rotated_x, window_starts), out=min_x[first:last])
+        np.maximum(max_x[first:last], np.maximum.reduceat(rotated_x, window_starts), out=max_x[first:last])
+        np.minimum(min_y[first:last], np.minimum.reduceat(rotated_y, window_starts), out=min_y[first:last])
+        np.maximum(max_y[first:last], np.maximum.reduceat(rotated_y, window_starts), out=max_y[first:last])
+
+    corners, width, height = _box_corners(centroids, cos, sin, min_x, max_x, min_y, max_y)
+
+    # single pixels get a unit box around the pixel, like in oriented_bounding_box_py
+    single = counts == 1
+    if np.any(single):
+        corners[single] = points[starts[single], None, :] + _UNIT_BOX
+        width[single] = 1
+        height[single] = 1
+
+    return corners, width, height
+
+
+def _box_corners(centroids, cos, sin, min_x, max_x, min_y, max_y):
+    # corners of boxes given by their extents in the rotated frame, rotated back and translated to the original position
+    local_x = np.stack([min_x, max_x, max_x, min_x], axis=1)
+    local_y = np.stack([min_y, min_y, max_y, max_y], axis=1)
+    corners = np.empty((len(centroids), 4, 2))
+    corners[:, :, 0] = cos[:, None] * local_x - sin[:, None] * local_y + centroids[:, 0, None]
+    corners[:, :, 1] = sin[:, None] * local_x + cos[:, None] * local_y + centroids[:, 1, None]
+    width = max_y - min_y
+    height = max_x - min_x
+    return corners, width, height
+
+
+def _split_sides(points, counts, corners):
+    """
+    Vectorized create_sub_parts for all nodes of one level.
+    :return: boolean array, True for points that belong to the second part of their node.
+    """
+    l1 = corners[:, 1] - corners[:, 0]
+    l2 = corners[:, 2] - corners[:, 1]
+    length1 = l1[:, 0] * l1[:, 0] + l1[:, 1] * l1[:, 1]
+    length2 = l2[:, 0] * l2[:, 0] + l2[:, 1] * l2[:, 1]
+    # near-square boxes cut at the second side, so that rounding of the corners cannot flip the choice
+    longer_first = length1 > (1 + CUT_TOLERANCE) * length2
+    intersection = np.where(longer_first[:, None], (corners[:, 0] + corners[:, 1]) / 2,
+                            (corners[:, 1] + corners[:, 2]) / 2)
+    direction = np.where(longer_first[:, None], corners[:, 2] - corners[:, 1], corners[:, 3] - corners[:, 2])
+
+    tolerance = CUT_TOLERANCE * (length1 + length2)
+
+    cross = (points[:, 0] - np.repeat(intersection[:, 0], counts)) * np.repeat(direction[:, 1], counts)
+    cross -= (points[:, 1] - np.repeat(intersection[:, 1], counts)) * np.repeat(direction[:, 0], counts)
+    return cross <= np.repeat(tolerance, counts)
+
+
+def _split_moments(points, counts, first_counts, moments):
+    """
+    Moments of both parts of every split node. Only the points of the smaller part of each node are summed, the
+    moments of the larger part are the difference to the moments of the node.
+    :param points: (P, 2) pixel indices, already partitioned so that the first part of each node precedes its second.
+    :param counts: (K,) number of points of each node.
+    :param first_counts: (K,) number of points in the first part of each node.
+    :param moments: (K, 6) raw moments of each node.
+    :return: (2K, 6) moments of the first and second part of every node, interleaved.
+    """
+    starts = np.cumsum(counts) - counts
+    second_starts = starts + first_counts
+    second_smaller = counts - first_counts < first_counts
+
+    # the parts are ranges of the partitioned points, the points of the smaller parts are selected by their position
+    small_moments = np.zeros_like(moments)
+    for begin, end, first, window_counts in _windows(starts, counts):
+        last = first + len(window_counts)
+        in_second = np.arange(begin, end) >= np.repeat(second_starts[first:last], window_counts)
+        small = in_second == np.repeat(second_smaller[first:last], window_counts)
+        window_starts = np.cumsum(window_counts) - window_counts
+        # the points of the larger part are zeroed, which leaves all sums but the count unchanged
+        window_moments = _segment_moments(np.where(small[:, None], points[begin:end], 0), window_starts)
+        window_moments[:, 0] = np.add.reduceat(small, window_starts, dtype=np.int64)
+        small_moments[first:last] += window_moments
+
+    part_moments = np.empty((2 * len(moments), 6), dtype=moments.dtype)
+    part_moments[0::2] = np.where(second_smaller[:, None], moments - small_moments, small_moments)
+    part_moments[1::2] = np.where(second_smaller[:, None], small_moments, moments - small_moments)
+    return part_moments
+
+
+def _compact_dtype(points):
+    """
+    Smallest integer dtype that holds all coordinates of integer points, float points keep their dtype.
+    """
+    if not np.issubdtype(points.dtype, np.integer) or len(points) == 0:
+        return points.dtype
+    low, high = int(points.min()), int(points.max())
+    for dtype in (np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return points.dtype
+
+
+def _compact(points, counts, kept):
+    """
+    Moves the points of the kept nodes to the front of points, in node order. The points of the other nodes are
+    dropped. A kept point never moves behind its position, so the points are moved window by window in place.
+    :param points: (P, 2) points of all nodes of a level, the points of each node contiguous. Modified in place.
+    :param counts: (K,) number of points of each node.
+    :param kept: (K,) True for the nodes to keep.
+    :return: number of kept points.
+    """
+    if np.all(kept):
+        return len(points)
+    # the points are moved as single items of a packed view, which is much faster than moving (P, 2) rows
+    packed = points.view(np.dtype((np.void, 2 * points.itemsize))).reshape(-1)
+    num_kept = 0
+    for begin, end, first, window_counts in _windows(np.cumsum(counts) - counts, counts):
+        keep = np.repeat(kept[first:first + len(window_counts)], window_counts)
+        window_kept = np.count_nonzero(keep)
+        if window_kept == end - begin and num_kept == begin:
+            num_kept = end
+        elif window_kept > 0:
+            packed[num_kept:num_kept + window_kept] = packed[begin:end][keep]
+            num_kept += window_kept
+    return num_kept
+
+
+def _misplaced(points, starts, counts, corners, second_starts, second):
+    """
+    Positions of the points that lie in the range of one part of their node but belong to the other, window by window.
+    :param second: Yield the points of the second part in the range of the first part if True, else the points of the
+     first part in the range of the second part.
+    :return: iterator of position arrays in increasing order.
+    """
+    for begin, end, first, window_counts in _windows(starts, counts):
+        last = first + len(window_counts)
+        sides = _split_sides(points[begin:end], window_counts, corners[first:last])
+        positions = np.arange(begin, end)
+        in_second = positions >= np.repeat(second_starts[first:last], window_counts)
+        yield positions[sides & ~in_second] if second else positions[in_second & ~sides]
+
+
+def _next_positions(positions, pending):
+    # the pending positions, or the next non-empty array of positions if all are used. None at the end
+    while len(pending) == 0:
+        pending = next(positions, None)
+        if pending is None:
+            return None
+    return pending
+
+
+def _partition(points, counts, corners):
+    """
+    In-place partition of the points of every node into the two parts given by the cut line of its box, the first
+    part of each node preceding its second like the order in which create_obb_tree visits the sub segments. Like in
+    quicksort, the points of the second part in the range of the first part are swapped with the points of the first
+    part in the range of the second part. Within a part the points are not kept in order.
+    The sides of the points are computed window by window, first to count the parts and then once more while
+    swapping, so no pass allocates temporaries larger than a window.
+    :param points: (P, 2) points of all nodes of a level, the points of each node contiguous. Modified in place.
+    :param counts: (K,) number of points of each node.
+    :param corners: (K, 4, 2) boxes of the nodes.
+    :return: (K,) number of points in the first part of every node.
+    """
+    starts = np.cumsum(counts) - counts
+    seconds = np.zeros(len(counts), dtype=np.int64)
+    for begin, end, first, window_counts in _windows(starts, counts):
+        sides = _split_sides(points[begin:end], window_counts, corners[first:first + len(window_counts)])
+        seconds[first:first + len(window_counts)] += np.add.reduceat(sides, np.cumsum(window_counts) - window_counts,
+                                                                     dtype=np.int64)
+    first_counts = counts - seconds
+
+    # every node has as many points of its second part in the range of its first part as the other way around, and
+    # both streams of positions are in node order: the k-th positions of both streams are swapped
+    second_starts = starts + first_counts
+    wrong_second = _misplaced(points, starts, counts, corners, second_starts, second=True)
+    wrong_first = _misplaced(points, starts, counts, corners, second_starts, second=False)
+    packed = points.view(np.dtype((np.void, 2 * points.itemsize))).reshape(-1)
+    pending_second = pending_first = np.zeros(0, dtype=np.int64)
+    while True:
+        pending_second = _next_positions(wrong_second, pending_second)
+        pending_first = _next_positions(wrong_first, pending_first)
+        if pending_second is None or pending_first is None:
+            break
+        num_swaps = min(len(pending_second), len(pending_first))
+        a, b = pending_second[:num_swaps], pending_first[:num_swaps]
+        packed[a], packed[b] = packed[b], packed[a]
+        pending_second, pending_first = pending_second[num_swaps:], pending_first[num_swaps:]
+    return first_counts
+
+
+def _split_level(points, counts, corners, split):
+    """
+    Partitions the points of the split nodes of a level into their parts, packed at the front of points in node order.
+    :return: (2S,) number of points in the first and second part of every split node, interleaved.
+    """
+    num_points = _compact(points, counts, split)
+    first_counts = _partition(points[:num_points], counts[split], corners[split])
+    return np.stack([first_counts, counts[split] - first_counts], axis=1).ravel()
+
+
+def _build_levels(points, counts, segments, max_depth, min_pixels, depth=0, refine=None):
+    """
+    Builds the trees of several segments level by level. All nodes of one level are fitted and split together.
+    The points are copied once into a buffer of the smallest integer dtype that holds the coordinates. Each level
+    partitions the points of its split nodes in place at the front of the buffer, so every node is a range of the
+    buffer. The passes over a level handle _WINDOW points at a time, so apart from the buffer the build only
+    allocates temporaries of the window size and arrays with one entry per node.
+    :param points: (P, 2) pixel indices, the points of each root are contiguous.
+    :param counts: (K,) number of points of each root, all counts are > 0.
+    :param segments: (K,) segment label of each root.
+    :param refine: Optional callable refine(points, starts, counts, corners, width, height) called for every level.
+     Nodes for which it returns False are not split, in addition to the min_pixels and max_depth rules.
+    :return: OBBTree holding all trees as one forest in level order.
+    """
+    buffer = np.array(points, dtype=_compact_dtype(points), order="C")
+    num_points = len(buffer)
+    levels = []
+    parents = np.full(len(counts), -1, dtype=np.int32)
+    num_nodes = 0
+    moments = None
+    stats = active()
+    while len(counts) > 0:
+        level_start = time.perf_counter() if stats is not None else 0.0
+        points = buffer[:num_points]
+        starts = np.zeros(len(counts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        if moments is None:
+            with stage("moments"):
+                moments = _segment_moments(points, starts)
+        with stage("fit"):
+            corners, width, height = _fit_boxes(points, starts, counts, moments)
+
+        # same stopping rule as create_obb_tree
+        split = counts >= min_pixels
+        if depth == max_depth:
+            split[:] = False
+        if refine is not None:
+            split &= refine(points, starts, counts, corners, width, height)
+
+        first_child = np.full(len(counts), -1, dtype=np.int32)
+        child_count = np.zeros(len(counts), dtype=np.int32)
+        next_num_points = 0
+        next_counts = counts[:0]
+        next_segments = segments[:0]
+        next_parents = parents[:0]
+        next_moments = moments[:0]
+        if np.any(split):
+            with stage("partition"):
+                part_counts = _split_level(points, counts, corners, split)
+            next_num_points = int(np.sum(part_counts))
+            with stage("moments"):
+                part_moments = _split_moments(buffer[:next_num_points], counts[split], part_counts[0::2],
+                                              moments[split])
+
+            # empty parts do not become nodes
+            non_empty = part_counts > 0
+            next_counts = part_counts[non_empty]
+            next_moments = part_moments[non_empty]
+            node_ids = num_nodes + np.flatnonzero(split).astype(np.int32)
+            next_parents = np.repeat(node_ids, 2)[non_empty]
+            next_segments = np.repeat(segments[split], 2)[non_empty]
+
+            num_parts = non_empty.reshape(-1, 2).sum(axis=1).astype(np.int32)
+            child_count[split] = num_parts
+            first_child[split] = num_nodes + len(counts) + np.cumsum(num_parts) - num_parts
+
+        levels.append((corners, width, height, np.full(len(counts), depth, dtype=np.int32), parents, first_child,
+                       child_count, segments, counts))
+        if stats is not None:
+            stats.add_level(depth, len(counts), num_points, np.count_nonzero(split), time.perf_counter() - level_start)
+        num_nodes += len(counts)
+        num_points, counts, segments, parents, moments = (next_num_points, next_counts, next_segments, next_parents,
+                                                           next_moments)
+        depth += 1
+
+    if len(levels) == 0:
+        return OBBTree.empty()
+    fields = [np.concatenate(field) for field in zip(*levels)]
+    return OBBTree(corners=fields[0], width=fields[1], height=fields[2], depth=fields[3], parent=fields[4],
+                   first_child=fields[5], child_count=fields[6], segment=fields[7].astype(np.int32),
+                   count=fields[8].astype(np.int64))
+
+
+def _foreground(labels):
+    # flat positions and labels of all foreground pixels, row-major. flatnonzero of a boolean mask is several times
+    # faster than of the integer labels
+    flat = labels.ravel()
+    positions = np.flatnonzero(flat != 0)
+    return positions, flat[positions]
+
+
+def label_moments(labels, foreground=None):
+    """
+    Raw moments (n, sum x, sum y, sum xx, sum xy, sum yy) of all segments of a label image in one pass over the image,
+    without grouping the pixel indices by label.
+    :param labels: Label image as numpy integer array. A value of 0 is treated as background.
+    :param foreground: Flat positions and labels of the foreground pixels if they are known already.
+    :return: (L, 6) int64 moments indexed by label, row 0 (the background) is zero.
+    """
+    positions, values = _foreground(labels) if foreground is None else foreground
+    num_labels = int(values.max()) + 1 if len(values) > 0 else 1
+    x, y = np.divmod(positions, labels.shape[1])
+
+    moments = np.zeros((num_labels, 6), dtype=np.int64)
+    moments[:, 0] = np.bincount(values, minlength=num_labels)
+    rows, cols = labels.shape
+    if len(values) * max(rows, cols) ** 2 < 2 ** 53:
+        # weighted bincount sums in float64, which is exact as long as no sum can exceed 2 ** 53
+        for column, weights in enumerate((x, y, x * x, x * y, y * y), start=1):
+            moments[:, column] = np.bincount(values, weights=weights, minlength=num_labels)
+    else:
+        for column, weights in enumerate((x, y, x * x, x * y, y * y), start=1):
+            np.add.at(moments[:, column], values, weights)
+    return moments
+
+
+def label_with_moments(mask, connectivity=2):
+    """
+    Connected component labeling of a foreground mask together with the raw moments of all segments.
+    :return: int32 label image and (L, 6) int64 moments, see label_moments.
+    """
+    from skimage import measure
+    labels = measure.label(mask, background=0, connectivity=connectivity).astype(np.int32)
+    return labels, label_moments(labels)
+
+
+def build_root_obbs(labels, moments=None):
+    """
+    Depth-0 OBBs of all segments of a label image, equal to build_obb_trees with max_depth=0. The orientations of all
+    boxes follow from the moments in one vectorized call, the extents from one grouped min/max pass over the
+    foreground pixels, so no pixel indices are grouped by label.
+    :param labels: Label image as numpy integer array. A value of 0 is treated as background.
+    :param moments: Moments as returned by label_moments. Computed if not given.
+    :return: OBBTree with one root per non-empty segment, in label order.
+    """
+    # the foreground pixels are located once for the moments and the extents
+    positions, values = _foreground(labels)
+    if moments is None:
+        moments = label_moments(labels, foreground=(positions, values))
+    segments = np.flatnonzero(moments[:, 0])
+    segments = segments[segments > 0]
+    if len(segments) == 0:
+        return OBBTree.empty()
+
+    centroids, cos, sin = principal_axes(moments[segments])
+
+    # rotate every foreground pixel by the angle of its segment, labels are mapped to box indices first
+    box_of_label = np.zeros(len(moments), dtype=np.int64)
+    box_of_label[segments] = np.arange(len(segments))
+    boxes = box_of_label[values]
+    x, y = np.divmod(positions, labels.shape[1])
+    dx = x - centroids[boxes, 0]
+    dy = y - centroids[boxes, 1]
+    rotated_x = cos[boxes] * dx + sin[boxes] * dy
+    rotated_y = cos[boxes] * dy - sin[boxes] * dx
+
+    extents = np.empty((4, len(segments)))
+    extents[0::2] = np.inf
+    extents[1::2] = -np.inf
+    np.minimum.at(extents[0], boxes, rotated_x)
+    np.maximum.at(extents[1], boxes, rotated_x)
+    np.minimum.at(extents[2], boxes, rotated_y)
+    np.maximum.at(extents[3], boxes, rotated_y)
+    corners, width, height = _box_corners(centroids, cos, sin, *extents)
+
+    counts = moments[segments, 0]
+    single = counts == 1
+    if np.any(single):
+        # the centroid of a single pixel is the pixel itself
+        corners[single] = centroids[single, None, :] + _UNIT_BOX
+        width[single] = 1
+        height[single] = 1
+
+    num_roots = len(segments)
+    return OBBTree(corners=corners, width=width, height=height, depth=np.zeros(num_roots, dtype=np.int32),
+                   parent=np.full(num_roots, -1, dtype=np.int32), first_child=np.full(num_roots, -1, dtype=np.int32),
+                   child_count=np.zeros(num_roots, dtype=np.int32), segment=segments.astype(np.int32),
+                   count=counts.astype(np.int64))
+
+
+def build_obb_tree(indices, max_depth=3, min_pixels=10, depth=0):
+    """
+    Level-synchronous counterpart of create_obb_tree for a single segment.
+    :param indices: (N, 2) pixel indices of the segment.
+    :return: OBBTree of the segment, segment label 0.
+    """
+    if len(indices) == 0:
+        return OBBTree.empty()
+    return _build_levels(indices, np.array([len(indices)]), np.zeros(1, dtype=np.int32), max_depth, min_pixels,
+                         depth=depth)
+
+
+def build_obb_trees(segments, max_depth=3, min_pixels=10, labels=None, return_stats=False, backend=None):
+    """
+    Builds the OBB trees of all segments of an image at once, one tree level at a time. Produces the same trees as
+    calling create_obb_tree for every segment.
+    :param segments: SegmentIndices as returned by group_indices_by_label.
+    :param labels: Labels of the segments to build. Defaults to all non-empty segments.
+    :param return_stats: Also return the profiling.BuildStats of the build (stage timings and per-level counts).
+    :param backend: "numpy" or "numba" (compiled build of all trees in one call, see obb_tree.jit). Selected
+     automatically if None.
+    :return: OBBTree holding the trees of all segments as one forest, and the BuildStats if return_stats is set.
+    """
+    if return_stats:
+        with collect() as stats:
+            tree = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels, labels=labels,
+                                   backend=backend)
+        return tree, stats
+
+    points, counts, labels = _gather_segments(segments, labels)
+    if get_backend(backend) == "numba" and np.issubdtype(points.dtype, np.integer):
+        with stage("compiled"):
+            tree = build_forest(points, counts, labels, max_depth, min_pixels)
+        stats = active()
+        if stats is not None:
+            # the compiled build is not split into levels, the per-level counts are taken from the result
+            for depth in range(tree.max_depth + 1):
+                level = tree.level(depth)
+                stats.add_level(depth, level.stop - level.start, np.sum(tree.count[level]),
+                                np.count_nonzero(tree.child_count[level]))
+        return tree
+    return _build_levels(points, counts, labels, max_depth, min_pixels)
+
+
+def _gather_segments(segments, labels=None):
+    """
+    Points of the given segments, the points of each segment contiguous and in the order of labels.
+    :return: points (P, 2), counts (K,) and int32 labels (K,) of the non-empty segments.
+    """
+    if labels is None:
+        labels = segments.labels()
+    labels = np.asarray(labels)
+    labels = labels[(labels > 0) & (labels < segments.num_labels)]
+    starts = segments.offsets[labels]
+    counts = segments.offsets[labels + 1] - starts
+    labels, starts, counts = labels[counts > 0], starts[counts > 0], counts[counts > 0]
+
+    if np.sum(counts) == len(segments.indices) and np.all(np.diff(labels) > 0):
+        # all pixels of the buffer are used and the labels are in buffer order, no gathering needed
+        points = segments.indices
+    else:
+        with stage("gather"):
+            point_ids = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(np.sum(counts))
+            points = segments.indices[point_ids]
+    return points, counts, labels.astype(np.int32)
+
+
+def extend_obb_tree(tree, points, max_depth, min_pixels=10):
+    """
+    Grows a tree built by this module with a smaller max_depth, only the levels below its deepest level are built.
+    The pixels of the deepest level are recovered by replaying the recorded splits, no box is fitted again above it.
+    :param tree: OBBTree or forest built with the same min_pixels.
+    :param points: (P, 2) pixel indices the tree was built from, the points of each root contiguous and in root order.
+    :return: OBBTree equal to the one built with max_depth directly.
+    """
+    deepest = tree.max_depth
+    if deepest < 0 or deepest >= max_depth:
+        return tree
+
+    # route the points down the tree with the cut lines of the stored boxes, partitioning a copy of them in place
+    points = np.array(points, dtype=_compact_dtype(points), order="C")
+    nodes = np.arange(tree.level(int(tree.depth[0])).stop)
+    counts = tree.count[nodes]
+    num_points = len(points)
+    for depth in range(int(tree.depth[0]), deepest):
+        part_counts = _split_level(points[:num_points], counts, tree.corners[nodes], tree.child_count[nodes] > 0)
+        num_points = int(np.sum(part_counts))
+        counts = part_counts[part_counts > 0]
+        nodes = tree.level(depth + 1)
+        nodes = np.arange(nodes.start, nodes.stop)
+    points = points[:num_points]
+
+    # rebuild the deepest level from its points, which refits the same boxes, and graft the new levels below it
+    sub_tree = _build_levels(points, counts, tree.segment[nodes], max_depth, min_pixels, depth=deepest)
+    offset = nodes[0]
+    sub_tree.parent[:len(nodes)] = tree.parent[nodes]
+    sub_tree.parent[len(nodes):] += offset
+    sub_tree.first_child[sub_tree.first_child >= 0] += offset
+    return OBBTree(**{name: np.concatenate([getattr(tree, name)[:offset], getattr(sub_tree, name)])
+                      for name in OBBTree.__dataclass_fields__})
+
+
+def compare_input_modes(labels, max_depth=3, min_pixels=10):
+    """
+    Builds the trees of all segments of a label image once from all pixels and once from the boundary pixels only and
+    reports the number of input pixels, the number of nodes and the run time of both modes.
+    :return: dict mapping "full" and "boundary" to dicts with the keys "pixels", "nodes" and "seconds".
+    """
+    report = {}
+    for mode in ("full", "boundary"):
+        t0 = time.perf_counter()
+        segments = group_indices_by_label(labels if mode == "full" else boundary_pixels(labels))
+        tree = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels)
+        report[mode] = {"pixels": len(segments.indices), "nodes": len(tree), "seconds": time.perf_counter() - t0}
+    return report
+
+
+if __name__ == '__main__':
+    from scipy.ndimage import label
+    from obb_tree.benchmark import make_scene
+
+    scene_labels, _ = label(make_scene(1024, 1024, segments=200, segment_size=80))
+    for scene_mode, result in compare_input_modes(scene_labels).items():
+        print(f"{scene_mode:>8}: {result['pixels']} pixels, {result['nodes']} nodes, {result['seconds'] * 1000:.1f} ms")
@@ -0,0 +1,110 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from obb_tree.builder import build_obb_trees, extend_obb_tree
+from obb_tree.tree import OBBTree
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0  # trees served from the cache, including truncated and extended ones
+    misses: int = 0  # trees built from scratch
+    truncations: int = 0  # hits served by cutting off levels of a deeper tree
+    extensions: int = 0  # hits served by building the missing levels of a shallower tree
+    evictions: int = 0  # trees dropped to stay below the memory cap
+
+
+def segment_hash(indices):
+    """
+    Content hash of the pixel indices of a segment. Equal pixel sets in the same row-major order get equal hashes.
+    """
+    return hashlib.blake2b(np.ascontiguousarray(indices, dtype=np.int64).tobytes(), digest_size=16).digest()
+
+
+class TreeCache:
+    """
+    Bounded LRU cache of OBB trees, keyed by the content of the segment and min_pixels. A tree is reused for every
+    max_depth: deeper trees are truncated and shallower trees are extended by the missing levels.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.nbytes = 0
+        # key -> (tree with segment label 0, max_depth it was built with)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def get_forest(self, segments, max_depth=3, min_pixels=10, labels=None):
+        """
+        Drop-in replacement for build_obb_trees that builds only the trees not found in the cache.
+        :param segments: SegmentIndices as returned by group_indices_by_label.
+        :param labels: Labels of the segments to build. Defaults to all non-empty segments.
+        :return: OBBTree holding the trees of all segments as one forest.
+        """
+        if labels is None:
+            labels = segments.labels()
+        labels = [int(label) for label in labels if len(segments.segment(label)) > 0]
+        keys = [(segment_hash(segments.segment(label)), min_pixels) for label in labels]
+
+        trees = {}
+        missing = []
+        grow = []
+        for label, key in zip(labels, keys):
+            entry = self._entries.get(key)
+            if entry is None:
+                missing.append(label)
+                continue
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            tree, built_depth = entry
+            trees[label] = replace(tree, segment=np.full(len(tree), label, dtype=np.int32))
+            if max_depth < tree.max_depth:
+                self.stats.truncations += 1
+            elif max_depth > built_depth and tree.max_depth == built_depth:
+                # the tree may grow further, otherwise it stopped at min_pixels and is complete
+                grow.append((label, key))
+        keys = dict(zip(labels, keys))
+
+        if len(grow) > 0:
+            # all trees that need more levels are extended together
+            self.stats.extensions += len(grow)
+            forest = OBBTree.concatenate([trees[label] for label, _ in grow])
+            points = np.concatenate([segments.segment(label) for label, _ in grow])
+            grown_labels, grown = extend_obb_tree(forest, points, max_depth, min_pixels).segment_trees()
+            for label, tree in zip(grown_labels.tolist(), grown):
+                trees[label] = tree
+                self._store(keys[label], tree, max_depth)
+
+        if len(missing) > 0:
+            # all missing trees are built in one batch and split afterwards
+            self.stats.misses += len(missing)
+            built_labels, built = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels,
+                                                  labels=missing).segment_trees()
+            for label, tree in zip(built_labels.tolist(), built):
+                trees[label] = tree
+                self._store(keys[label], tree, max_depth)
+
+        forest = OBBTree.concatenate([trees[label] for label in labels])
+        return forest.truncate(max_depth) if forest.max_depth > max_depth else forest
+
+    def _store(self, key, tree, max_depth):
+        # the label is not part of the content, the same segment may carry another label in the next image
+        tree = replace(tree, segment=np.zeros(len(tree), dtype=np.int32))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[0].nbytes
+        self._entries[key] = (tree, max_depth)
+        self.nbytes += tree.nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.stats.evictions += 1
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+
+from obb_tree.builder import build_obb_trees, build_root_obbs
+from obb_tree.obb import SegmentIndices, boundary_pixels, group_indices_by_label
+
+IMAGE_EXTENSIONS = (".npy", ".png", ".tif", ".tiff", ".bmp", ".pgm", ".ppm")
+
+# marks the end of the input stream in the pipeline queue
+_END = object()
+
+
+def iter_input_paths(inputs, stdin=None):
+    """
+    Expands the command line inputs into a stream of file paths. Directories yield their image files in sorted order,
+    "-" yields one path per line read from stdin.
+    """
+    for item in inputs:
+        if item == "-":
+            for line in stdin if stdin is not None else sys.stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        elif os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(item, name)
+        else:
+            yield item
+
+
+def load_labels(path, relabel=False):
+    """
+    Loads a label image. .npy files are memory-mapped instead of read into memory.
+    :param relabel: Treat the input as a foreground mask (non-zero pixels) and run a connected component analysis.
+    """
+    if path.lower().endswith(".npy"):
+        image = np.load(path, mmap_mode="r")
+    else:
+        from skimage import io
+        image = io.imread(path)
+    if image.ndim == 3:
+        # colour images of binary drawings, any channel works as foreground mask
+        image = image[..., 0]
+    if relabel:
+        from skimage import measure
+        image = measure.label(np.asarray(image) != 0, background=0, connectivity=2)
+    return image
+
+
+def _read_inputs(paths, pipeline, relabel):
+    # producer of the pipeline, blocks as soon as the bounded queue is full. The end marker is always put, otherwise
+    # the consumer would wait forever if expanding the inputs fails
+    try:
+        for path in paths:
+            try:
+                pipeline.put((path, load_labels(path, relabel=relabel), None))
+            except Exception as e:
+                pipeline.put((path, None, e))
+    except Exception as e:
+        pipeline.put((None, None, e))
+    finally:
+        pipeline.put(_END)
+
+
+def _segment_offsets(labels):
+    # offsets of the SegmentIndices of a label image without grouping its pixels
+    counts = np.bincount(np.asarray(labels).ravel())
+    counts[0] = 0
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def process_labels(labels, max_depth, min_pixels, boundary_only=False, workers=1):
+    """
+    Builds the trees of a label image.
+    :return: the OBBTree and the SegmentIndices of the pixels the trees were built from. The indices are empty if the
+     build did not group the pixels, the offsets are always set.
+    """
+    if boundary_only:
+        labels = boundary_pixels(labels)
+    no_indices = np.zeros((0, 2), dtype=np.int64)
+    if max_depth == 0:
+        # root boxes need the moments and extents of the segments only, not their grouped pixel indices
+        labels = np.asarray(labels)
+        return build_root_obbs(labels), SegmentIndices(indices=no_indices, offsets=_segment_offsets(labels))
+    if workers != 1:
+        from obb_tree.parallel import build_obb_forest
+        tree = build_obb_forest(labels, max_depth=max_depth, min_pixels=min_pixels, workers=workers)
+        return tree, SegmentIndices(indices=no_indices, offsets=_segment_offsets(labels))
+    segments = group_indices_by_label(labels)
+    return build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels), segments
+
+
+def write_tree(tree, path):
+    np.savez(path, **{name: getattr(tree, name) for name in tree.__dataclass_fields__})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="obb-tree", description="Build OBB trees for directories of label images.")
+    parser.add_argument("inputs", nargs="+",
+                        help="label images (.npy or image files), directories of them, or - to read paths from stdin")
+    parser.add_argument("-o", "--output", default=".", help="directory the trees are written to")
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--min-pixels", type=int, default=10)
+    parser.add_argument("--boundary", action="store_true", help="build the trees from boundary pixels only")
+    parser.add_argument("--label", action="store_true",
+                        help="inputs are foreground masks, run a connected component analysis first")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes per image")
+    parser.add_argument("--store", metavar="FILE",
+                        help="append the label images and trees to one memory-mappable result file instead of writing "
+                             ".obb.npz files")
+    parser.add_argument("--prefetch", type=int, default=2, help="number of images loaded ahead of the processing")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    writer = None
+    if args.store is not None:
+        from obb_tree.storage import ResultWriter
+        writer = ResultWriter(os.path.join(args.output, args.store), append=True)
+        metadata = {"max_depth": args.max_depth, "min_pixels": args.min_pixels, "boundary": args.boundary}
+
+    # bounded two-stage pipeline: a reader thread loads the next images while the current one is processed, at most
+    # prefetch images are held in memory at any time
+    pipeline = queue.Queue(maxsize=max(1, args.prefetch))
+    reader = threading.Thread(target=_read_inputs, args=(iter_input_paths(args.inputs), pipeline, args.label),
+                              daemon=True)
+    reader.start()
+
+    failed = 0
+    # input path of every output name, inputs with the same file name in different directories would overwrite each
+    # other's results
+    names = {}
+    while True:
+        item = pipeline.get()
+        if item is _END:
+            break
+        path, labels, error = item
+        record = {"input": path}
+        name = os.path.splitext(os.path.basename(path))[0] if path is not None else None
+        if error is None and name in names:
+            error = FileExistsError(f"output name '{name}' was already used for {names[name]}")
+        if error is None:
+            names[name] = path
+            try:
+                t0 = time.perf_counter()
+                if args.boundary:
+                    # the stored label image holds the pixels the trees were built from, so that its regrouped
+                    # pixels match the stored offsets
+                    labels = boundary_pixels(labels)
+                tree, segments = process_labels(labels, args.max_depth, args.min_pixels, workers=args.workers)
+                if writer is not None:
+                    # the pixel indices can be regrouped from the stored label image, only the offsets are stored
+                    writer.write(tree, labels=labels, segments=segments, name=name, metadata=metadata,
+                                 store_indices=False)
+                    output = writer.path
+                else:
+                    output = os.path.join(args.output, name + ".obb.npz")
+                    write_tree(tree, output)
+                record.update(output=output, segments=int(np.count_nonzero(tree.parent == -1)), nodes=len(tree),
+                              seconds=round(time.perf_counter() - t0, 6))
+            except Exception as e:
+                error = e
+        if error is not None:
+            failed += 1
+            record["error"] = f"{type(error).__name__}: {error}"
+        labels = segments = None
+        print(json.dumps(record), flush=True)
+
+    if writer is not None:
+        writer.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
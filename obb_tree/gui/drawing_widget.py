@@ -1,4 +1,4 @@
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QRect, QRectF
 from PySide6.QtGui import QImage, QPainter, QPen
 from PySide6.QtWidgets import QWidget
 
@@ -14,6 +14,8 @@ class DrawingWidget(QWidget):
         self.brush_size = 5
         self.brush_color = Qt.black
         self.eraser_color = Qt.white
+        # image area changed since the last call of take_dirty_rect
+        self.dirty_rect = QRect()
 
     def paintEvent(self, event):
         painter = QPainter(self)
@@ -28,6 +30,7 @@ class DrawingWidget(QWidget):
         painter.drawImage((self.image.width() - scaled_image.width()) / 2,
                           (self.image.height() - scaled_image.height()) / 2, scaled_image)
         painter.end()
+        self.mark_dirty(self.image.rect())
         self.update()
 
     def mousePressEvent(self, event):
@@ -61,6 +64,7 @@ class DrawingWidget(QWidget):
         scaled_pos = pos * scaling_factor
         painter.drawPoint(scaled_pos)
         painter.end()
+        self._mark_stroke_dirty(scaled_pos, scaled_pos)
         self.update()
 
     def draw_line(self, p1, p2):
@@ -72,8 +76,26 @@ class DrawingWidget(QWidget):
 
         painter.drawLine(scaled_p1, scaled_p2)
         painter.end()
+        self._mark_stroke_dirty(scaled_p1, scaled_p2)
         self.update()
 
     def clear(self):
         self.image.fill(Qt.white)
+        self.mark_dirty(self.image.rect())
         self.update()
+
+    def _mark_stroke_dirty(self, p1, p2):
+        # the pen covers up to half its width around the stroke, one extra pixel covers the rounding to the grid
+        margin = self.brush_size / 2 + 1
+        self.mark_dirty(QRectF(p1, p2).normalized().adjusted(-margin, -margin, margin, margin).toAlignedRect())
+
+    def mark_dirty(self, rect):
+        self.dirty_rect = self.dirty_rect.united(rect).intersected(self.image.rect())
+
+    def take_dirty_rect(self):
+        """
+        Returns the image area changed since the last call and resets it. The rect is empty if nothing changed.
+        """
+        rect = self.dirty_rect
+        self.dirty_rect = QRect()
+        return rect
@@ -1,23 +1,29 @@
 import sys
 import numpy as np
+from contextlib import nullcontext
 
-from PySide6.QtCore import Qt, QPoint, QRect, QPointF
-from PySide6.QtGui import QImage, QPainter, QPen, QColor, QPixmap, QPolygonF
+from PySide6.QtCore import Qt, QThreadPool
+from PySide6.QtGui import QImage, QColor
 from PySide6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QSpinBox, \
-    QPushButton, QGraphicsPixmapItem, QGraphicsScene, QGraphicsPolygonItem, QCheckBox, QFormLayout
-from skimage import measure
+    QPushButton, QGraphicsScene, QCheckBox, QFormLayout, QProgressBar
 
 from obb_tree.gui.drawing_widget import DrawingWidget
+from obb_tree.gui.label_image_item import LabelImageItem
+from obb_tree.gui.obb_layer_item import OBBLayerItem
+from obb_tree.gui.worker import Job
 from obb_tree.gui.zoom_pan_graphicsview import ZoomableGraphicsView
-from obb_tree.obb import get_indices_for_segment, create_obb_tree
-from obb_tree.segment_count import count_pixels_per_segment
+from obb_tree.incremental import IncrementalForest, IncrementalLabeler
+from obb_tree.profiling import collect, stage
+
+# with level of detail enabled, a tree level is drawn once its typical box is at least this many screen pixels large
+MIN_BOX_PIXELS = 8
 
 
 class ResultScene(QGraphicsScene):
 
     def __init__(self, parent=None):
         super(ResultScene, self).__init__(parent)
-        self._obb_rects = []  # type: list[QGraphicsPixmapItem]
+        self._obb_layers = []  # type: list[OBBLayerItem]
         self._ccl_image_item = None
         self.colors = [
             QColor(0, 114, 189),  # Blue
@@ -33,38 +39,51 @@ class ResultScene(QGraphicsScene):
         ]
 
     def remove_obbs(self):
-        for item in self._obb_rects:
+        for item in self._obb_layers:
             self.removeItem(item)
-        self._obb_rects = []
-
-    def draw_obb(self, obb):
-        corners = obb.corners[:, ::-1]
-        corners = [QPointF(x[0], x[1]) for x in corners]
-        polygon = QPolygonF(corners)
-        polygon_item = QGraphicsPolygonItem(polygon)
-        depth = 0 if obb.depth is None else obb.depth
-        pen = QPen(self.colors[depth % len(self.colors)])
-        pen.setWidth(2)
-        pen.setCosmetic(True)
-        pen.setStyle(Qt.DotLine)
-        polygon_item.setPen(pen)
-
-        self.addItem(polygon_item)
-        self._obb_rects.append(polygon_item)
-
-    def draw_ccl_image(self, image, labels):
-        if self._ccl_image_item is not None:
-            self.removeItem(self._ccl_image_item)
-
-        component_image = QImage(image.size(), QImage.Format_RGB32)
-        component_image.fill(Qt.white)
-        painter = QPainter(component_image)
-        for i in range(image.width()):
-            for j in range(image.height()):
-                if labels[j, i] > 0:
-                    painter.fillRect(QRect(i, j, 1, 1), self.colors[(labels[j, i] - 1) % len(self.colors)])
-        painter.end()
-        self._ccl_image_item = self.addPixmap(QPixmap.fromImage(component_image))
+        self._obb_layers = []
+
+    def set_obbs(self, forest):
+        """
+        Replaces the drawn boxes by the nodes of a forest, one layer item per tree level.
+        """
+        self.remove_obbs()
+        for depth in range(forest.max_depth + 1):
+            # nodes are stored as (row, col), the scene uses (x, y)
+            corners = forest.corners[forest.level(depth)][:, :, ::-1]
+            layer = OBBLayerItem(corners, self.colors[depth % len(self.colors)])
+            self.addItem(layer)
+            self._obb_layers.append(layer)
+
+    def detail_depth(self, scale):
+        """
+        Deepest level whose boxes are at least MIN_BOX_PIXELS large on screen at the given view scale, the roots are
+        always drawn.
+        """
+        depth = 0
+        for level, layer in enumerate(self._obb_layers):
+            if layer.box_size * scale >= MIN_BOX_PIXELS:
+                depth = level
+        return depth
+
+    def show_obb_levels(self, level=None, scale=None):
+        """
+        Shows only the layer of the given level, or all layers if level is None. If the view scale is given, levels
+        below detail_depth(scale) are hidden, also a single selected level until the view is zoomed in far enough.
+        """
+        max_depth = len(self._obb_layers) if scale is None else self.detail_depth(scale)
+        for depth, layer in enumerate(self._obb_layers):
+            layer.setVisible(depth <= max_depth and (level is None or depth == level))
+
+    def draw_ccl_image(self, labels, region=None):
+        """
+        Draws the label image. If region (row start, row end, col start, col end) is given, only that part of the
+        previously drawn image is updated.
+        """
+        if self._ccl_image_item is None:
+            self._ccl_image_item = LabelImageItem(self.colors)
+            self.addItem(self._ccl_image_item)
+        self._ccl_image_item.set_labels(labels, region)
 
 
 class MainWindow(QMainWindow):
@@ -80,6 +99,14 @@ class MainWindow(QMainWindow):
         self.result_view.setScene(self.result_scene)
 
         self.ccl_result = None
+        self.forest = None
+        # labels and trees are updated for the edited parts of the drawing only
+        self.labeler = IncrementalLabeler()
+        self.forest_cache = IncrementalForest()
+        # labeling and tree building run on one worker thread, in the order they were requested
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self._obb_job = None
 
         self.brush_size_spinbox = QSpinBox()
         self.brush_size_spinbox.setRange(1, 30)
@@ -104,6 +131,9 @@ class MainWindow(QMainWindow):
         self.obbs_button = QPushButton("Oriented Bounding Boxes")
         self.obbs_button.clicked.connect(self.on_obbs_button_clicked)
 
+        self.boundary_only_checkbox = QCheckBox("Boundary pixels only")
+        self.boundary_only_checkbox.stateChanged.connect(self.on_obbs_button_clicked)
+
         recursion_depth_label = QLabel("Max OBB Tree Depth:")
         self.recursion_depth_spinbox = QSpinBox()
         self.recursion_depth_spinbox.setRange(0, 10)
@@ -114,18 +144,38 @@ class MainWindow(QMainWindow):
         self.draw_level_spinbox = QSpinBox()
         self.draw_level_spinbox.setRange(0, 10)
         self.draw_level_spinbox.setValue(2)
-        self.draw_level_spinbox.valueChanged.connect(self.on_obbs_button_clicked)
+        self.draw_level_spinbox.valueChanged.connect(self.draw_obbs)
+
+        # deeper levels appear while zooming in
+        self.level_of_detail_checkbox = QCheckBox("Level of detail from zoom")
+        self.level_of_detail_checkbox.setChecked(True)
+        self.level_of_detail_checkbox.stateChanged.connect(self.draw_obbs)
+        self.result_view.scale_changed.connect(self.draw_obbs)
 
         self.draw_all_obbs_checkbox = QCheckBox("Draw all OBBs")
         self.draw_all_obbs_checkbox.stateChanged.connect(self.on_draw_all_obbs_checkbox_stateChanged)
-        self.draw_all_obbs_checkbox.stateChanged.connect(self.on_obbs_button_clicked)
+        self.draw_all_obbs_checkbox.stateChanged.connect(self.draw_obbs)
         self.draw_all_obbs_checkbox.setChecked(True)
 
+        # statistics of the last labeling and build, drawn on top of the result view
+        self.stats_checkbox = QCheckBox("Show statistics")
+        self.stats_checkbox.toggled.connect(self.on_stats_checkbox_toggled)
+        self.stats_overlay = QLabel(self.result_view)
+        self.stats_overlay.setStyleSheet("background-color: rgba(255, 255, 255, 200); font-family: monospace;")
+        self.stats_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.stats_overlay.move(4, 4)
+        self.stats_overlay.hide()
+
         obbs_layout = QFormLayout()
-        obbs_layout.addRow(self.obbs_button)
+        hlayout = QHBoxLayout()
+        hlayout.addWidget(self.obbs_button)
+        hlayout.addWidget(self.boundary_only_checkbox)
+        obbs_layout.addRow(hlayout)
         obbs_layout.addRow(recursion_depth_label, self.recursion_depth_spinbox)
         obbs_layout.addRow(draw_level_label, self.draw_level_spinbox)
         obbs_layout.addRow(self.draw_all_obbs_checkbox)
+        obbs_layout.addRow(self.level_of_detail_checkbox)
+        obbs_layout.addRow(self.stats_checkbox)
 
         config_layout = QVBoxLayout()
         hlayout = QHBoxLayout()
@@ -153,6 +203,12 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(central_widget)
         self.setWindowTitle("OBB-Tree Visu Tool")
 
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
     def on_brush_size_changed(self, value):
         self.drawing_widget.brush_size = value
 
@@ -176,42 +232,137 @@ class MainWindow(QMainWindow):
             self.draw_level_spinbox.setEnabled(True)
 
     def on_obbs_button_clicked(self):
-        if self.ccl_result is None:
-            return
-        self.result_view.obb_rects = []
-        segment_counts, num_segments = count_pixels_per_segment(self.ccl_result.copy())
-        self.result_scene.remove_obbs()
-        draw_level = self.draw_level_spinbox.value()
-        draw_all_obbs = self.draw_all_obbs_checkbox.isChecked()
         max_depth = self.recursion_depth_spinbox.value()
-        for i in range(num_segments - 1):
-            indices = get_indices_for_segment(self.ccl_result, i + 1)
-            root, sub_trees = create_obb_tree(indices, max_depth=max_depth)
-
-            if draw_all_obbs or root.depth == draw_level:
-                self.result_scene.draw_obb(root)
-
-            def traverse_tree(tree):
-                if len(tree) > 0:
-                    for obb, sub_t in tree:
-                        depth = obb.depth
-                        if draw_all_obbs or depth == draw_level:
-                            self.result_scene.draw_obb(obb)
-                        traverse_tree(sub_t)
+        boundary_only = self.boundary_only_checkbox.isChecked()
+        collect_stats = self.stats_checkbox.isChecked()
+
+        def build(progress, cancel_event):
+            # runs on the worker thread, which owns the labeler and the forest cache
+            if self.labeler.labels is None:
+                return None
+            with collect() if collect_stats else nullcontext() as build_stats:
+                forest = self.forest_cache.update(self.labeler.labels, self.labeler.bboxes, max_depth=max_depth,
+                                                  boundary_only=boundary_only, progress=progress,
+                                                  cancel_event=cancel_event)
+            stats = self.forest_cache.cache.stats
+            return forest, (f"{self.forest_cache.last_segments} segments from {self.forest_cache.last_pixels} pixels "
+                            f"(cache: {stats.hits} hits, {stats.misses} misses, "
+                            f"{self.forest_cache.cache.nbytes >> 10} KiB)"), build_stats
+
+        # a newer request supersedes a running or queued build
+        if self._obb_job is not None:
+            self._obb_job.cancel()
+        self._obb_job = Job(build).connect(self.on_obbs_progress, self.on_obbs_finished, self.on_job_failed)
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.thread_pool.start(self._obb_job)
+
+    def on_obbs_progress(self, job, done, total, forest):
+        if job is not self._obb_job:
+            return
+        self.progress_bar.setValue(int(100 * done / total) if total > 0 else 100)
+        self.statusBar().showMessage(f"Building trees: {done}/{total} pixels, {job.elapsed:.2f} s")
+        # partial forests are drawn as they arrive
+        self.show_forest(forest)
 
-            traverse_tree(sub_trees)
+    def on_obbs_finished(self, job, result):
+        if job is not self._obb_job:
+            return
+        self._obb_job = None
+        self.progress_bar.hide()
+        if result is None:
+            return
+        forest, summary, stats = result
+        self.statusBar().showMessage(f"{len(forest)} nodes, {summary} in {job.elapsed * 1000:.1f} ms")
+        self.show_forest(forest)
+        self.show_stats("Tree building", job, stats)
+
+    def on_job_failed(self, job, message):
+        if job is self._obb_job:
+            self._obb_job = None
+        self.progress_bar.hide()
+        self.statusBar().showMessage(f"Failed: {message}")
+
+    def show_forest(self, forest):
+        self.forest = forest
+        self.result_scene.set_obbs(forest)
+        self.draw_obbs()
+
+    def draw_obbs(self):
+        # changing what is drawn never rebuilds the trees or the layers
+        draw_level = None if self.draw_all_obbs_checkbox.isChecked() else self.draw_level_spinbox.value()
+        scale = self.result_view.transform().m11() if self.level_of_detail_checkbox.isChecked() else None
+        self.result_scene.show_obb_levels(draw_level, scale)
+        if draw_level is not None and scale is not None and draw_level > self.result_scene.detail_depth(scale):
+            self.statusBar().showMessage(f"Level {draw_level} is too small to draw, zoom in to show it", 3000)
+
+    @staticmethod
+    def foreground_mask(image, rect):
+        # everything that is not white is foreground
+        gray_image = image.copy(rect).convertToFormat(QImage.Format_Grayscale8)
+        array = np.frombuffer(gray_image.bits(), dtype=np.uint8).reshape(
+            (gray_image.height(), gray_image.bytesPerLine()))
+        return array[:, :gray_image.width()] != 255
 
     def on_connected_component_button_clicked(self):
         image = self.drawing_widget.image
-        gray_image = QImage(image.size(), QImage.Format_Grayscale8)
-        painter = QPainter(gray_image)
-        painter.drawImage(QPoint(0, 0), image)
-        painter.end()
-
-        array = np.frombuffer(gray_image.bits(), dtype=np.uint8).reshape((image.height(), image.width()))
-        labels = measure.label(array, background=255, connectivity=2).astype(np.int32)
-        self.ccl_result = labels
-        self.result_scene.draw_ccl_image(self.drawing_widget.image, labels)
+        rect = self.drawing_widget.take_dirty_rect()
+        shape = (image.height(), image.width())
+        if self.ccl_result is None or self.ccl_result.shape != shape:
+            rect = image.rect()
+            window = None
+        elif rect.isEmpty():
+            return
+        else:
+            window = (rect.top(), rect.bottom() + 1, rect.left(), rect.right() + 1)
+        # the mask is read here, the drawing may change while the worker labels it
+        mask = self.foreground_mask(image, rect)
+
+        collect_stats = self.stats_checkbox.isChecked()
+
+        def label(progress, cancel_event):
+            with collect() if collect_stats else nullcontext() as stats, stage("labeling"):
+                if window is None or self.labeler.labels is None or self.labeler.labels.shape != shape:
+                    self.labeler.reset(mask)
+                    self.forest_cache.invalidate()
+                else:
+                    self.forest_cache.invalidate(self.labeler.update(mask, window))
+            r0, r1, c0, c1 = self.labeler.changed_region
+            # the GUI gets a copy of the relabeled part, the worker keeps updating its own label image
+            return self.labeler.changed_region, self.labeler.labels[r0:r1, c0:c1].copy(), shape, stats
+
+        # builds queued before the labeling would work on outdated labels
+        if self._obb_job is not None:
+            self._obb_job.cancel()
+            self._obb_job = None
+        # labeling jobs are never cancelled, each one consumes the dirty area of the drawing
+        self.thread_pool.start(Job(label).connect(on_finished=self.on_labels_finished, on_failed=self.on_job_failed))
+
+    def on_labels_finished(self, job, result):
+        region, patch, shape, stats = result
+        if self.ccl_result is None or self.ccl_result.shape != shape:
+            self.ccl_result = np.zeros(shape, dtype=patch.dtype)
+        r0, r1, c0, c1 = region
+        self.ccl_result[r0:r1, c0:c1] = patch
+        self.result_scene.draw_ccl_image(self.ccl_result, region)
+        self.statusBar().showMessage(f"Labeled {(r1 - r0) * (c1 - c0)} pixels in {job.elapsed * 1000:.1f} ms")
+        self.show_stats("Labeling", job, stats)
+
+    def on_stats_checkbox_toggled(self, checked):
+        self.stats_overlay.setVisible(checked and len(self.stats_overlay.text()) > 0)
+
+    def show_stats(self, title, job, stats):
+        if stats is None:
+            return
+        self.stats_overlay.setText(f"{title}: {job.elapsed * 1000:.1f} ms\n{stats.summary()}")
+        self.stats_overlay.adjustSize()
+        self.stats_overlay.setVisible(self.stats_checkbox.isChecked())
+
+    def closeEvent(self, event):
+        if self._obb_job is not None:
+            self._obb_job.cancel()
+        self.thread_pool.waitForDone()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
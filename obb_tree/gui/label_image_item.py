@@ -0,0 +1,69 @@
+import numpy as np
+
+from PySide6.QtCore import QRectF
+from PySide6.QtGui import QImage
+from PySide6.QtWidgets import QGraphicsItem
+
+WHITE = 0xFFFFFFFF
+
+
+def colorize_labels(labels, palette, out=None):
+    """
+    Maps a label image to RGB32 pixels: background white, label l gets palette[(l - 1) % len(palette)].
+    :param labels: Label image as numpy integer array.
+    :param palette: (n,) uint32 colours as returned by QColor.rgba().
+    :param out: Optional uint32 array of the shape of labels that receives the result.
+    :return: uint32 array of the shape of labels.
+    """
+    # a lookup table over all label values turns the colouring into a single indexing operation
+    num_labels = int(labels.max()) + 1 if labels.size > 0 else 1
+    lut = np.empty(num_labels, dtype=np.uint32)
+    lut[0] = WHITE
+    lut[1:] = np.resize(palette, num_labels - 1)
+    if out is None:
+        return np.take(lut, labels)
+    if out.flags.c_contiguous:
+        # all labels are covered by the table, clip mode lets take write into out without a temporary
+        return np.take(lut, labels, out=out, mode="clip")
+    # regions of the buffer are strided views
+    out[...] = np.take(lut, labels)
+    return out
+
+
+class LabelImageItem(QGraphicsItem):
+    """
+    Shows a label image in the colours of a palette. The pixels live in a numpy buffer that is reused across updates,
+    the QImage painted by the item wraps that buffer without copying it.
+    """
+
+    def __init__(self, colors, parent=None):
+        super().__init__(parent)
+        self.palette = np.array([color.rgba() for color in colors], dtype=np.uint32)
+        self._buffer = np.zeros((0, 0), dtype=np.uint32)
+        self._image = QImage()
+
+    def set_labels(self, labels, region=None):
+        """
+        Colours the label image. If region (row start, row end, col start, col end) is given, only that part of the
+        buffer is updated.
+        """
+        if self._buffer.shape != labels.shape:
+            self.prepareGeometryChange()
+            self._buffer = np.empty(labels.shape, dtype=np.uint32)
+            height, width = labels.shape
+            self._image = QImage(self._buffer.data, width, height, width * 4, QImage.Format_RGB32)
+            region = None
+
+        if region is None:
+            colorize_labels(labels, self.palette, out=self._buffer)
+            self.update()
+        else:
+            r0, r1, c0, c1 = region
+            colorize_labels(labels[r0:r1, c0:c1], self.palette, out=self._buffer[r0:r1, c0:c1])
+            self.update(QRectF(c0, r0, c1 - c0, r1 - r0))
+
+    def boundingRect(self):
+        return QRectF(0, 0, self._buffer.shape[1], self._buffer.shape[0])
+
+    def paint(self, painter, option, widget=None):
+        painter.drawImage(0, 0, self._image)
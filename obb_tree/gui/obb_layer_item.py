@@ -0,0 +1,140 @@
+import numpy as np
+
+from PySide6.QtCore import Qt, QByteArray, QDataStream, QIODevice, QRectF
+from PySide6.QtGui import QPen, QPolygonF
+from PySide6.QtWidgets import QGraphicsItem
+
+# the grid of a layer has at most GRID_CELLS cells per axis, boxes covering more than LARGE_BOX_CELLS cells are not
+# entered into the grid but tested against every exposed rectangle directly
+GRID_CELLS = 256
+LARGE_BOX_CELLS = 64
+
+
+def points_to_polygon(points):
+    """
+    Converts (N, 2) points into a QPolygonF without a Python loop: the points are written in the QDataStream format
+    of QPolygonF (big-endian uint32 count followed by big-endian double pairs) and read back in one call.
+    """
+    data = np.array([len(points)], dtype=">u4").tobytes() + np.ascontiguousarray(points, dtype=">f8").tobytes()
+    # the stream operates on the byte array, which has to outlive it
+    buffer = QByteArray(data)
+    stream = QDataStream(buffer, QIODevice.ReadOnly)
+    polygon = QPolygonF()
+    stream >> polygon
+    return polygon
+
+
+class BoxGrid:
+    """
+    Uniform grid over the axis-aligned bounds of boxes. Each box is entered into every cell its bounds overlap, the
+    entries are stored sorted by cell (row-major), so the entries of a row of cells are one contiguous slice.
+    """
+
+    def __init__(self, lower, upper):
+        """
+        :param lower: (K, 2) minimum x, y of the boxes.
+        :param upper: (K, 2) maximum x, y of the boxes.
+        """
+        self.lower = lower
+        self.upper = upper
+        self.origin = lower.min(axis=0)
+        extent = upper.max(axis=0) - self.origin
+        # cells about the size of a typical box, but not more than GRID_CELLS per axis
+        box_size = np.median((upper - lower).max(axis=1))
+        self.cell_size = max(float(box_size), float(extent.max()) / GRID_CELLS, 1.0)
+        self.shape = (np.floor(extent / self.cell_size).astype(np.int64) + 1)[::-1]  # rows (y), cols (x)
+
+        first = self._cell(lower)
+        last = self._cell(upper)
+        spans = last - first + 1
+        cells = spans[:, 0] * spans[:, 1]
+        small = cells <= LARGE_BOX_CELLS
+        self.large = np.flatnonzero(~small)
+
+        # one entry per (box, cell) pair of the small boxes
+        boxes = np.flatnonzero(small)
+        boxes = np.repeat(boxes, cells[boxes])
+        within = np.arange(len(boxes)) - np.repeat(np.cumsum(cells[small]) - cells[small], cells[small])
+        x = first[boxes, 0] + within % spans[boxes, 0]
+        y = first[boxes, 1] + within // spans[boxes, 0]
+        cell = y * self.shape[1] + x
+        order = np.argsort(cell, kind="stable")
+        self.entries = boxes[order]
+        self.offsets = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.shape[0] * self.shape[1]), out=self.offsets[1:])
+
+    def _cell(self, points):
+        cells = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.shape[::-1] - 1)
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """
+        :return: sorted indices of all boxes whose bounds overlap the rectangle.
+        """
+        (x0, y0), (x1, y1) = self._cell(np.array([[min_x, min_y], [max_x, max_y]]))
+        row = self.shape[1]
+        pieces = [self.entries[self.offsets[y * row + x0]:self.offsets[y * row + x1 + 1]] for y in range(y0, y1 + 1)]
+        candidates = np.unique(np.concatenate(pieces + [self.large]))
+        lower, upper = self.lower[candidates], self.upper[candidates]
+        overlap = ((lower[:, 0] <= max_x) & (upper[:, 0] >= min_x) & (lower[:, 1] <= max_y) & (upper[:, 1] >= min_y))
+        return candidates[overlap]
+
+
+class OBBLayerItem(QGraphicsItem):
+    """
+    Draws all boxes of one tree level. The edges of all boxes are collected into one list of end point pairs when the
+    layer is created, so painting the whole layer is one drawLines call regardless of the number of boxes. When only a
+    part of the layer is exposed, the boxes in it are looked up in a grid and only their edges are drawn, so the cost
+    of a frame depends on what is visible instead of the size of the layer.
+    """
+
+    def __init__(self, corners, color, parent=None):
+        """
+        :param corners: (K, 4, 2) box corners in (x, y) scene coordinates.
+        :param color: QColor of the outlines.
+        """
+        super().__init__(parent)
+        self.pen = QPen(color)
+        self.pen.setWidth(2)
+        self.pen.setCosmetic(True)
+        self.pen.setStyle(Qt.DotLine)
+        # paint() needs the exposed rectangle
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+        # start and end point of the four edges of every box
+        self.edges = np.stack([corners, np.roll(corners, -1, axis=1)], axis=2).reshape(-1, 8, 2)
+        self.lines = points_to_polygon(self.edges.reshape(-1, 2))
+
+        if len(corners) > 0:
+            lower, upper = corners.min(axis=1), corners.max(axis=1)
+            (min_x, min_y), (max_x, max_y) = lower.min(axis=0), upper.max(axis=0)
+            # the cosmetic pen reaches one pixel outside the boxes, the view never zooms out far enough for that pixel
+            # to exceed two scene units
+            self._bounding_rect = QRectF(min_x, min_y, max_x - min_x, max_y - min_y).adjusted(-2, -2, 2, 2)
+            self.grid = BoxGrid(lower, upper)
+            # typical edge length of the boxes, used to decide whether they are large enough on screen
+            self.box_size = float(np.median((upper - lower).max(axis=1)))
+        else:
+            self._bounding_rect = QRectF()
+            self.grid = None
+            self.box_size = 0.0
+
+    def boundingRect(self):
+        return self._bounding_rect
+
+    def visible_boxes(self, rect):
+        """
+        Indices of the boxes that overlap rect (item coordinates), including the width of the pen.
+        """
+        rect = rect.adjusted(-2, -2, 2, 2)
+        return self.grid.query(rect.left(), rect.top(), rect.right(), rect.bottom())
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(self.pen)
+        exposed = option.exposedRect
+        if self.grid is None or exposed.contains(self._bounding_rect):
+            painter.drawLines(self.lines)
+            return
+        boxes = self.visible_boxes(exposed)
+        if len(boxes) > 0:
+            painter.drawLines(points_to_polygon(self.edges[boxes].reshape(-1, 2)))
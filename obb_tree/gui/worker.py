@@ -0,0 +1,56 @@
+import threading
+import time
+
+from PySide6.QtCore import QObject, QRunnable, Qt, Signal
+
+
+class JobSignals(QObject):
+    progress = Signal(object, int, int, object)  # job, done, total, partial result
+    finished = Signal(object, object)  # job, result
+    failed = Signal(object, str)  # job, error message
+
+
+class Job(QRunnable):
+    """
+    Runs fn(progress, cancel_event) on a thread pool thread. fn may report progress by calling
+    progress(done, total, partial_result) and should return early once cancel_event is set. The signals are delivered
+    in the thread that created the job, i.e. the GUI thread.
+    """
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = JobSignals()
+        self.cancel_event = threading.Event()
+        self.started = time.perf_counter()
+
+    def connect(self, on_progress=None, on_finished=None, on_failed=None):
+        for signal, slot in ((self.signals.progress, on_progress), (self.signals.finished, on_finished),
+                             (self.signals.failed, on_failed)):
+            if slot is not None:
+                signal.connect(slot, Qt.QueuedConnection)
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def run(self):
+        if self.cancelled:
+            return
+        self.started = time.perf_counter()
+        try:
+            result = self.fn(lambda done, total, partial: self.signals.progress.emit(self, done, total, partial),
+                             self.cancel_event)
+        except Exception as e:
+            self.signals.failed.emit(self, f"{type(e).__name__}: {e}")
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(self, result)
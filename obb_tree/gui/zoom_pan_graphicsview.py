@@ -1,9 +1,12 @@
-from PySide6.QtCore import QPointF, Qt
+from PySide6.QtCore import QPointF, Qt, Signal
 from PySide6.QtGui import QPainter
 from PySide6.QtWidgets import QGraphicsView
 
 
 class ZoomableGraphicsView(QGraphicsView):
+    # emitted with the new scale after zooming, e.g. to choose the level of detail drawn
+    scale_changed = Signal(float)
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -34,6 +37,7 @@ class ZoomableGraphicsView(QGraphicsView):
             # Zoom out
             if self.transform().m11() > zoom_out_limit:
                 self.scale(1 / zoom_factor, 1 / zoom_factor)
+        self.scale_changed.emit(self.transform().m11())
 
     def mousePressEvent(self, event):
         # Start panning the view when the left mouse button is pressed
@@ -0,0 +1,110 @@
+import numpy as np
+
+from obb_tree.obb import OBB
+
+
+def convex_hull(indices):
+    """
+    Convex hull of pixel indices (pixel centres) with Andrew's monotone chain. Only the first and last pixel of every
+    row can be a hull vertex, so the chain runs over at most two candidates per row.
+    :param indices: (N, 2) pixel indices, N > 0.
+    :return: (H, 2) hull vertices in counter-clockwise order (in index coordinates), collinear points removed.
+    """
+    points = np.asarray(indices)
+    rows, cols = points[:, 0], points[:, 1]
+    # indices from group_indices_by_label and their sub parts are already in row-major order
+    if not np.all((rows[1:] > rows[:-1]) | ((rows[1:] == rows[:-1]) & (cols[1:] > cols[:-1]))):
+        points = np.unique(points, axis=0)
+        rows, cols = points[:, 0], points[:, 1]
+
+    row_start = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    row_end = np.r_[row_start[1:], len(points)] - 1
+    candidates = points[np.unique(np.concatenate([row_start, row_end]))].tolist()
+    if len(candidates) <= 2:
+        return np.array(candidates, dtype=np.float64)
+
+    def half_hull(points):
+        chain = []
+        for p in points:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1]) -
+                                       (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append(p)
+        return chain
+
+    lower = half_hull(candidates)
+    upper = half_hull(reversed(candidates))
+    return np.array(lower[:-1] + upper[:-1], dtype=np.float64)
+
+
+def clip_hull(hull, point, direction, offset, keep_positive):
+    """
+    Clips a convex polygon at a line. Used to derive the hulls of the two parts of a split from the hull of the node.
+    The result contains the hull of the points of the part. For convex segments it is only slightly larger near the
+    line, for concave segments it can also span gaps that the part does not cover.
+    :param hull: (H, 2) convex polygon.
+    :param point: a point on the cutting line.
+    :param direction: direction of the cutting line.
+    :param offset: the line is where cross(p - point, direction) == offset.
+    :param keep_positive: keep the part with cross(p - point, direction) >= offset if True, the other part otherwise.
+    :return: (H', 2) clipped convex polygon.
+    """
+    diffs = hull - point
+    side = diffs[:, 0] * direction[1] - diffs[:, 1] * direction[0] - offset
+    if not keep_positive:
+        side = -side
+    inside = side >= 0
+    if np.all(inside):
+        return hull
+
+    next_hull = np.roll(hull, -1, axis=0)
+    next_side = np.roll(side, -1)
+    crossing = ((side > 0) & (next_side < 0)) | ((side < 0) & (next_side > 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(crossing, side / (side - next_side), 0.0)
+    intersections = hull + t[:, None] * (next_hull - hull)
+
+    # walk the polygon, emitting every kept vertex followed by the intersection on its outgoing edge
+    vertices = np.stack([hull, intersections], axis=1)
+    keep = np.stack([inside, crossing], axis=1)
+    return vertices[keep]
+
+
+def box_from_hull(hull, centroid, cos, sin):
+    """
+    Oriented bounding box with the given orientation whose extents are evaluated over the hull vertices only.
+    Equals the box over all points if hull is the exact convex hull of the points.
+    """
+    rotation_matrix = np.array([[cos, sin],
+                                [-sin, cos]])
+    rotated_hull = np.dot(hull - centroid, rotation_matrix.T)
+    min_x, min_y = np.min(rotated_hull, axis=0)
+    max_x, max_y = np.max(rotated_hull, axis=0)
+
+    corners = np.array([[min_x, min_y],
+                        [max_x, min_y],
+                        [max_x, max_y],
+                        [min_x, max_y]])
+    translated_corners = np.dot(corners, rotation_matrix) + centroid
+    return OBB(corners=translated_corners, width=max_y - min_y, height=max_x - min_x, depth=None)
+
+
+def minimum_area_box(hull):
+    """
+    Minimum-area bounding box of a convex polygon (rotating calipers). The optimal box has one side collinear with a
+    hull edge, so all edge directions are evaluated at once.
+    :param hull: (H, 2) convex polygon, H > 0.
+    :return: OBB with the same corner convention as oriented_bounding_box_py.
+    """
+    edges = np.roll(hull, -1, axis=0) - hull
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    if len(hull) < 2 or np.all(lengths == 0):
+        return box_from_hull(hull, hull[0], 1.0, 0.0)
+    edges = edges[lengths > 0] / lengths[lengths > 0, None]
+
+    # extents of all hull vertices along every edge direction and its normal
+    along = np.dot(edges, hull.T)
+    across = edges[:, 0, None] * hull[None, :, 1] - edges[:, 1, None] * hull[None, :, 0]
+    areas = (along.max(axis=1) - along.min(axis=1)) * (across.max(axis=1) - across.min(axis=1))
+    cos, sin = edges[np.argmin(areas)]
+    return box_from_hull(hull, hull[0], cos, sin)
@@ -0,0 +1,179 @@
+import numpy as np
+from scipy import ndimage
+
+from obb_tree.cache import TreeCache
+from obb_tree.obb import SegmentIndices, boundary_pixels, group_indices_by_label
+from obb_tree.parallel import chunk_labels
+from obb_tree.tree import OBBTree
+
+
+def _label(mask, connectivity):
+    from skimage import measure
+    return measure.label(mask, background=0, connectivity=connectivity).astype(np.int32)
+
+
+class IncrementalLabeler:
+    """
+    Keeps the connected component labels of a foreground mask up to date with local edits. Only the edited window and
+    the segments touching it are labeled again, all other labels stay untouched. Segments keep their label as long as
+    they exist, labels of removed segments are reused for new ones.
+    """
+
+    def __init__(self, connectivity=2):
+        self.connectivity = connectivity
+        self.labels = None  # (H, W) int32 label image
+        self.bboxes = np.zeros((1, 4), dtype=np.int64)  # (L, 4) row start, row end, col start, col end per label
+        self.changed_region = None  # (row start, row end, col start, col end) relabeled by the last update
+
+    def reset(self, mask):
+        """
+        Labels the whole mask from scratch.
+        :return: all labels.
+        """
+        self.labels = _label(mask, self.connectivity)
+        self.bboxes = np.zeros((int(self.labels.max()) + 1, 4), dtype=np.int64)
+        self._set_bboxes(self.labels, np.arange(len(self.bboxes)), 0, 0)
+        self.changed_region = (0, self.labels.shape[0], 0, self.labels.shape[1])
+        return np.arange(1, len(self.bboxes))
+
+    def update(self, mask, window):
+        """
+        Applies an edit of the mask inside a window.
+        :param mask: Boolean foreground mask of the window.
+        :param window: (row start, row end, col start, col end) of the window in the image.
+        :return: labels whose set of pixels changed, including labels that no longer exist.
+        """
+        r0, r1, c0, c1 = window
+        rows, cols = self.labels.shape
+        # pixels just outside the window can connect segments through the edit
+        g0, g1, h0, h1 = max(r0 - 1, 0), min(r1 + 1, rows), max(c0 - 1, 0), min(c1 + 1, cols)
+        affected = np.unique(self.labels[g0:g1, h0:h1])
+        affected = affected[affected > 0]
+
+        # region holding all pixels of the affected segments and of the edit
+        boxes = np.vstack([self.bboxes[affected], [[g0, g1, h0, h1]]])
+        s0, s1 = boxes[:, 0].min(), boxes[:, 1].max()
+        t0, t1 = boxes[:, 2].min(), boxes[:, 3].max()
+        old = self.labels[s0:s1, t0:t1]
+
+        # unchanged pixels keep their foreground state, other segments in the region are left out
+        in_affected = np.isin(old, affected)
+        region_mask = in_affected.copy()
+        region_mask[r0 - s0:r1 - s0, c0 - t0:c1 - t0] = mask
+        new = _label(region_mask, self.connectivity)
+
+        # components inherit the label of the old segment they overlap most, the others get free labels
+        mapping = np.zeros(int(new.max()) + 1, dtype=np.int32)
+        both = (new > 0) & (old > 0)
+        pairs, overlaps = np.unique(np.stack([new[both], old[both]]), axis=1, return_counts=True)
+        used = set()
+        for k in np.argsort(-overlaps, kind="stable"):
+            component, label = pairs[:, k]
+            if mapping[component] == 0 and label not in used:
+                mapping[component] = label
+                used.add(label)
+        free = sorted(set(affected.tolist()) - used)
+        free += list(range(len(self.bboxes), len(self.bboxes) + len(mapping)))
+        unassigned = np.flatnonzero(mapping == 0)[1:]
+        mapping[unassigned] = free[:len(unassigned)]
+
+        merged = np.where(region_mask, mapping[new], np.where(in_affected, 0, old))
+        changed = np.unique(np.concatenate([old[merged != old], merged[merged != old]]))
+        self.labels[s0:s1, t0:t1] = merged
+        self.changed_region = (int(s0), int(s1), int(t0), int(t1))
+
+        num_labels = max(len(self.bboxes), int(mapping.max()) + 1)
+        if num_labels > len(self.bboxes):
+            self.bboxes = np.vstack([self.bboxes, np.zeros((num_labels - len(self.bboxes), 4), dtype=np.int64)])
+        self.bboxes[affected] = 0
+        self._set_bboxes(new, mapping, s0, t0)
+        return changed[changed > 0]
+
+    def _set_bboxes(self, components, label_ids, row_offset, col_offset):
+        # boxes of the components of a region image, stored for the labels the components were mapped to
+        for label, box in zip(label_ids[1:], ndimage.find_objects(components)):
+            if box is not None:
+                self.bboxes[label] = (box[0].start + row_offset, box[0].stop + row_offset,
+                                      box[1].start + col_offset, box[1].stop + col_offset)
+
+
+class IncrementalForest:
+    """
+    OBB forest of a label image that is updated segment-wise. Trees of segments whose pixels did not change are kept,
+    the trees of changed segments are taken from a TreeCache, which builds them from the pixels inside their bounding
+    boxes if it does not hold them yet.
+    """
+
+    def __init__(self, cache=None):
+        self.forest = OBBTree.empty()
+        self.cache = cache if cache is not None else TreeCache()
+        self.last_pixels = 0  # number of pixels the last update looked up trees for
+        self.last_segments = 0  # number of segments the last update looked up trees for
+        self._params = None
+        self._dirty = np.zeros(0, dtype=np.int64)
+
+    def invalidate(self, labels=None):
+        """
+        Marks the trees of the given labels as outdated, or all trees if labels is None.
+        """
+        if labels is None:
+            self._params = None
+        else:
+            self._dirty = np.union1d(self._dirty, labels)
+
+    def update(self, labels, bboxes, max_depth=3, min_pixels=10, boundary_only=False, progress=None,
+               cancel_event=None, chunks=8):
+        """
+        Rebuilds the outdated trees.
+        :param labels: Current label image.
+        :param bboxes: (L, 4) bounding box of every label, see IncrementalLabeler.
+        :param progress: Optional callback progress(done, total, forest) called after every chunk of segments with the
+         number of pixels processed so far and the forest of the trees available so far.
+        :param cancel_event: Optional threading.Event. If it is set between two chunks, the update stops and returns
+         None; the forest is left as before and the outdated trees stay marked.
+        :param chunks: Number of chunks the segments are split into for progress reports and cancellation.
+        :return: OBBTree of all segments, the trees are not ordered by label. None if the update was cancelled.
+        """
+        params = (max_depth, min_pixels, boundary_only)
+        if params != self._params:
+            segments = group_indices_by_label(boundary_pixels(labels) if boundary_only else labels)
+            kept = OBBTree.empty()
+        else:
+            dirty = self._dirty[(self._dirty > 0) & (self._dirty < len(bboxes))]
+            segments = self._crop_segments(labels, bboxes, dirty, boundary_only)
+            kept = self.forest.select(~np.isin(self.forest.segment, self._dirty))
+
+        total = len(segments.indices)
+        pieces = [kept]
+        for lo, hi in chunk_labels(segments, max(-(-total // chunks), 1)):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            pieces.append(self.cache.get_forest(segments, max_depth=max_depth, min_pixels=min_pixels,
+                                                labels=np.arange(lo, hi)))
+            if progress is not None:
+                progress(int(segments.offsets[hi]), total, OBBTree.concatenate(pieces))
+
+        self.forest = OBBTree.concatenate(pieces)
+        self.last_pixels, self.last_segments = total, len(segments.labels())
+        self._params = params
+        self._dirty = np.zeros(0, dtype=np.int64)
+        return self.forest
+
+    @staticmethod
+    def _crop_segments(labels, bboxes, dirty, boundary_only):
+        # pixels of the given labels, read from their bounding boxes only
+        pieces = []
+        for label in dirty:
+            r0, r1, c0, c1 = bboxes[label]
+            crop = labels[r0:r1, c0:c1]
+            if boundary_only:
+                # outside its bounding box no pixel belongs to the segment, so the crop yields the same boundary
+                crop = boundary_pixels(crop)
+            pieces.append(np.argwhere(crop == label) + [r0, c0])
+        counts = np.zeros(int(dirty.max()) + 1 if len(dirty) > 0 else 1, dtype=np.int64)
+        counts[dirty] = [len(piece) for piece in pieces]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # dirty is sorted, so the pieces are in label order like the offsets
+        indices = np.concatenate(pieces) if len(pieces) > 0 else np.zeros((0, 2), dtype=np.int64)
+        return SegmentIndices(indices=indices, offsets=offsets)
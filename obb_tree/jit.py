@@ -0,0 +1,276 @@
+import numpy as np
+
+from obb_tree.obb import CUT_TOLERANCE, OBB
+
+# Compiled kernels for fitting and splitting boxes. The kernels are plain loops over the pixels of one node, written so
+# that numba compiles them to machine code, which removes the dispatch overhead of the many small NumPy calls per node.
+# Without numba the same functions run as (slow) Python, the NumPy implementations stay the default then.
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+BACKENDS = ("numpy", "numba")
+_default_backend = None
+
+# LAPACK treats off-diagonal entries below this relative threshold as zero, see principal_axes
+_EPSNEG = float(np.finfo(np.float64).epsneg)
+
+
+def _njit(fn):
+    if NUMBA_AVAILABLE:
+        return numba.njit(cache=True, nogil=True)(fn)
+    return fn
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != "numba" or NUMBA_AVAILABLE]
+
+
+def set_default_backend(name):
+    """
+    Overrides the automatic backend selection of build_obb_trees. Pass None to return to automatic selection.
+    """
+    global _default_backend
+    if name is not None and name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Known backends: {list(BACKENDS)}")
+    _default_backend = name
+
+
+def get_backend(name=None):
+    """
+    Returns the name of the backend that is used for the given request. An explicitly requested backend takes
+    precedence over the default set with set_default_backend, which takes precedence over the automatic selection
+    (numba if it is installed).
+    """
+    name = name if name is not None else _default_backend
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown backend '{name}'. Known backends: {list(BACKENDS)}")
+        if name == "numba" and not NUMBA_AVAILABLE:
+            raise RuntimeError("Backend 'numba' is not available, install numba to use it.")
+        return name
+    return available_backends()[-1]
+
+
+@_njit
+def _fit_node(points, start, count, corners, width, height, node):
+    # the arithmetic follows principal_axes and _fit_boxes operation by operation, so the boxes are the same
+    if count == 1:
+        x, y = points[start, 0], points[start, 1]
+        corners[node, 0, 0], corners[node, 0, 1] = x - 0.5, y - 0.5
+        corners[node, 1, 0], corners[node, 1, 1] = x + 0.5, y - 0.5
+        corners[node, 2, 0], corners[node, 2, 1] = x + 0.5, y + 0.5
+        corners[node, 3, 0], corners[node, 3, 1] = x - 0.5, y + 0.5
+        width[node] = 1.0
+        height[node] = 1.0
+        return
+
+    # raw moments, exact in int64
+    n = np.int64(count)
+    sx = np.int64(0)
+    sy = np.int64(0)
+    sxx = np.int64(0)
+    sxy = np.int64(0)
+    syy = np.int64(0)
+    for i in range(start, start + count):
+        x = np.int64(points[i, 0])
+        y = np.int64(points[i, 1])
+        sx += x
+        sy += y
+        sxx += x * x
+        sxy += x * y
+        syy += y * y
+
+    # covariance matrix [[a, b], [b, c]] scaled by n
+    if float(n) * max(sxx, syy) < 2.0 ** 62:
+        a = float(n * sxx - sx * sx)
+        b = float(n * sxy - sx * sy)
+        c = float(n * syy - sy * sy)
+    else:
+        fn, fx, fy = float(n), float(sx), float(sy)
+        a = fn * float(sxx) - fx * fx
+        b = fn * float(sxy) - fx * fy
+        c = fn * float(syy) - fy * fy
+    center_x = sx / n
+    center_y = sy / n
+    if abs(b) <= np.sqrt(abs(a)) * np.sqrt(abs(c)) * _EPSNEG:
+        b = 0.0
+
+    # eigenvector of the largest eigenvalue from the half-angle formulas, with the sign convention of np.linalg.eigh
+    half_diff = (a - c) / 2
+    radius = np.hypot(half_diff, b)
+    cos_2theta = half_diff / radius if radius > 0 else -1.0
+    cos = np.sqrt(max(1 + cos_2theta, 0.0) / 2)
+    sin = np.sqrt(max(1 - cos_2theta, 0.0) / 2)
+    if b < 0:
+        sin = -sin
+    if b < 0 or (b > 0 and a > c):
+        cos = -cos
+        sin = -sin
+
+    # extents in the rotated frame
+    min_x = np.inf
+    max_x = -np.inf
+    min_y = np.inf
+    max_y = -np.inf
+    for i in range(start, start + count):
+        dx = points[i, 0] - center_x
+        dy = points[i, 1] - center_y
+        rotated_x = cos * dx + sin * dy
+        rotated_y = cos * dy - sin * dx
+        min_x = min(min_x, rotated_x)
+        max_x = max(max_x, rotated_x)
+        min_y = min(min_y, rotated_y)
+        max_y = max(max_y, rotated_y)
+
+    local_x = (min_x, max_x, max_x, min_x)
+    local_y = (min_y, min_y, max_y, max_y)
+    for k in range(4):
+        corners[node, k, 0] = cos * local_x[k] - sin * local_y[k] + center_x
+        corners[node, k, 1] = sin * local_x[k] + cos * local_y[k] + center_y
+    width[node] = max_y - min_y
+    height[node] = max_x - min_x
+
+
+@_njit
+def _split_node(points, start, count, corners, node):
+    # in-place partition of the points of a node at the cut line of create_sub_parts like in quicksort, points of the
+    # second part (points on the line included) at the front are swapped with points of the first part at the back
+    # :return: number of points of the first part
+    l1x = corners[node, 1, 0] - corners[node, 0, 0]
+    l1y = corners[node, 1, 1] - corners[node, 0, 1]
+    l2x = corners[node, 2, 0] - corners[node, 1, 0]
+    l2y = corners[node, 2, 1] - corners[node, 1, 1]
+    length1 = l1x * l1x + l1y * l1y
+    length2 = l2x * l2x + l2y * l2y
+    if length1 > (1 + CUT_TOLERANCE) * length2:
+        intersection_x = (corners[node, 0, 0] + corners[node, 1, 0]) / 2
+        intersection_y = (corners[node, 0, 1] + corners[node, 1, 1]) / 2
+        direction_x = corners[node, 2, 0] - corners[node, 1, 0]
+        direction_y = corners[node, 2, 1] - corners[node, 1, 1]
+    else:
+        intersection_x = (corners[node, 1, 0] + corners[node, 2, 0]) / 2
+        intersection_y = (corners[node, 1, 1] + corners[node, 2, 1]) / 2
+        direction_x = corners[node, 3, 0] - corners[node, 2, 0]
+        direction_y = corners[node, 3, 1] - corners[node, 2, 1]
+    tolerance = CUT_TOLERANCE * (length1 + length2)
+
+    first = start
+    last = start + count - 1
+    while True:
+        while first <= last and ((points[first, 0] - intersection_x) * direction_y
+                                 - (points[first, 1] - intersection_y) * direction_x) > tolerance:
+            first += 1
+        while first < last and ((points[last, 0] - intersection_x) * direction_y
+                                - (points[last, 1] - intersection_y) * direction_x) <= tolerance:
+            last -= 1
+        if first >= last:
+            return first - start
+        for k in range(2):
+            points[first, k], points[last, k] = points[last, k], points[first, k]
+        first += 1
+        last -= 1
+
+
+@_njit
+def _grow(array, size):
+    grown = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+@_njit
+def _build_forest(points, counts, max_depth, min_pixels):
+    # Breadth-first build of the trees of several roots. Nodes are processed in the order they are created, which is
+    # level order with the children of a node contiguous, the same order as the level-synchronous builder. The points
+    # of every node are a range of points, which is partitioned in place when the node is split.
+    capacity = 2 * len(counts) + 16
+    corners = np.empty((capacity, 4, 2))
+    width = np.empty(capacity)
+    height = np.empty(capacity)
+    depth = np.empty(capacity, dtype=np.int32)
+    parent = np.empty(capacity, dtype=np.int32)
+    first_child = np.empty(capacity, dtype=np.int32)
+    child_count = np.empty(capacity, dtype=np.int32)
+    root = np.empty(capacity, dtype=np.int32)
+    start = np.empty(capacity, dtype=np.int64)
+    count = np.empty(capacity, dtype=np.int64)
+
+    offset = 0
+    for i in range(len(counts)):
+        depth[i], parent[i], root[i], start[i], count[i] = 0, -1, i, offset, counts[i]
+        offset += counts[i]
+    num_nodes = len(counts)
+
+    node = 0
+    while node < num_nodes:
+        _fit_node(points, start[node], count[node], corners, width, height, node)
+        first_child[node] = -1
+        child_count[node] = 0
+        if count[node] >= min_pixels and depth[node] < max_depth:
+            num_first = _split_node(points, start[node], count[node], corners, node)
+            if num_nodes + 2 > capacity:
+                capacity *= 2
+                corners, width, height = _grow(corners, capacity), _grow(width, capacity), _grow(height, capacity)
+                depth, parent = _grow(depth, capacity), _grow(parent, capacity)
+                first_child = _grow(first_child, capacity)
+                child_count, root = _grow(child_count, capacity), _grow(root, capacity)
+                start, count = _grow(start, capacity), _grow(count, capacity)
+            first_child[node] = num_nodes
+            # empty parts do not become nodes
+            for part_start, part_count in ((start[node], num_first),
+                                           (start[node] + num_first, count[node] - num_first)):
+                if part_count > 0:
+                    depth[num_nodes], parent[num_nodes], root[num_nodes] = depth[node] + 1, node, root[node]
+                    start[num_nodes], count[num_nodes] = part_start, part_count
+                    num_nodes += 1
+                    child_count[node] += 1
+        node += 1
+
+    return (corners[:num_nodes], width[:num_nodes], height[:num_nodes], depth[:num_nodes], parent[:num_nodes],
+            first_child[:num_nodes], child_count[:num_nodes], root[:num_nodes], count[:num_nodes])
+
+
+def build_forest(points, counts, segments, max_depth, min_pixels):
+    """
+    Compiled counterpart of the level-synchronous builder, the whole build of all trees runs in one call.
+    :param points: (P, 2) integer pixel indices, the points of each root are contiguous. Not modified.
+    :param counts: (K,) number of points of each root, all counts are > 0.
+    :param segments: (K,) segment label of each root.
+    :return: OBBTree holding all trees as one forest in level order.
+    """
+    from obb_tree.builder import _compact_dtype
+    from obb_tree.tree import OBBTree
+
+    if len(counts) == 0:
+        return OBBTree.empty()
+    # the nodes are partitioned in place in one copy of the points, of the smallest dtype that holds them
+    points = np.array(points, dtype=_compact_dtype(points), order="C")
+    corners, width, height, depth, parent, first_child, child_count, root, count = _build_forest(
+        points, np.asarray(counts, dtype=np.int64), int(max_depth), int(min_pixels))
+    return OBBTree(corners=corners, width=width, height=height, depth=depth, parent=parent, first_child=first_child,
+                   child_count=child_count, segment=np.asarray(segments, dtype=np.int32)[root], count=count)
+
+
+def oriented_bounding_box_jit(indices):
+    """
+    Compiled counterpart of oriented_bounding_box_py for integer pixel indices.
+    """
+    corners = np.empty((1, 4, 2))
+    width = np.empty(1)
+    height = np.empty(1)
+    _fit_node(np.ascontiguousarray(indices, dtype=np.int64), 0, len(indices), corners, width, height, 0)
+    return OBB(corners=corners[0], width=width[0], height=height[0], depth=None)
+
+
+def create_sub_parts_jit(indices, corners):
+    """
+    Compiled counterpart of create_sub_parts for integer pixel indices. The parts hold the same points, but not in
+    the order of indices.
+    """
+    points = np.array(indices, dtype=np.int64, order="C")
+    num_first = _split_node(points, 0, len(points), np.asarray(corners, dtype=np.float64)[None], 0)
+    return points[:num_first], points[num_first:]
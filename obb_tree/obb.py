@@ -1,11 +1,17 @@
-import matplotlib
-
-matplotlib.use('TkAgg')
 import numpy as np
-from matplotlib.path import Path
 from dataclasses import dataclass
 from typing import Optional
 
+from obb_tree.profiling import active, profiled, stage
+
+
+# Relative tolerance below which a point counts as lying on the line that cuts a box in half. This deliberately
+# changes how boxes are split compared to the original `cross > 0` rule: pixels on the cut line (the middle row or
+# column of a box with an odd number of pixels) always go to the second part, and near-square boxes are always cut at
+# their second side. Without the tolerance both decisions depend on rounding errors of the fitted corners, so they
+# changed with the position of a segment and differed between the recursive, batched and jit builders.
+CUT_TOLERANCE = 1e-10
+
 
 @dataclass
 class OBB:
@@ -15,12 +21,78 @@ class OBB:
     depth: Optional[int]
 
 
+@dataclass
+class SegmentIndices:
+    """
+    Pixel indices of all segments of a label image in a CSR-style layout.
+    The indices of segment ``label`` are ``indices[offsets[label]:offsets[label + 1]]``, in the same (row-major)
+    order as ``np.argwhere(labels == label)`` would return them. The background (label 0) is not stored.
+    """
+    indices: np.ndarray
+    offsets: np.ndarray
+
+    @property
+    def num_labels(self):
+        # number of label values covered by the offsets, including the (empty) background label 0
+        return len(self.offsets) - 1
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def segment(self, label):
+        # returns a view into the shared index buffer, no copy is made
+        if label <= 0 or label >= self.num_labels:
+            return self.indices[:0]
+        return self.indices[self.offsets[label]:self.offsets[label + 1]]
+
+    def labels(self):
+        # all labels that own at least one pixel
+        return np.flatnonzero(self.counts())
+
+
 def get_indices_for_segment(image, segment_value):
     # Find the indices of all pixels in the segment
     indices = np.argwhere(image == segment_value)
     return indices
 
 
+def group_indices_by_label(labels):
+    """
+    Groups the pixel indices of all segments of a label image with a single scan over the image.
+    :param labels: Label image as numpy integer array. A value of 0 is treated as background.
+    :return: SegmentIndices holding one (N, 2) index buffer and the per-label offsets into it.
+    """
+    flat = labels.ravel()
+    # positions of all foreground pixels, already in row-major order
+    positions = np.flatnonzero(flat != 0)
+    values = flat[positions]
+
+    num_labels = int(values.max()) + 1 if len(values) > 0 else 1
+    counts = np.bincount(values, minlength=num_labels)
+    offsets = np.zeros(num_labels + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # a stable sort keeps the row-major order within each segment
+    positions = positions[np.argsort(values, kind="stable")]
+    indices = np.empty((len(positions), 2), dtype=np.int64)
+    indices[:, 0], indices[:, 1] = np.unravel_index(positions, labels.shape)
+    return SegmentIndices(indices=indices, offsets=offsets)
+
+
+def boundary_pixels(labels):
+    """
+    Removes the interior of every segment of a label image in a single vectorized pass. A pixel is kept if one of its
+    4-neighbours has a different label, pixels at the image border are always kept.
+    :param labels: Label image as numpy integer array. A value of 0 is treated as background.
+    :return: Label image of the same shape containing only the boundary pixels of each segment.
+    """
+    padded = np.pad(labels, 1)
+    interior = ((padded[:-2, 1:-1] == labels) & (padded[2:, 1:-1] == labels) &
+                (padded[1:-1, :-2] == labels) & (padded[1:-1, 2:] == labels))
+    return np.where(interior, 0, labels)
+
+
+@profiled("oriented_bounding_box_py")
 def oriented_bounding_box_py(indices):
 
     if len(indices) == 1:
@@ -80,15 +152,111 @@ def oriented_bounding_box_py(indices):
     return OBB(corners=translated_corners, width=width, height=height, depth=None)
 
 
-def create_sub_parts(indices, corners):
-    # given initial coordinates of a segment by the indices array (N,2) and an array giving the corners
-    # of a rectangle, create two new indices arrays. These are given by cutting the rectangle in half at the longer
-    # side and associating the indices with one of the two parts
+def compute_moments(indices):
+    """
+    Computes the raw moments (n, sum x, sum y, sum xx, sum xy, sum yy) of pixel indices, where x is the first and y the
+    second index coordinate. Integer indices give exact int64 moments, so moments of a part can be obtained exactly by
+    subtracting the moments of the other part from the moments of the whole.
+    :param indices: (N, 2) pixel indices.
+    :return: moments as numpy array of length 6.
+    """
+    dtype = np.int64 if np.issubdtype(indices.dtype, np.integer) else np.float64
+    x = indices[:, 0].astype(dtype, copy=False)
+    y = indices[:, 1].astype(dtype, copy=False)
+    return np.array([len(indices), x.sum(), y.sum(), np.dot(x, x), np.dot(x, y), np.dot(y, y)], dtype=dtype)
+
+
+def principal_axes(moments):
+    """
+    Closed-form principal axis of the 2x2 covariance matrices given by raw moments.
+    :param moments: (..., 6) raw moments as returned by compute_moments, with n > 0.
+    :return:
+    - centroids (..., 2)
+    - cos, sin (...) of the angle of the eigenvector of the largest eigenvalue. Ties and the sign of the eigenvector
+     follow np.linalg.eigh applied to the exact covariance matrix: for equal diagonal entries (a == c) the vector is
+     (1, 1) / sqrt(2) if b > 0 and (-1, 1) / sqrt(2) if b < 0, for an isotropic covariance (a == c, b == 0) it is
+     (0, 1). oriented_bounding_box_py computes the covariance in floating point with np.cov, whose rounding can break
+     such exact ties either way, so on (near-)isotropic or symmetric point sets its box may be rotated by 90 degrees
+     or have its corners in another order. Otherwise the boxes are the same.
+    """
+    moments = np.asarray(moments)
+    n, sx, sy, sxx, sxy, syy = np.moveaxis(moments, -1, 0)
+
+    # entries of the covariance matrix [[a, b], [b, c]] scaled by n. For integer indices n * a etc. are integers and
+    # are computed exactly as long as they fit into int64, so that e.g. a vanishing b is exactly zero
+    if np.issubdtype(moments.dtype, np.integer) and np.all(n.astype(np.float64) * np.maximum(sxx, syy) < 2.0 ** 62):
+        a = (n * sxx - sx * sx).astype(np.float64)
+        b = (n * sxy - sx * sy).astype(np.float64)
+        c = (n * syy - sy * sy).astype(np.float64)
+    else:
+        n, sx, sy, sxx, sxy, syy = (m.astype(np.float64) for m in (n, sx, sy, sxx, sxy, syy))
+        a = n * sxx - sx * sx
+        b = n * sxy - sx * sy
+        c = n * syy - sy * sy
+    centroids = np.stack([sx / n, sy / n], axis=-1)
+
+    # LAPACK treats off-diagonal entries below this threshold as zero
+    b = np.where(np.abs(b) <= np.sqrt(np.abs(a)) * np.sqrt(np.abs(c)) * np.finfo(np.float64).epsneg, 0.0, b)
+
+    # the eigenvector of the largest eigenvalue is at angle theta with tan(2 theta) = 2b / (a - c), its cosine and sine
+    # follow from the half-angle formulas without evaluating any trigonometric function
+    half_diff = (a - c) / 2
+    radius = np.hypot(half_diff, b)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_2theta = np.where(radius > 0, half_diff / radius, -1.0)
+    cos = np.sqrt(np.maximum(1 + cos_2theta, 0) / 2)
+    sin = np.sqrt(np.maximum(1 - cos_2theta, 0) / 2)
+    sin = np.where(b < 0, -sin, sin)
+
+    # sign convention of the eigenvectors returned by np.linalg.eigh for positive semi-definite 2x2 matrices
+    flip = (b < 0) | ((b > 0) & (a > c))
+    cos = np.where(flip, -cos, cos)
+    sin = np.where(flip, -sin, sin)
+    return centroids, cos, sin
+
+
+def oriented_bounding_box_from_moments(indices, moments):
+    """
+    Same box as oriented_bounding_box_py, but the centroid and orientation are derived from precomputed raw moments,
+    so the extents are the only pass over the indices.
+    """
+    if len(indices) == 1:
+        return oriented_bounding_box_py(indices)
+
+    centroid, cos, sin = principal_axes(moments)
+    rotation_matrix = np.array([[cos, sin],
+                                [-sin, cos]])
+
+    # Rotate the indices by the angle and compute the extents
+    rotated_indices = np.dot(indices - centroid, rotation_matrix.T)
+    min_x, min_y = np.min(rotated_indices, axis=0)
+    max_x, max_y = np.max(rotated_indices, axis=0)
+
+    corners = np.array([[min_x, min_y],
+                        [max_x, min_y],
+                        [max_x, max_y],
+                        [min_x, max_y]])
+    translated_corners = np.dot(corners, rotation_matrix) + centroid
+
+    width = max_y - min_y
+    height = max_x - min_x
+
+    return OBB(corners=translated_corners, width=width, height=height, depth=None)
+
 
+def cut_line(corners):
+    """
+    The line that cuts a box in half at its longer side.
+    :return: a point on the line, the direction of the line and the tolerance below which the cross product of a point
+     with the line counts as zero
+    """
     # Compute the midpoint of the longest side of the bounding box
     l1 = corners[1] - corners[0]
     l2 = corners[2] - corners[1]
-    if np.dot(l1, l1) > np.dot(l2, l2):
+    length1 = l1[0] * l1[0] + l1[1] * l1[1]
+    length2 = l2[0] * l2[0] + l2[1] * l2[1]
+    # near-square boxes are cut at the second side, so that rounding of the corners cannot flip the choice
+    if length1 > (1 + CUT_TOLERANCE) * length2:
         intersection1 = (corners[0] + corners[1]) / 2
         intersection2 = intersection1 + corners[2] - corners[1]
     else:
@@ -97,6 +265,16 @@ def create_sub_parts(indices, corners):
 
     # compute the direction vector of the intersection line
     direction = intersection2 - intersection1
+    tolerance = CUT_TOLERANCE * (length1 + length2)
+    return intersection1, direction, tolerance
+
+
+@profiled("create_sub_parts")
+def create_sub_parts(indices, corners):
+    # given initial coordinates of a segment by the indices array (N,2) and an array giving the corners
+    # of a rectangle, create two new indices arrays. These are given by cutting the rectangle in half at the longer
+    # side and associating the indices with one of the two parts
+    intersection1, direction, tolerance = cut_line(corners)
 
     # compute vector from all indices to first intersection point (we need just one point on the intersection line,
     # any point would do
@@ -106,32 +284,84 @@ def create_sub_parts(indices, corners):
     # half-line of the rectangle
     cross = np.cross(diffs, direction)
 
-    # comptue the masks
-    m1 = cross > 0
-    m2 = cross <= 0
+    # comptue the masks. Points on the half-line go to the second part, the tolerance makes sure that this does not
+    # depend on rounding errors of the corners
+    m1 = cross > tolerance
+    m2 = cross <= tolerance
     return indices[m1], indices[m2]
 
 
-def create_obb_tree(indices, depth=0, max_depth=3, min_pixels=10):
+def split_moments(moments, part1, part2):
+    """
+    Moments of the two parts of a split. Only the smaller part is summed, the moments of the larger part are the
+    difference to the moments of the whole.
     """
+    if len(part1) <= len(part2):
+        moments1 = compute_moments(part1)
+        return moments1, moments - moments1
+    moments2 = compute_moments(part2)
+    return moments - moments2, moments2
 
-    :param indices:
+
+def create_obb_tree(indices, depth=0, max_depth=3, min_pixels=10, moments=None, fit="pca", hull=None):
+    """
+
+    :param indices: (N, 2) pixel indices of the segment, e.g. a slice of SegmentIndices.segment(). The array is only
+     read, so views into a shared index buffer can be passed without copying.
     :param depth:
     :param min_pixels:
+    :param moments: Raw moments of the indices as returned by compute_moments. Computed if not given.
+    :param fit: How the box of a node is fitted.
+     "pca": orientation from the moments, extents over all pixels of the node.
+     "hull": orientation from the moments, extents over the convex hull vertices of the node only.
+     "min_area": minimum-area box of the convex hull of the node (rotating calipers).
+     In the hull modes the hull is computed once for the root and the hulls of the children are derived from it by
+     clipping at the cut line, so the extents cost O(hull vertices) instead of O(pixels). Boxes still contain all
+     pixels, but they are only tight for (nearly) convex segments such as filled blobs: for concave segments a
+     clipped hull can span gaps the node does not cover.
+    :param hull: Convex hull of the indices for the hull modes. Computed if not given.
+    Boxes are cut as described at CUT_TOLERANCE: pixels on the cut line go to the second child and near-square boxes
+    are cut at their second side.
     :return:
     - obb tree of current level
     - list if obb trees of children
     """
+    if fit not in ("pca", "hull", "min_area"):
+        raise ValueError(f"Unknown fit '{fit}', expected 'pca', 'hull' or 'min_area'.")
+    if moments is None and fit != "min_area":
+        moments = compute_moments(indices)
+
     # Compute the oriented bounding box for the segment
-    obb = oriented_bounding_box_py(indices)
+    with stage("fit"):
+        if fit == "pca" or len(indices) == 1:
+            obb = oriented_bounding_box_from_moments(indices, moments)
+        else:
+            from obb_tree.hull import box_from_hull, convex_hull, minimum_area_box
+            if hull is None:
+                hull = convex_hull(indices)
+            if fit == "hull":
+                obb = box_from_hull(hull, *principal_axes(moments))
+            else:
+                obb = minimum_area_box(hull)
     obb.depth = depth
 
     # If the segment has too few pixels or the tree depth limit is reached, return the bounding box as a leaf node
-    if indices.shape[0] < min_pixels or depth == max_depth:
+    is_leaf = indices.shape[0] < min_pixels or depth == max_depth
+    stats = active()
+    if stats is not None:
+        stats.add_level(depth, 1, len(indices), not is_leaf)
+    if is_leaf:
         return obb, []
 
     # Create sub-segments by applying the mask to the image
     sub_segments = create_sub_parts(indices, obb.corners)
+    sub_moments = split_moments(moments, *sub_segments) if moments is not None else (None, None)
+    sub_hulls = (None, None)
+    if hull is not None:
+        from obb_tree.hull import clip_hull
+        intersection, direction, tolerance = cut_line(obb.corners)
+        sub_hulls = (clip_hull(hull, intersection, direction, tolerance, keep_positive=True),
+                     clip_hull(hull, intersection, direction, tolerance, keep_positive=False))
 
     # image = np.zeros((100, 100))
     # image[indices[:, 0], indices[:, 1]] = 1
@@ -142,15 +372,19 @@ def create_obb_tree(indices, depth=0, max_depth=3, min_pixels=10):
 
     # Recursively create obb trees for each sub-segment
     obb_trees = []
-    for sub_segment in sub_segments:
+    for sub_segment, sub_moment, sub_hull in zip(sub_segments, sub_moments, sub_hulls):
         if len(sub_segment) > 0:
-            sub_obb, sub_trees = create_obb_tree(sub_segment, depth + 1, max_depth=max_depth, min_pixels=min_pixels)
+            sub_obb, sub_trees = create_obb_tree(sub_segment, depth + 1, max_depth=max_depth, min_pixels=min_pixels,
+                                                 moments=sub_moment, fit=fit, hull=sub_hull)
             obb_trees.append((sub_obb, sub_trees))
 
     return obb, obb_trees
 
 
 def visualize_bounding_box(segment_value, image):
+    # plotting libraries are only imported by the demos, importing the algorithms must work headless
+    import matplotlib.pyplot as plt
+
     # Compute the bounding box
     corners, width, height = oriented_bounding_box_py(image, segment_value)
     print(corners)
@@ -180,6 +414,7 @@ def obb_tree_test():
     import numpy as np
     import matplotlib.pyplot as plt
     from skimage.draw import polygon, polygon_perimeter
+    from obb_tree.tree import OBBTree
 
     # Define image size and create empty image
     image_size = 100
@@ -194,35 +429,26 @@ def obb_tree_test():
     SHOW_ONLY_ACIVE = False
 
     # Define function to plot oriented bounding box
-    def plot_obb(obb):
+    def plot_obb(corners, depth):
         colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
                   "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
-        color = colors[obb.depth % len(colors)]
-        corners = obb.corners.copy()
+        color = colors[depth % len(colors)]
         corners = corners[:, ::-1]
-        if SHOW_ONLY_ACIVE and obb.depth != SHOW_ONLY_LEVEL:
-            return
         plt.plot([corners[0, 0], corners[1, 0]], [corners[0, 1], corners[1, 1]], color)
         plt.plot([corners[1, 0], corners[2, 0]], [corners[1, 1], corners[2, 1]], color)
         plt.plot([corners[2, 0], corners[3, 0]], [corners[2, 1], corners[3, 1]], color)
         plt.plot([corners[3, 0], corners[0, 0]], [corners[3, 1], corners[0, 1]], color)
 
     # Compute the oriented bounding box tree
-    indices = get_indices_for_segment(image, 1)
-    root, sub_trees = create_obb_tree(indices, depth=4)
+    indices = group_indices_by_label(image.astype(np.int32)).segment(1)
+    tree = OBBTree.from_nested(create_obb_tree(indices, depth=4))
 
     # Plot the image with the oriented bounding boxes
     plt.imshow(image, cmap='gray')
     # plt.axis('off')
-    plot_obb(root)
-
-    def traverse_tree(tree):
-        if len(tree) > 0:
-            for obb, sub_t in tree:
-                plot_obb(obb)
-                traverse_tree(sub_t)
-
-    traverse_tree(sub_trees)
+    nodes = tree.level(SHOW_ONLY_LEVEL) if SHOW_ONLY_ACIVE else slice(None)
+    for corners, depth in zip(tree.corners[nodes], tree.depth[nodes]):
+        plot_obb(corners, depth)
     # if obb_tree[3] is not None:
     #     for i, (corners, width, height, subtrees) in enumerate(obb_tree[3]):
     #         plot_obb(corners, color='C' + str(i))
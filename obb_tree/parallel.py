@@ -0,0 +1,92 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from obb_tree.builder import build_obb_trees
+from obb_tree.obb import SegmentIndices, group_indices_by_label
+from obb_tree.tree import OBBTree
+
+# state of a worker process: the shared memory blocks and the SegmentIndices view onto them
+_worker_state = {}
+
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 every attaching process registers the block with the resource tracker. The workers share
+        # the tracker of the parent with every start method, where the name is already registered, so this is a no-op.
+        # The block must not be unregistered here, that would remove the parent's registration and its unlink would
+        # then fail in the tracker.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(indices_spec, offsets_spec):
+    arrays = []
+    for name, shape, dtype in (indices_spec, offsets_spec):
+        shm = _attach_shared_memory(name)
+        _worker_state.setdefault("shm", []).append(shm)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    _worker_state["segments"] = SegmentIndices(indices=arrays[0], offsets=arrays[1])
+
+
+def _build_chunk(label_range, max_depth, min_pixels):
+    return build_obb_trees(_worker_state["segments"], max_depth=max_depth, min_pixels=min_pixels,
+                           labels=np.arange(*label_range))
+
+
+def _to_shared_memory(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def chunk_labels(segments, chunk_pixels):
+    """
+    Splits the labels of a SegmentIndices into consecutive ranges of roughly chunk_pixels pixels each, so that many
+    small segments are handled by one task.
+    :return: list of (first label, last label + 1) tuples.
+    """
+    total = int(segments.offsets[-1])
+    cuts = np.searchsorted(segments.offsets, np.arange(chunk_pixels, total, chunk_pixels), side="right") - 1
+    bounds = np.unique(np.concatenate([[1], cuts, [segments.num_labels]]))
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def build_obb_forest(labels, max_depth=3, min_pixels=10, workers=None, chunk_pixels=1 << 16):
+    """
+    Builds the OBB trees of all segments of a label image with a pool of worker processes. The label image is grouped
+    once, the grouped index buffer is placed in shared memory and the workers build the trees of consecutive label
+    ranges of about chunk_pixels pixels from it.
+    :param labels: Label image as numpy integer array. A value of 0 is treated as background.
+    :param workers: Number of worker processes, defaults to the number of CPUs. With 1 worker everything runs in the
+     calling process.
+    :param chunk_pixels: Target number of pixels per task.
+    :return: OBBTree holding the trees of all segments, identical to build_obb_trees on the whole image.
+    """
+    segments = group_indices_by_label(labels)
+    workers = workers or os.cpu_count() or 1
+    # at least a few tasks per worker to balance segments of very different sizes
+    chunk_pixels = max(1, min(chunk_pixels, -(-len(segments.indices) // (4 * workers))))
+    chunks = chunk_labels(segments, chunk_pixels)
+    if workers == 1 or len(chunks) <= 1:
+        return build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels)
+
+    shared = []
+    try:
+        specs = []
+        for array in (segments.indices, segments.offsets):
+            shm, spec = _to_shared_memory(array)
+            shared.append(shm)
+            specs.append(spec)
+        del segments
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_worker,
+                                 initargs=tuple(specs)) as executor:
+            trees = list(executor.map(_build_chunk, chunks, [max_depth] * len(chunks), [min_pixels] * len(chunks)))
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+    return OBBTree.concatenate(trees)
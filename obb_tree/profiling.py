@@ -0,0 +1,218 @@
+import functools
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+
+# Opt-in instrumentation of the build. Stages are only timed while a collector is active in the current thread or a
+# hook is registered. Otherwise stage() returns a shared no-op context and profiled functions call straight through,
+# so the cost of a disabled stage is one global lookup.
+
+# number of active collectors plus registered hooks
+_enabled = 0
+_lock = threading.Lock()
+_local = threading.local()
+_hooks = []
+_NULL_STAGE = nullcontext()
+
+
+@dataclass
+class LevelStats:
+    nodes: int = 0
+    pixels: int = 0  # pixels processed at this depth, summed over all nodes
+    split: int = 0  # nodes that were split into children
+    seconds: float = 0.0  # wall time of the level, only measured by the level-synchronous builder
+
+
+@dataclass
+class BuildStats:
+    """
+    Statistics collected while a profiling.collect() block is active. Several builds in one block add up.
+    """
+    seconds: dict = field(default_factory=dict)  # stage name -> total wall time
+    calls: dict = field(default_factory=dict)  # stage name -> number of times the stage was entered
+    peak_bytes: dict = field(default_factory=dict)  # stage name -> largest traced allocation peak within the stage
+    levels: dict = field(default_factory=dict)  # depth -> LevelStats
+    trace_allocations: bool = False
+
+    def add_level(self, depth, nodes, pixels, split, seconds=0.0):
+        level = self.levels.setdefault(int(depth), LevelStats())
+        level.nodes += int(nodes)
+        level.pixels += int(pixels)
+        level.split += int(split)
+        level.seconds += seconds
+
+    def add_stage(self, name, seconds, peak_bytes=None):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if peak_bytes is not None:
+            self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak_bytes)
+
+    @property
+    def nodes_per_depth(self):
+        return {depth: level.nodes for depth, level in sorted(self.levels.items())}
+
+    def summary(self):
+        """
+        Multi-line text with one row per stage and one per tree level.
+        """
+        lines = []
+        for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            line = f"{name:<24} {seconds * 1000:9.2f} ms  {self.calls[name]:7d} calls"
+            if name in self.peak_bytes:
+                line += f"  {self.peak_bytes[name] / 1024:9.1f} KiB peak"
+            lines.append(line)
+        for depth, level in sorted(self.levels.items()):
+            line = f"depth {depth:<3} {level.nodes:8d} nodes {level.pixels:10d} pixels {level.split:8d} split"
+            if level.seconds > 0:
+                line += f"  {level.seconds * 1000:9.2f} ms"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def active():
+    """
+    The BuildStats collecting in the current thread, or None. Code that gathers statistics beyond stage timings checks
+    this once per call.
+    """
+    return getattr(_local, "stats", None) if _enabled else None
+
+
+def _add_enabled(delta):
+    global _enabled
+    with _lock:
+        _enabled += delta
+
+
+@contextmanager
+def collect(trace_allocations=False, stats=None):
+    """
+    Collects statistics of everything run in the current thread inside the block:
+
+        with profiling.collect() as stats:
+            build_obb_trees(segments)
+        print(stats.summary())
+
+    :param trace_allocations: Also record the peak of the memory allocated by each stage with tracemalloc, which
+     slows down the build considerably.
+    :param stats: BuildStats to add to, a new one by default.
+    """
+    stats = BuildStats(trace_allocations=trace_allocations) if stats is None else stats
+    previous = getattr(_local, "stats", None)
+    started_tracing = trace_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _local.stats = stats
+    _add_enabled(1)
+    try:
+        yield stats
+    finally:
+        _add_enabled(-1)
+        _local.stats = previous
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def add_hook(hook):
+    """
+    Registers hook(event, name), called with event "begin" and "end" around every stage in every thread, e.g. to
+    open and close ranges of an external profiler. Hooks are called even without an active collector.
+    """
+    with _lock:
+        _hooks.append(hook)
+    _add_enabled(1)
+    return hook
+
+
+def remove_hook(hook):
+    with _lock:
+        _hooks.remove(hook)
+    _add_enabled(-1)
+
+
+class _Stage:
+    __slots__ = ("name", "stats", "start", "memory")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.stats = getattr(_local, "stats", None)
+        for hook in _hooks:
+            hook("begin", self.name)
+        self.memory = None
+        if self.stats is not None and self.stats.trace_allocations and tracemalloc.is_tracing():
+            self.memory = _begin_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.stats is not None:
+            self.stats.add_stage(self.name, elapsed, _end_peak(self.memory) if self.memory is not None else None)
+        for hook in _hooks:
+            hook("end", self.name)
+        return False
+
+
+def _begin_peak():
+    # tracemalloc has one peak per process, nested stages keep the peak of their parent on a per-thread stack
+    stack = _local.__dict__.setdefault("peaks", [])
+    current, peak = tracemalloc.get_traced_memory()
+    if len(stack) > 0:
+        stack[-1][1] = max(stack[-1][1], peak)
+    current = _reset_peak(stack, current)
+    frame = [current, current]
+    stack.append(frame)
+    return frame
+
+
+def _end_peak(frame):
+    stack = _local.peaks
+    current, peak = tracemalloc.get_traced_memory()
+    stack.pop()
+    peak = max(frame[1], peak)
+    if len(stack) > 0:
+        stack[-1][1] = max(stack[-1][1], peak)
+    _reset_peak(stack, current)
+    return peak - frame[0]
+
+
+def _reset_peak(stack, current):
+    # tracemalloc.reset_peak is new in Python 3.9. Before, restarting the trace resets the peak too, but the traced
+    # memory starts again at zero, so the frames on the stack are shifted along. Allocations of the other threads are
+    # shifted by the same amount, their stages get approximate peaks.
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+        return current
+    tracemalloc.stop()
+    tracemalloc.start()
+    for frame in stack:
+        frame[0] -= current
+        frame[1] -= current
+    return 0
+
+
+def stage(name):
+    """
+    Context manager that times the enclosed block as stage name if profiling is enabled.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def profiled(name):
+    """
+    Decorator that times every call of the function as stage name if profiling is enabled.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,216 @@
+import numpy as np
+
+from obb_tree.obb import CUT_TOLERANCE
+from obb_tree.tree import OBBTree
+
+
+def _box_frames(corners):
+    """
+    Local frames of boxes given by their corners.
+    :param corners: (..., 4, 2) box corners in the order of oriented_bounding_box_py.
+    :return: origins (..., 2), unit axes (..., 2, 2) and extents along the axes (..., 2). Degenerate boxes of zero
+     width get the normal of their long side as second axis.
+    """
+    edges = np.stack([corners[..., 1, :] - corners[..., 0, :], corners[..., 3, :] - corners[..., 0, :]], axis=-2)
+    extents = np.hypot(edges[..., 0], edges[..., 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        axes = edges / extents[..., None]
+    first_ok = extents[..., 0] > 0
+    second_ok = extents[..., 1] > 0
+    # replace missing axes by the normal of the other one
+    normal_of_second = np.stack([axes[..., 1, 1], -axes[..., 1, 0]], axis=-1)
+    axes[..., 0, :] = np.where(first_ok[..., None], axes[..., 0, :], np.where(second_ok[..., None], normal_of_second,
+                                                                              [1.0, 0.0]))
+    normal_of_first = np.stack([-axes[..., 0, 1], axes[..., 0, 0]], axis=-1)
+    axes[..., 1, :] = np.where(second_ok[..., None], axes[..., 1, :], normal_of_first)
+    return corners[..., 0, :], axes, extents
+
+
+def _contains(corners, points, margin):
+    # containment for aligned arrays of boxes (..., 4, 2) and points (..., 2)
+    origins, axes, extents = _box_frames(corners)
+    local = np.einsum("...ij,...j->...i", axes, points - origins)
+    # pixels on the border of their box must not get lost to rounding errors of the corners
+    margin = margin + CUT_TOLERANCE * (1 + np.sum(extents, axis=-1, keepdims=True))
+    return np.all((local >= -margin) & (local <= extents + margin), axis=-1)
+
+
+def points_in_obbs(corners, points, margin=0.0):
+    """
+    Tests every point against every box.
+    :param corners: (K, 4, 2) box corners, e.g. tree.corners or a level of it.
+    :param points: (M, 2) query points in index coordinates.
+    :param margin: Distance by which the boxes are grown, e.g. 0.5 to treat boxes around pixel centres as pixel areas.
+    :return: (M, K) boolean array, True if point m lies in box k.
+    """
+    return _contains(corners[None, :, :, :], np.asarray(points, dtype=np.float64)[:, None, :], margin)
+
+
+def obbs_overlap(corners_a, corners_b, margin=0.0):
+    """
+    Separating axis test for pairs of oriented boxes, vectorized over all pairs.
+    :param corners_a: (..., 4, 2) box corners.
+    :param corners_b: (..., 4, 2) box corners, broadcast against corners_a.
+    :param margin: Boxes closer than this distance count as overlapping.
+    :return: (...) boolean array, True where the boxes overlap.
+    """
+    corners_a, corners_b = np.broadcast_arrays(corners_a, corners_b)
+    # the candidate separating axes of two rectangles are the two edge directions of each of them
+    axes = np.concatenate([_box_frames(corners_a)[1], _box_frames(corners_b)[1]], axis=-2)
+    projections_a = np.einsum("...ij,...kj->...ik", axes, corners_a)
+    projections_b = np.einsum("...ij,...kj->...ik", axes, corners_b)
+    margin = margin + CUT_TOLERANCE * (1 + np.abs(projections_a).max(axis=-1) + np.abs(projections_b).max(axis=-1))
+    separated = ((projections_a.max(axis=-1) + margin < projections_b.min(axis=-1)) |
+                 (projections_b.max(axis=-1) + margin < projections_a.min(axis=-1)))
+    return ~np.any(separated, axis=-1)
+
+
+def _children(tree, nodes):
+    """
+    Children of the given nodes.
+    :return: index of the parent entry in nodes for every child, and the child node indices.
+    """
+    counts = tree.child_count[nodes]
+    parents = np.repeat(np.arange(len(nodes)), counts)
+    ranks = np.arange(len(parents)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return parents, tree.first_child[nodes][parents] + ranks
+
+
+def _as_tree(tree):
+    # nested (OBB, children) tuples as returned by create_obb_tree are converted to the flat layout
+    return tree if isinstance(tree, OBBTree) else OBBTree.from_nested(tree)
+
+
+def _root_nodes(tree, segments):
+    roots = np.flatnonzero(tree.parent == -1)
+    if segments is not None:
+        roots = roots[np.isin(tree.segment[roots], segments)]
+    return roots
+
+
+def _ranges(starts, stops):
+    # owner index and value of every element of the ranges [starts[i], stops[i])
+    counts = np.maximum(stops - starts, 0)
+    owners = np.repeat(np.arange(len(starts)), counts)
+    return owners, np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts) + starts[owners]
+
+
+def _root_pairs(tree_a, roots_a, tree_b, roots_b, margin):
+    """
+    Pairs of roots whose axis-aligned bounding boxes overlap, found by sorting the boxes by their lower x bound and
+    sweeping instead of testing all pairs. obbs_overlap applies the margin (and its tolerance) along the box axes, which
+    widens the axis-aligned bounds by up to sqrt(2) times as much, the bounds are grown by that so no pair that
+    obbs_overlap accepts is dropped.
+    :return: node indices into tree_a and tree_b, sorted by the node in tree_a and then by the node in tree_b.
+    """
+    def bounds(tree, roots):
+        corners = tree.corners[roots]
+        tolerance = CUT_TOLERANCE * (0.5 + np.hypot(corners[..., 0], corners[..., 1]).max(axis=-1))
+        grow = np.sqrt(2) * (margin / 2 + tolerance)
+        return corners.min(axis=1) - grow[:, None], corners.max(axis=1) + grow[:, None]
+
+    low_a, high_a = bounds(tree_a, roots_a)
+    low_b, high_b = bounds(tree_b, roots_b)
+    order_a = np.argsort(low_a[:, 0], kind="stable")
+    order_b = np.argsort(low_b[:, 0], kind="stable")
+    sorted_a, sorted_b = low_a[order_a, 0], low_b[order_b, 0]
+    # the x intervals of two boxes overlap if the lower bound of one lies in the interval of the other; every pair is
+    # found from the box with the smaller lower bound, ties from the box of tree_a
+    owners_a, ranks_b = _ranges(np.searchsorted(sorted_b, low_a[:, 0], side="left"),
+                                np.searchsorted(sorted_b, high_a[:, 0], side="right"))
+    owners_b, ranks_a = _ranges(np.searchsorted(sorted_a, low_b[:, 0], side="right"),
+                                np.searchsorted(sorted_a, high_b[:, 0], side="right"))
+    pairs_a = np.concatenate([owners_a, order_a[ranks_a]])
+    pairs_b = np.concatenate([order_b[ranks_b], owners_b])
+    overlap = (low_a[pairs_a, 1] <= high_b[pairs_b, 1]) & (low_b[pairs_b, 1] <= high_a[pairs_a, 1])
+    pairs_a, pairs_b = roots_a[pairs_a[overlap]], roots_b[pairs_b[overlap]]
+    order = np.lexsort((pairs_b, pairs_a))
+    return pairs_a[order], pairs_b[order]
+
+
+def query_points(tree, points, margin=0.0, segments=None):
+    """
+    Finds the leaves of a tree or forest that contain the query points. All points descend the trees together: the
+    candidate (point, node) pairs of one level are tested in one batch and only pairs whose box contains the point are
+    expanded to the children of the node. The box of a child is not necessarily contained in the box of its parent, a
+    point is only reported for a leaf if it lies in all boxes on the path from the root. All pixels of a segment are
+    found in the leaves holding them.
+    :param tree: OBBTree or the result of create_obb_tree.
+    :param points: (M, 2) query points in index coordinates.
+    :param margin: Distance by which the boxes are grown.
+    :param segments: Restrict the query to the trees of these segment labels.
+    :return: point indices and leaf node indices of all hits, one entry per (point, leaf) pair.
+    """
+    tree = _as_tree(tree)
+    points = np.asarray(points, dtype=np.float64)
+    roots = _root_nodes(tree, segments)
+    point_ids = np.repeat(np.arange(len(points)), len(roots))
+    nodes = np.tile(roots, len(points))
+
+    hit_points, hit_nodes = [point_ids[:0]], [nodes[:0]]
+    while len(nodes) > 0:
+        inside = _contains(tree.corners[nodes], points[point_ids], margin)
+        point_ids, nodes = point_ids[inside], nodes[inside]
+        leaf = tree.child_count[nodes] == 0
+        hit_points.append(point_ids[leaf])
+        hit_nodes.append(nodes[leaf])
+        parents, nodes = _children(tree, nodes[~leaf])
+        point_ids = point_ids[~leaf][parents]
+    return np.concatenate(hit_points), np.concatenate(hit_nodes)
+
+
+def intersect_trees(tree_a, tree_b, margin=0.0, segments_a=None, segments_b=None, distinct_segments=False):
+    """
+    Finds all pairs of overlapping leaves of two trees or forests by simultaneous descent. Pairs of nodes that do not
+    overlap prune the whole pair of subtrees, the remaining pairs of one level are tested in one batch. Like in
+    query_points, a pair of leaves is only reported if all pairs of ancestor boxes on the way down overlap as well.
+    The pairs of roots are prefiltered by their axis-aligned bounds, so forests of many trees are not compared root by
+    root.
+    :param tree_a: OBBTree or the result of create_obb_tree.
+    :param tree_b: OBBTree or the result of create_obb_tree, may be the same object as tree_a.
+    :param margin: Boxes closer than this distance count as overlapping, useful for proximity checks.
+    :param segments_a: Restrict tree_a to the trees of these segment labels.
+    :param segments_b: Restrict tree_b to the trees of these segment labels.
+    :param distinct_segments: Skip pairs of trees with the same segment label, e.g. for collision checks between the
+     segments of one forest.
+    :return: node indices into tree_a and tree_b of all overlapping leaf pairs.
+    """
+    tree_a, tree_b = _as_tree(tree_a), _as_tree(tree_b)
+    roots_a = _root_nodes(tree_a, segments_a)
+    roots_b = _root_nodes(tree_b, segments_b)
+    nodes_a, nodes_b = _root_pairs(tree_a, roots_a, tree_b, roots_b, margin)
+    if distinct_segments:
+        different = tree_a.segment[nodes_a] != tree_b.segment[nodes_b]
+        nodes_a, nodes_b = nodes_a[different], nodes_b[different]
+
+    area_a = tree_a.width * tree_a.height
+    area_b = tree_b.width * tree_b.height
+    hits_a, hits_b = [nodes_a[:0]], [nodes_b[:0]]
+    while len(nodes_a) > 0:
+        overlap = obbs_overlap(tree_a.corners[nodes_a], tree_b.corners[nodes_b], margin)
+        nodes_a, nodes_b = nodes_a[overlap], nodes_b[overlap]
+        leaf_a = tree_a.child_count[nodes_a] == 0
+        leaf_b = tree_b.child_count[nodes_b] == 0
+        both = leaf_a & leaf_b
+        hits_a.append(nodes_a[both])
+        hits_b.append(nodes_b[both])
+
+        # descend into the larger of the two boxes unless it is a leaf
+        descend_a = ~leaf_a & (leaf_b | (area_a[nodes_a] >= area_b[nodes_b]))
+        descend_b = ~both & ~descend_a
+        parents_a, children_a = _children(tree_a, nodes_a[descend_a])
+        parents_b, children_b = _children(tree_b, nodes_b[descend_b])
+        nodes_a = np.concatenate([children_a, nodes_a[descend_b][parents_b]])
+        nodes_b = np.concatenate([nodes_b[descend_a][parents_a], children_b])
+    return np.concatenate(hits_a), np.concatenate(hits_b)
+
+
+def touching_segments(tree, margin=0.0):
+    """
+    Pairs of segments of a forest whose leaf boxes overlap or are closer than margin.
+    :return: (K, 2) array of segment label pairs, the smaller label first.
+    """
+    tree = _as_tree(tree)
+    leaves_a, leaves_b = intersect_trees(tree, tree, margin=margin, distinct_segments=True)
+    pairs = np.sort(np.stack([tree.segment[leaves_a], tree.segment[leaves_b]], axis=1), axis=1)
+    return np.unique(pairs, axis=0)
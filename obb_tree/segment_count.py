@@ -1,27 +1,124 @@
-import pycuda.driver as cuda
-import pycuda.autoinit
+import functools
 import numpy as np
 import os
+import time
 
+# Registered backends in order of preference. Each entry maps a name to (count function, availability check).
+_BACKENDS = {}
+_default_backend = None
 
-def count_pixels_per_segment(image: np.ndarray):
+
+def register_backend(name, count_fn, is_available=lambda: True):
+    """
+    Registers a backend for count_pixels_per_segment. Backends registered later are preferred by the automatic
+    selection if they are available.
+    :param name: Name under which the backend can be selected explicitly.
+    :param count_fn: Function taking a non-negative integer image and returning (segment_counts, num_segments).
+    :param is_available: Function returning True if the backend can be used on this machine.
+    """
+    _BACKENDS[name] = (count_fn, is_available)
+
+
+def available_backends():
+    return [name for name, (_, is_available) in _BACKENDS.items() if is_available()]
+
+
+def set_default_backend(name):
+    """
+    Overrides the automatic backend selection. Pass None to return to automatic selection.
+    """
+    global _default_backend
+    if name is not None and name not in _BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Known backends: {list(_BACKENDS)}")
+    _default_backend = name
+
+
+def get_backend(name=None):
+    """
+    Returns the name of the backend that is used for the given request. An explicitly requested backend takes
+    precedence over the default set with set_default_backend, which takes precedence over the automatic selection.
+    """
+    name = name if name is not None else _default_backend
+    if name is not None:
+        if name not in _BACKENDS:
+            raise ValueError(f"Unknown backend '{name}'. Known backends: {list(_BACKENDS)}")
+        if not _BACKENDS[name][1]():
+            raise RuntimeError(f"Backend '{name}' is not available on this machine.")
+        return name
+    return available_backends()[-1]
+
+
+def count_pixels_per_segment(image: np.ndarray, backend=None):
     """
     Counts the number of times each pixel value occurs.
     A value of 0 is treated as background.
     :param image: Segmented image as numpy integer array.
+    :param backend: Name of the backend to use, e.g. "numpy" or "cuda". Selected automatically if None.
     :return:
     segment_counts: Number of pixels per segment as numpy array The numpy array has length num_segments.
      At index idx of the array is the number of times the given value occurs
     num_segments: number of segments
     """
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    mod = cuda.module_from_file(os.path.join(current_folder, "segment_count.cubin"))
-    count_pixel_kernel = mod.get_function("count_pixels_per_segment")
+    count_fn, _ = _BACKENDS[get_backend(backend)]
+    return count_fn(image)
+
+
+def _count_pixels_numpy(image):
+    flat = image.ravel()
+    if len(flat) == 0:
+        return np.zeros(0, dtype=np.int32), 0
+    # bincount sizes its buffer to the largest label, independent of the image size
+    segment_counts = np.bincount(flat).astype(np.int32)
+    num_segments = int(np.count_nonzero(segment_counts))
+    return segment_counts[:num_segments], num_segments
 
+
+register_backend("numpy", _count_pixels_numpy)
+
+
+# The CUDA module and kernel handle are loaded on first use and cached for all later calls.
+_cuda_kernel = None
+
+
+@functools.lru_cache(maxsize=None)
+def _cuda_available():
+    try:
+        import pycuda.driver as cuda
+        cuda.init()
+        return cuda.Device.count() > 0
+    except Exception:
+        return False
+
+
+def _get_cuda_kernel():
+    global _cuda_kernel
+    if _cuda_kernel is None:
+        import pycuda.autoinit
+        import pycuda.driver as cuda
+
+        current_folder = os.path.dirname(os.path.abspath(__file__))
+        cubin_path = os.path.join(current_folder, "segment_count.cubin")
+        if os.path.exists(cubin_path):
+            mod = cuda.module_from_file(cubin_path)
+        else:
+            # no precompiled cubin shipped, compile the kernel source at runtime instead
+            from pycuda.compiler import SourceModule
+            with open(os.path.join(current_folder, "segment_count.cu")) as f:
+                mod = SourceModule(f.read(), no_extern_c=True)
+        _cuda_kernel = mod, mod.get_function("count_pixels_per_segment")
+    return _cuda_kernel[1]
+
+
+def _count_pixels_cuda(image):
+    import pycuda.driver as cuda
+    count_pixel_kernel = _get_cuda_kernel()
+
+    image = np.ascontiguousarray(image, dtype=np.int32)
     width = image.shape[0]
     height = image.shape[1]
 
-    segment_counts = np.zeros(width // 2 * height // 2, dtype=np.int32)
+    # one counter per label value, the kernel indexes the buffer with the pixel value
+    segment_counts = np.zeros(int(image.max()) + 1 if image.size > 0 else 1, dtype=np.int32)
     segment_counts_gpu = cuda.to_device(segment_counts)
 
     num_segments = np.zeros(1, dtype=np.int32)
@@ -30,7 +127,7 @@ def count_pixels_per_segment(image: np.ndarray):
     block = (32, 32, 1)
     grid = ((width + block[0] - 1) // block[0], (height + block[1] - 1) // block[1])
 
-    count_pixel_kernel(cuda.to_device(image.flatten()), segment_counts_gpu, num_segments_gpu, np.int32(width),
+    count_pixel_kernel(cuda.to_device(image.ravel()), segment_counts_gpu, num_segments_gpu, np.int32(width),
                        np.int32(height), block=block, grid=grid)
 
     cuda.memcpy_dtoh(segment_counts, segment_counts_gpu)
@@ -39,25 +136,42 @@ def count_pixels_per_segment(image: np.ndarray):
     return segment_counts[:num_segments[0]], num_segments[0]
 
 
-def compare_results():
-    width, height = 512, 512
-    image = np.random.randint(0, 40, (width, height), dtype=np.int32)
+register_backend("cuda", _count_pixels_cuda, _cuda_available)
 
-    import time
+
+def compare_results(width=512, height=512, num_labels=40, repeats=5):
+    """
+    Runs every available backend on a random image, checks that all of them agree with np.unique and reports the
+    best-of-repeats run time per backend.
+    :return: dict mapping backend name to run time in seconds.
+    """
+    image = np.random.randint(0, num_labels, (width, height), dtype=np.int32)
 
     t0 = time.perf_counter()
     labels, counts = np.unique(image, return_counts=True)
-    t1 = time.perf_counter()
-    segment_counts, num_segments = count_pixels_per_segment(image)
-    t2 = time.perf_counter()
-    print(t1 - t0, t2 - t1)
-
-    assert len(labels) == num_segments
-
-    for c, idx in zip(counts, labels):
-        assert c == segment_counts[idx]
-
-    print(count_pixels_per_segment(image))
+    timings = {"np.unique": time.perf_counter() - t0}
+
+    reference = None
+    for backend in available_backends():
+        # the first call of a backend may include one-time initialisation, which is not part of the timing
+        count_pixels_per_segment(image, backend=backend)
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            segment_counts, num_segments = count_pixels_per_segment(image, backend=backend)
+            best = min(best, time.perf_counter() - t0)
+        timings[backend] = best
+
+        assert len(labels) == num_segments, backend
+        for c, idx in zip(counts, labels):
+            assert c == segment_counts[idx], backend
+        if reference is None:
+            reference = segment_counts
+        assert np.array_equal(reference, segment_counts), backend
+
+    for name, elapsed in timings.items():
+        print(f"{name:>10}: {elapsed * 1000:.3f} ms")
+    return timings
 
 
 if __name__ == '__main__':
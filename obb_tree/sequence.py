@@ -0,0 +1,365 @@
+import numpy as np
+from dataclasses import dataclass
+
+from obb_tree.builder import _build_levels, _fit_boxes, _segment_moments, _split_sides, build_obb_trees, label_moments
+from obb_tree.obb import SegmentIndices, group_indices_by_label
+from obb_tree.tree import OBBTree, _level_order
+
+
+@dataclass
+class FrameStats:
+    unchanged: int = 0  # segments whose pixel set did not change, their trees are reused as they are
+    moved: int = 0  # segments shifted by whole pixels, their trees are translated
+    refit: int = 0  # segments with few changed pixels, only the subtrees containing changed pixels are fitted again
+    rebuilt: int = 0  # new segments and segments that changed too much, built from scratch
+    fitted_nodes: int = 0  # boxes fitted in refit segments
+    reused_nodes: int = 0  # boxes taken over unchanged in refit segments
+
+
+def _gather_pixels(labels, wanted, num_labels):
+    """
+    Pixel indices of some segments of a label image, with one scan over the image like group_indices_by_label.
+    :param wanted: Labels of the segments to gather.
+    :return: SegmentIndices in which all other segments are empty.
+    """
+    if len(wanted) == 0:
+        return SegmentIndices(indices=np.zeros((0, 2), dtype=np.int64),
+                              offsets=np.zeros(num_labels + 1, dtype=np.int64))
+    selected = np.zeros(num_labels, dtype=bool)
+    selected[wanted] = True
+    flat = labels.ravel()
+    positions = np.flatnonzero(selected[flat])
+    values = flat[positions]
+    offsets = np.zeros(num_labels + 1, dtype=np.int64)
+    np.cumsum(np.bincount(values, minlength=num_labels), out=offsets[1:])
+    # a stable sort keeps the row-major order within each segment
+    positions = positions[np.argsort(values, kind="stable")]
+    indices = np.empty((len(positions), 2), dtype=np.int64)
+    indices[:, 0], indices[:, 1] = np.unravel_index(positions, labels.shape)
+    return SegmentIndices(indices=indices, offsets=offsets)
+
+
+def _overlaps(previous, labels, counts):
+    """
+    Pixel overlap of the segments of two label images of the same shape.
+    :param counts: (L,) number of pixels of every label of the current image.
+    :return: previous labels, current labels and number of shared pixels of all pairs of overlapping segments.
+    """
+    previous, labels = previous.ravel(), labels.ravel()
+    # with labels that are stable over frames most pixels keep their label, only the others are gathered and sorted
+    differ = np.flatnonzero(previous != labels)
+    previous, labels = previous[differ], labels[differ]
+    kept = counts - np.bincount(labels, minlength=len(counts))
+    kept[0] = 0
+    kept_labels = np.flatnonzero(kept)
+    both = (previous != 0) & (labels != 0)
+    keys, shared = np.unique(previous[both].astype(np.int64) * len(counts) + labels[both], return_counts=True)
+    return (np.concatenate([kept_labels, keys // len(counts)]), np.concatenate([kept_labels, keys % len(counts)]),
+            np.concatenate([kept[kept_labels], shared]))
+
+
+def _shape_keys(moments):
+    # pixel count and scaled central second moments, which do not change when a segment is shifted
+    n, sx, sy, sxx, sxy, syy = moments.T
+    return np.stack([n, n * sxx - sx * sx, n * sxy - sx * sy, n * syy - sy * sy], axis=1)
+
+
+def _segment_tree(forest, cuts, root):
+    # tree below a root of a forest and the boxes its nodes were split at
+    ids = _subtree(forest, root)
+    fields = {name: getattr(forest, name)[ids] for name in forest.__dataclass_fields__}
+    for name in ("parent", "first_child"):
+        # the ids of a tree in a level-ordered forest are ascending
+        fields[name] = np.where(fields[name] >= 0, np.searchsorted(ids, fields[name]), -1).astype(np.int32)
+    return OBBTree(**fields), cuts[ids]
+
+
+def _concatenate(trees, cuts):
+    # OBBTree.concatenate of the trees, and the cuts of their nodes in the same order
+    forest = OBBTree.concatenate(trees)
+    order = np.argsort(np.concatenate([tree.depth for tree in trees]), kind="stable")
+    return forest, np.concatenate(cuts).reshape(-1, 4, 2)[order]
+
+
+def _subtree(tree, node):
+    # node ids of the subtree below node, in level order
+    level = np.array([node])
+    pieces = [level]
+    while True:
+        level = level[tree.child_count[level] > 0]
+        lengths = tree.child_count[level].astype(np.int64)
+        if len(level) == 0:
+            return np.concatenate(pieces)
+        level = np.repeat(tree.first_child[level] - np.cumsum(lengths) + lengths, lengths) + np.arange(np.sum(lengths))
+        pieces.append(level)
+
+
+def _dirty_nodes(tree, cuts, changed):
+    """
+    Nodes of a tree whose pixel set contains one of the changed pixels, found by routing the changed pixels down the
+    cut lines the pixels of the nodes were split at. Routing stops at nodes with a single child, whose other side is
+    unknown.
+    """
+    dirty = np.zeros(len(tree), dtype=bool)
+    nodes = np.zeros(len(changed), dtype=np.int64)
+    points = changed
+    while len(points) > 0:
+        dirty[nodes] = True
+        go = tree.child_count[nodes] == 2
+        order = np.argsort(nodes[go], kind="stable")
+        points, nodes = points[go][order], nodes[go][order]
+        unique_nodes, counts = np.unique(nodes, return_counts=True)
+        second = _split_sides(points, counts, cuts[unique_nodes])
+        nodes = tree.first_child[nodes] + second
+    return dirty
+
+
+def refit_tree(tree, points, changed, max_depth=3, min_pixels=10, stats=None, cuts=None):
+    """
+    Updates the tree of a segment whose pixel set changed slightly. The pixels are routed down the cut lines of the
+    old tree. Subtrees without changed pixels are taken over, the boxes of the other nodes are fitted to their new
+    pixels, and where the old tree has no cut line to follow the subtree is built from scratch. The boxes contain their
+    pixels and are fitted like in create_obb_tree, but refit nodes keep the cut line their pixels were split at before,
+    so the result differs from a tree built from scratch as soon as a box moved. That cut line no longer follows from
+    the box of the node, it is returned to route the pixels of the next refit.
+    :param tree: OBBTree of the segment in the previous frame.
+    :param points: (P, 2) pixel indices of the segment in the current frame.
+    :param changed: (Q, 2) pixels added to or removed from the segment.
+    :param stats: Optional FrameStats to count the fitted and reused boxes in.
+    :param cuts: (N, 4, 2) boxes whose cut lines split the pixels of the nodes of tree, as returned by the previous
+     refit_tree call. Defaults to the boxes of tree, which holds for trees built from scratch.
+    :return: OBBTree of the segment with the segment label of tree, and the (M, 4, 2) boxes of its cut lines.
+    """
+    cuts = tree.corners if cuts is None else cuts
+    dirty = _dirty_nodes(tree, cuts, changed)
+    blocks = []  # (corners, width, height, depth, parent, count, cuts) of newly created nodes, in creation order
+    num_nodes = 0
+    queue = [(0, points, -1)]
+    for old, node_points, parent in queue:
+        depth = int(tree.depth[old])
+        if not dirty[old]:
+            ids = _subtree(tree, old)
+            position = np.full(len(tree), -1, dtype=np.int64)
+            position[ids] = num_nodes + np.arange(len(ids))
+            parents = position[tree.parent[ids]]
+            parents[0] = parent
+            blocks.append((tree.corners[ids], tree.width[ids], tree.height[ids], tree.depth[ids], parents,
+                           tree.count[ids], cuts[ids]))
+            if stats is not None:
+                stats.reused_nodes += len(ids)
+        elif len(node_points) == 0:
+            # all pixels of the node were removed
+            continue
+        elif tree.child_count[old] == 2 and len(node_points) >= min_pixels and depth < max_depth:
+            starts, counts = np.zeros(1, dtype=np.int64), np.array([len(node_points)])
+            corners, width, height = _fit_boxes(node_points, starts, counts, _segment_moments(node_points, starts))
+            blocks.append((corners, width, height, np.array([depth]), np.array([parent]), counts, cuts[old][None]))
+            # the pixels follow the old cut line, so the subtrees on both sides stay valid
+            second = _split_sides(node_points, counts, cuts[old][None])
+            first_child = int(tree.first_child[old])
+            queue.append((first_child, node_points[~second], num_nodes))
+            queue.append((first_child + 1, node_points[second], num_nodes))
+            if stats is not None:
+                stats.fitted_nodes += 1
+        else:
+            sub_tree = _build_levels(node_points, np.array([len(node_points)]), np.zeros(1, dtype=np.int32), max_depth,
+                                     min_pixels, depth=depth)
+            blocks.append((sub_tree.corners, sub_tree.width, sub_tree.height, sub_tree.depth,
+                           np.where(sub_tree.parent >= 0, sub_tree.parent + num_nodes, parent), sub_tree.count,
+                           sub_tree.corners))
+            if stats is not None:
+                stats.fitted_nodes += len(sub_tree)
+        num_nodes += len(blocks[-1][3])
+
+    corners, width, height, depth, parent, count, new_cuts = [np.concatenate(field) for field in zip(*blocks)]
+    return (OBBTree.from_parents(corners, width, height, depth, parent, tree.segment[0], count),
+            new_cuts[_level_order(depth, parent)[0]])
+
+
+class SequenceForest:
+    """
+    OBB forests of a sequence of label images in which most segments change little from frame to frame. The segments
+    of each frame are matched to the segments of the previous frame by pixel overlap, and by shape moments for segments
+    that moved without overlapping their old position:
+    - segments with the same pixel set reuse their tree,
+    - segments shifted by whole pixels get their tree translated,
+    - segments with at most max_change changed pixels (relative to their size) are refit with refit_tree,
+    - all other segments are built from scratch, in one batch.
+    Labels do not have to be stable over the frames, e.g. when every frame is labeled on its own. The trees of
+    unchanged segments are taken over from the previous forest in one selection, only the changed segments are handled
+    one by one.
+
+        sequence = SequenceForest(max_depth=5)
+        for labels in frames:
+            forest = sequence.update(labels)
+    """
+
+    def __init__(self, max_depth=3, min_pixels=10, min_overlap=0.5, max_change=0.25):
+        """
+        :param min_overlap: Fraction of the pixels of the larger of two segments that have to overlap for a match.
+        :param max_change: Largest number of added plus removed pixels, relative to the segment size, for which a
+         tree is refit instead of rebuilt. 0 rebuilds every changed segment, so that all trees equal trees built from
+         scratch up to the rounding of translated boxes.
+        """
+        self.max_depth = max_depth
+        self.min_pixels = min_pixels
+        self.min_overlap = min_overlap
+        self.max_change = max_change
+        self.stats = FrameStats()  # statistics of the last update
+        self.reset()
+
+    def reset(self):
+        self.forest = OBBTree.empty()
+        self._cuts = np.zeros((0, 4, 2))  # boxes whose cut lines split the pixels of the nodes of the forest
+        self._labels = None
+        self._moments = None
+
+    def update(self, labels):
+        """
+        Computes the forest of the next frame.
+        :param labels: Label image of the frame. A value of 0 is treated as background.
+        :return: OBBTree of all segments of the frame, the trees are not ordered by label.
+        """
+        labels = np.asarray(labels)
+        moments = label_moments(labels)
+        stats = FrameStats()
+        if self._labels is None or self._labels.shape != labels.shape:
+            forest = build_obb_trees(group_indices_by_label(labels), max_depth=self.max_depth,
+                                     min_pixels=self.min_pixels)
+            cuts = forest.corners
+            stats.rebuilt = int(np.count_nonzero(forest.parent == -1))
+        else:
+            forest, cuts = self._match(labels, moments, stats)
+
+        self.forest = forest
+        self._cuts = cuts
+        self._labels = labels.copy()
+        self._moments = moments
+        self.stats = stats
+        return self.forest
+
+    def _match(self, labels, moments, stats):
+        # takes over the trees of unchanged segments, translates, refits or rebuilds the trees of the others
+        previous_moments = self._moments
+        counts, previous_counts = moments[:, 0], previous_moments[:, 0]
+        previous_labels, current_labels, overlap = _overlaps(self._labels, labels, counts)
+        # best overlapping previous segment of every current segment
+        order = np.lexsort((-overlap, current_labels))
+        current_labels, first = np.unique(current_labels[order], return_index=True)
+        partner = np.zeros(len(moments), dtype=np.int64)
+        shared = np.zeros(len(moments), dtype=np.int64)
+        partner[current_labels] = previous_labels[order][first]
+        shared[current_labels] = overlap[order][first]
+
+        present = np.flatnonzero(counts)
+        present = present[present > 0]
+        unchanged = (partner[present] > 0) & (shared[present] == counts[present])
+        unchanged &= counts[present] == previous_counts[partner[present]]
+        # new label of every previous segment whose tree is taken over
+        new_label = np.zeros(len(previous_moments), dtype=np.int32)
+        new_label[partner[present[unchanged]]] = present[unchanged]
+        keep = new_label[self.forest.segment] > 0
+        kept = self.forest.select(keep)
+        kept.segment = new_label[kept.segment]
+        stats.unchanged = int(np.count_nonzero(unchanged))
+        trees, cuts = [kept], [self._cuts[keep]]
+
+        changed = present[~unchanged]
+        if len(changed) > 0:
+            rebuild = self._update_changed(labels, moments, changed, partner, shared, stats, trees, cuts)
+            if len(rebuild) > 0:
+                stats.rebuilt = len(rebuild)
+                trees.append(build_obb_trees(_gather_pixels(labels, rebuild, len(moments)), max_depth=self.max_depth,
+                                             min_pixels=self.min_pixels, labels=rebuild))
+                cuts.append(trees[-1].corners)
+        return _concatenate(trees, cuts)
+
+    def _update_changed(self, labels, moments, changed, partner, shared, stats, trees, cuts):
+        # appends the translated and refit trees of the changed segments to trees and cuts, returns the labels to build
+        # from scratch
+        previous_moments = self._moments
+        counts, previous_counts = moments[:, 0], previous_moments[:, 0]
+        pixels = _gather_pixels(labels, changed, len(moments))
+        roots = np.flatnonzero(self.forest.parent == -1)
+        root_of = np.full(len(previous_moments), -1, dtype=np.int64)
+        root_of[self.forest.segment[roots]] = roots
+
+        # previous segments of the same shape, the candidates for a shift, grouped by shape
+        previous_present = np.flatnonzero(previous_counts)
+        previous_present = previous_present[previous_present > 0]
+        keys = _shape_keys(np.concatenate([previous_moments[previous_present], moments[changed]]))
+        shape = np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1)
+        previous_shape, shape = shape[:len(previous_present)], shape[len(previous_present):]
+        by_shape = np.argsort(previous_shape, kind="stable")
+        starts = np.searchsorted(previous_shape[by_shape], shape, side="left")
+        ends = np.searchsorted(previous_shape[by_shape], shape, side="right")
+
+        # the pixels of the refit partners are gathered together
+        refit = (partner[changed] > 0) & (shared[changed] >= self.min_overlap * np.maximum(
+            counts[changed], previous_counts[partner[changed]]))
+        previous_pixels = _gather_pixels(self._labels, partner[changed][refit], len(previous_moments))
+
+        rebuild = []
+        for label, can_refit, start, end in zip(changed.tolist(), refit.tolist(), starts.tolist(), ends.tolist()):
+            old = int(partner[label])
+            points = pixels.segment(label)
+            # candidates for a shift: the overlapping segment first, then the segments of the same shape, nearest first
+            candidates = previous_present[by_shape[start:end]]
+            if len(candidates) > 0:
+                offsets = moments[label, 1:3] - previous_moments[candidates, 1:3]
+                whole = np.all(offsets % counts[label] == 0, axis=1)
+                candidates, offsets = candidates[whole], offsets[whole] // counts[label]
+                distance = np.sum(offsets.astype(np.float64) ** 2, axis=1)
+                order = np.lexsort((distance, candidates != old))
+                moved = self._translated(points, candidates[order], offsets[order], root_of)
+                if moved is not None:
+                    tree, tree_cuts = moved
+                    tree.segment[:] = label
+                    trees.append(tree)
+                    cuts.append(tree_cuts)
+                    stats.moved += 1
+                    continue
+
+            if can_refit:
+                previous_points = previous_pixels.segment(old)
+                # both pixel lists are in row-major order, the changed pixels are their symmetric difference
+                width = labels.shape[1]
+                changed_ids = np.setxor1d(points[:, 0] * width + points[:, 1],
+                                          previous_points[:, 0] * width + previous_points[:, 1], assume_unique=True)
+                if len(changed_ids) <= self.max_change * len(points):
+                    tree, old_cuts = _segment_tree(self.forest, self._cuts, root_of[old])
+                    tree.segment[:] = label
+                    tree, tree_cuts = refit_tree(tree, points, np.stack(np.divmod(changed_ids, width), axis=1),
+                                                 self.max_depth, self.min_pixels, stats, cuts=old_cuts)
+                    trees.append(tree)
+                    cuts.append(tree_cuts)
+                    stats.refit += 1
+                    continue
+            rebuild.append(label)
+        return rebuild
+
+    def _translated(self, points, candidates, offsets, root_of):
+        # tree and cuts of the first candidate whose pixel set shifted by its offset is points, translated by the
+        # offset. A candidate has as many pixels as points, so the sets are equal if all pixels of points shifted back
+        # belong to the candidate in the previous frame.
+        shape = np.array(self._labels.shape)
+        for old, offset in zip(candidates.tolist(), offsets):
+            shifted = points - offset
+            if np.any(shifted < 0) or np.any(shifted >= shape):
+                continue
+            if np.all(self._labels[shifted[:, 0], shifted[:, 1]] == old):
+                tree, old_cuts = _segment_tree(self.forest, self._cuts, root_of[old])
+                tree.corners += offset
+                return tree, old_cuts + offset
+        return None
+
+
+def build_sequence_forests(frames, max_depth=3, min_pixels=10, min_overlap=0.5, max_change=0.25):
+    """
+    Forests of a sequence of label images, see SequenceForest.
+    :return: generator of the OBBTree of every frame.
+    """
+    sequence = SequenceForest(max_depth=max_depth, min_pixels=min_pixels, min_overlap=min_overlap,
+                              max_change=max_change)
+    for labels in frames:
+        yield sequence.update(labels)
@@ -0,0 +1,200 @@
+import json
+import os
+import struct
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
+
+from obb_tree.obb import SegmentIndices
+from obb_tree.tree import OBBTree
+
+# File layout: a FILE_HEADER_SIZE byte header (magic, format version) followed by any number of records, one per image.
+# A record starts with a fixed prefix (magic, length of the JSON description, size of the whole record), followed by
+# the JSON description of its arrays and the raw array data. Every array starts at a multiple of ALIGNMENT bytes from
+# the start of the file, so all of them can be used directly as views of one memory map.
+MAGIC = b"OBBTREE\0"
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct("<8sI")
+FILE_HEADER_SIZE = 64
+RECORD_MAGIC = b"OBBR"
+RECORD_PREFIX = struct.Struct("<4sIQ")
+ALIGNMENT = 64
+
+TREE_FIELDS = tuple(OBBTree.__dataclass_fields__)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+@dataclass
+class StoredResult:
+    """
+    Result of one image as read from a result file. All arrays are read-only views of the memory-mapped file.
+    """
+    tree: OBBTree
+    labels: Optional[np.ndarray] = None  # label image
+    segments: Optional[SegmentIndices] = None  # pixel indices of the segments, indices may be empty if not stored
+    name: Optional[str] = None
+    metadata: dict = field(default_factory=dict)
+
+
+class ResultWriter:
+    """
+    Writes results to a result file record by record, so batch jobs can stream one image after the other into a
+    single file. With append=True an existing file is continued instead of replaced.
+
+        with ResultWriter("trees.obb", append=True) as writer:
+            writer.write(tree, labels=labels, name="scan_001")
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                _read_file_header(f)
+            self._file = open(path, "r+b")
+            # a record cut short by a crashed writer is overwritten
+            self._file.seek(_records_end(self._file))
+            self._file.truncate()
+        else:
+            self._file = open(path, "wb")
+            self._file.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION).ljust(FILE_HEADER_SIZE, b"\0"))
+
+    def write(self, tree, labels=None, segments=None, name=None, metadata=None, store_indices=True):
+        """
+        Appends the result of one image.
+        :param tree: OBBTree (forest) of the image.
+        :param labels: Optional label image.
+        :param segments: Optional SegmentIndices of the image. The offsets give the pixel range of every segment.
+        :param store_indices: Store the pixel indices of the segments too, otherwise only their offsets.
+        """
+        arrays = {"tree." + key: getattr(tree, key) for key in TREE_FIELDS}
+        if labels is not None:
+            arrays["labels"] = labels
+        if segments is not None:
+            arrays["segments.offsets"] = segments.offsets
+            if store_indices:
+                arrays["segments.indices"] = segments.indices
+        # arrays are stored in little-endian byte order
+        arrays = {key: np.asarray(array).astype(np.asarray(array).dtype.newbyteorder("<"), copy=False)
+                  for key, array in arrays.items()}
+
+        start = self._file.tell()
+        description = {"name": name, "metadata": metadata or {}, "arrays": {}}
+        # the description holds the offsets of the arrays, which depend on its length: move the data behind it until
+        # it fits
+        data_start = start + RECORD_PREFIX.size
+        while True:
+            offset = _align(data_start)
+            for key, array in arrays.items():
+                description["arrays"][key] = {"dtype": array.dtype.str, "shape": list(array.shape),
+                                              "offset": offset - start}
+                offset = _align(offset + array.nbytes)
+            header = json.dumps(description).encode()
+            if start + RECORD_PREFIX.size + len(header) <= data_start:
+                break
+            data_start = start + RECORD_PREFIX.size + len(header)
+
+        self._file.write(RECORD_PREFIX.pack(RECORD_MAGIC, len(header), offset - start))
+        self._file.write(header)
+        for key, array in arrays.items():
+            self._file.seek(start + description["arrays"][key]["offset"])
+            self._file.write(np.ascontiguousarray(array).data)
+        # pad the record to its full size, the next one starts aligned
+        self._file.seek(offset - 1)
+        self._file.write(b"\0")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_file_header(f):
+    magic, version = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not an OBB tree result file")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"result file version {version} is newer than the supported version {FORMAT_VERSION}")
+    return version
+
+
+def _scan_records(f):
+    # yields (record start, record size, description) of all complete records, reading only the record headers
+    size = f.seek(0, os.SEEK_END)
+    start = FILE_HEADER_SIZE
+    while start + RECORD_PREFIX.size <= size:
+        f.seek(start)
+        magic, header_length, record_size = RECORD_PREFIX.unpack(f.read(RECORD_PREFIX.size))
+        if magic != RECORD_MAGIC or start + record_size > size:
+            break
+        yield start, record_size, json.loads(f.read(header_length))
+        start += record_size
+
+
+def _records_end(f):
+    end = FILE_HEADER_SIZE
+    for start, record_size, _ in _scan_records(f):
+        end = start + record_size
+    return end
+
+
+class ResultFile:
+    """
+    Read access to a result file. The file is memory-mapped once, the records are views into the map: opening a
+    record copies nothing, and several processes reading the same file share its pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.version = _read_file_header(f)
+            self._records = list(_scan_records(f))
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def names(self):
+        return [description["name"] for _, _, description in self._records]
+
+    def find(self, name):
+        return self[self.names.index(name)]
+
+    def __getitem__(self, i):
+        start, _, description = self._records[i]
+        arrays = {key: np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=self._map,
+                                  offset=start + spec["offset"])
+                  for key, spec in description["arrays"].items()}
+        segments = None
+        if "segments.offsets" in arrays:
+            indices = arrays.get("segments.indices", np.zeros((0, 2), dtype=np.int64))
+            segments = SegmentIndices(indices=indices, offsets=arrays["segments.offsets"])
+        return StoredResult(tree=OBBTree(**{name: arrays["tree." + name] for name in TREE_FIELDS}),
+                            labels=arrays.get("labels"), segments=segments, name=description["name"],
+                            metadata=description["metadata"])
+
+
+def save_result(path, tree, labels=None, segments=None, name=None, metadata=None):
+    """
+    Writes the result of one image to a new result file.
+    """
+    with ResultWriter(path) as writer:
+        writer.write(tree, labels=labels, segments=segments, name=name, metadata=metadata)
+
+
+def load_result(path, index=0):
+    """
+    Opens one record of a result file without reading its arrays into memory.
+    """
+    return ResultFile(path)[index]
@@ -0,0 +1,233 @@
+import numpy as np
+from dataclasses import dataclass
+from scipy import ndimage
+
+from obb_tree.builder import build_obb_trees
+from obb_tree.obb import SegmentIndices
+from obb_tree.tree import OBBTree
+
+
+def _label(mask, connectivity):
+    from skimage import measure
+    return measure.label(mask, background=0, connectivity=connectivity)
+
+
+class _UnionFind:
+    """
+    Union-find over provisional labels. The root of a set is always its smallest label, so the final labels follow
+    the order in which the provisional labels were handed out.
+    """
+
+    def __init__(self):
+        self.size = 1  # label 0 is the background
+        self.parent = np.zeros(1024, dtype=np.int64)
+
+    def add(self, count):
+        """
+        Adds count new labels, each in a set of its own.
+        :return: the first new label.
+        """
+        start = self.size
+        if start + count > len(self.parent):
+            # grow geometrically, tiles add labels many times
+            self.parent = np.resize(self.parent, max(2 * len(self.parent), start + count))
+        self.parent[start:start + count] = np.arange(start, start + count)
+        self.size += count
+        return start
+
+    def find(self, label):
+        parent = self.parent
+        while parent[label] != label:
+            # path halving
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def roots(self):
+        # pointer jumping resolves the root of every label at once
+        roots = self.parent[:self.size].copy()
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                return roots
+            roots = next_roots
+
+
+@dataclass
+class TiledLabels:
+    """
+    Connected components of an image labeled tile by tile. Per-segment statistics are indexed by label, index 0 is
+    the background.
+    """
+    labels: np.ndarray  # (H, W) int32 label image, usually a memory map
+    counts: np.ndarray  # (L,) int64 number of pixels per label
+    moments: np.ndarray  # (L, 6) int64 raw moments (n, sum x, sum y, sum xx, sum xy, sum yy) per label
+    bboxes: np.ndarray  # (L, 4) int64 row start, row end, col start, col end per label, 0 for the background
+
+    @property
+    def num_labels(self):
+        return len(self.counts)
+
+
+def iter_tiles(shape, tile_shape):
+    """
+    Yields the (row start, row end, col start, col end) of all tiles in row-major order.
+    """
+    for r0 in range(0, shape[0], tile_shape[0]):
+        for c0 in range(0, shape[1], tile_shape[1]):
+            yield r0, min(r0 + tile_shape[0], shape[0]), c0, min(c0 + tile_shape[1], shape[1])
+
+
+def _seam_pairs(neighbours, edge, connectivity):
+    # label pairs across a seam: neighbours is the already labeled line next to the edge of the tile, padded by one
+    # pixel on both ends, so that with 8-connectivity the diagonal neighbours are compared too
+    offsets = (-1, 0, 1) if connectivity == 2 else (0,)
+    n = len(edge)
+    pairs = np.concatenate([np.stack([neighbours[1 + d:1 + d + n], edge], axis=1) for d in offsets])
+    pairs = pairs[(pairs[:, 0] > 0) & (pairs[:, 1] > 0)]
+    return np.unique(pairs, axis=0)
+
+
+def _tile_statistics(local, num_local, r0, c0):
+    # pixel counts, raw moments and bounding boxes of the local labels 1..num_local of one tile
+    rows, cols = np.indices(local.shape, dtype=np.int64)
+    rows += r0
+    cols += c0
+    flat = local.ravel()
+    foreground = flat > 0
+    flat, x, y = flat[foreground], rows.ravel()[foreground], cols.ravel()[foreground]
+    moments = np.zeros((num_local + 1, 6), dtype=np.int64)
+    moments[:, 0] = np.bincount(flat, minlength=num_local + 1)
+    for column, values in enumerate((x, y, x * x, x * y, y * y), start=1):
+        # sums of the int64 values are exact, np.add.at avoids the float weights of bincount
+        np.add.at(moments[:, column], flat, values)
+
+    bboxes = np.zeros((num_local + 1, 4), dtype=np.int64)
+    for label, box in enumerate(ndimage.find_objects(local), start=1):
+        if box is not None:
+            bboxes[label] = (box[0].start + r0, box[0].stop + r0, box[1].start + c0, box[1].stop + c0)
+    return moments[1:], bboxes[1:]
+
+
+def label_tiled(mask, output, tile_shape=(1024, 1024), connectivity=2):
+    """
+    Connected component labeling of an image that does not fit into memory. The image is labeled tile by tile,
+    components that continue across a tile seam are merged with a union-find over the provisional labels, and a second
+    pass over the tiles writes the final labels. Only one tile of the input is held in memory at a time.
+    :param mask: (H, W) array, e.g. a memory-mapped .npy file. Non-zero pixels are foreground.
+    :param output: Path of the .npy file the int32 label image is written to, or a writable (H, W) int32 array.
+    :param tile_shape: (rows, cols) of the tiles.
+    :return: TiledLabels with the label image, pixel counts, raw moments and bounding boxes of all segments. Labels are
+     numbered in the order in which the row-major pass over the tiles first reaches the segments.
+    """
+    if isinstance(output, str):
+        output = np.lib.format.open_memmap(output, mode="w+", dtype=np.int32, shape=mask.shape)
+    height, width = mask.shape
+
+    union_find = _UnionFind()
+    tile_moments = [np.zeros((1, 6), dtype=np.int64)]
+    tile_bboxes = [np.zeros((1, 4), dtype=np.int64)]
+    for r0, r1, c0, c1 in iter_tiles(mask.shape, tile_shape):
+        local = _label(np.asarray(mask[r0:r1, c0:c1]) != 0, connectivity)
+        num_local = int(local.max())
+        if union_find.size + num_local > np.iinfo(np.int32).max:
+            raise OverflowError("too many provisional labels for an int32 label image, use larger tiles")
+        offset = union_find.add(num_local) - 1
+        moments, bboxes = _tile_statistics(local, num_local, r0, c0)
+        tile_moments.append(moments)
+        tile_bboxes.append(bboxes)
+        provisional = np.where(local > 0, local + offset, 0).astype(np.int32)
+        output[r0:r1, c0:c1] = provisional
+
+        # the tiles above and to the left are labeled already, connect the components touching them
+        pairs = []
+        if r0 > 0:
+            neighbours = np.zeros(c1 - c0 + 2, dtype=np.int64)
+            lo, hi = max(c0 - 1, 0), min(c1 + 1, width)
+            neighbours[lo - c0 + 1:hi - c0 + 1] = output[r0 - 1, lo:hi]
+            pairs.append(_seam_pairs(neighbours, provisional[0], connectivity))
+        if c0 > 0:
+            # the row below the tile is not labeled yet, its diagonal is handled by the seam of the tile below
+            neighbours = np.zeros(r1 - r0 + 2, dtype=np.int64)
+            lo = max(r0 - 1, 0)
+            neighbours[lo - r0 + 1:r1 - r0 + 1] = output[lo:r1, c0 - 1]
+            pairs.append(_seam_pairs(neighbours, provisional[:, 0], connectivity))
+        for a, b in np.concatenate(pairs) if len(pairs) > 0 else ():
+            union_find.union(int(a), int(b))
+
+    # final labels: the sets of provisional labels numbered by their smallest member
+    roots = union_find.roots()
+    unique_roots, final = np.unique(roots, return_inverse=True)
+    final = final.astype(np.int32)
+    num_labels = len(unique_roots)
+
+    provisional_moments = np.concatenate(tile_moments)
+    provisional_bboxes = np.concatenate(tile_bboxes)
+    moments = np.zeros((num_labels, 6), dtype=np.int64)
+    np.add.at(moments, final, provisional_moments)
+    moments[0] = 0
+    bboxes = np.zeros((num_labels, 4), dtype=np.int64)
+    bboxes[:, [0, 2]] = np.iinfo(np.int64).max
+    np.minimum.at(bboxes[:, 0], final, provisional_bboxes[:, 0])
+    np.maximum.at(bboxes[:, 1], final, provisional_bboxes[:, 1])
+    np.minimum.at(bboxes[:, 2], final, provisional_bboxes[:, 2])
+    np.maximum.at(bboxes[:, 3], final, provisional_bboxes[:, 3])
+    bboxes[0] = 0
+
+    for r0, r1, c0, c1 in iter_tiles(mask.shape, tile_shape):
+        output[r0:r1, c0:c1] = final[output[r0:r1, c0:c1]]
+    if isinstance(output, np.memmap):
+        output.flush()
+    return TiledLabels(labels=output, counts=moments[:, 0].copy(), moments=moments, bboxes=bboxes)
+
+
+def segment_pixels(labels, label, bbox, band_rows=1024):
+    """
+    Pixel indices of one segment in row-major order, read from its bounding box in bands of band_rows rows, so that
+    at most one band of the label image is in memory besides the indices.
+    """
+    r0, r1, c0, c1 = bbox
+    pieces = []
+    for start in range(r0, r1, band_rows):
+        end = min(start + band_rows, r1)
+        pieces.append(np.argwhere(np.asarray(labels[start:end, c0:c1]) == label) + [start, c0])
+    return np.concatenate(pieces) if len(pieces) > 0 else np.zeros((0, 2), dtype=np.int64)
+
+
+def iter_tiled_forests(tiled, max_depth=3, min_pixels=10, chunk_pixels=1 << 20, band_rows=1024):
+    """
+    Builds the trees of all segments of a TiledLabels in batches of consecutive labels with about chunk_pixels pixels
+    each. Peak memory is bounded by one band of the label image plus the pixel indices of one batch, a segment larger
+    than chunk_pixels forms a batch of its own.
+    :return: generator of OBBTree forests, one per batch, with the segment labels of tiled.
+    """
+    labels = np.flatnonzero(tiled.counts)
+    labels = labels[labels > 0]
+    # batch boundaries where the running pixel count crosses a multiple of chunk_pixels
+    cumulative = np.cumsum(tiled.counts[labels])
+    cuts = np.flatnonzero(np.diff(cumulative // chunk_pixels)) + 1
+    for batch in np.split(labels, cuts):
+        if len(batch) == 0:
+            continue
+        pieces = [segment_pixels(tiled.labels, label, tiled.bboxes[label], band_rows) for label in batch]
+        # the batch is built with local labels 1..k, which are mapped back afterwards
+        offsets = np.zeros(len(batch) + 2, dtype=np.int64)
+        np.cumsum([len(piece) for piece in pieces], out=offsets[2:])
+        segments = SegmentIndices(indices=np.concatenate(pieces), offsets=offsets)
+        forest = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels)
+        forest.segment = batch[forest.segment - 1].astype(np.int32)
+        yield forest
+
+
+def build_tiled_forest(tiled, max_depth=3, min_pixels=10, chunk_pixels=1 << 20, band_rows=1024):
+    """
+    Builds the trees of all segments of a TiledLabels, see iter_tiled_forests.
+    :return: OBBTree holding the trees of all segments as one forest.
+    """
+    return OBBTree.concatenate(list(iter_tiled_forests(tiled, max_depth=max_depth, min_pixels=min_pixels,
+                                                       chunk_pixels=chunk_pixels, band_rows=band_rows)))
@@ -0,0 +1,218 @@
+import numpy as np
+from dataclasses import dataclass
+
+from obb_tree.obb import OBB
+
+
+def _level_order(depth, parent):
+    """
+    Level order of nodes given by their depth and parent, see OBBTree.from_parents.
+    :return: (N,) node of every position in level order, and (N,) position of every node.
+    """
+    order = []
+    new_index = np.full(len(depth), -1, dtype=np.int64)
+    for level in range(int(depth.max()) + 1 if len(depth) > 0 else 0):
+        nodes = np.flatnonzero(depth == level)
+        if level > 0:
+            nodes = nodes[np.argsort(new_index[parent[nodes]], kind="stable")]
+        new_index[nodes] = len(order) + np.arange(len(nodes))
+        order.extend(nodes.tolist())
+    return np.array(order, dtype=np.int64), new_index
+
+
+@dataclass
+class OBBTree:
+    """
+    Flat, array-backed OBB tree (or forest of trees). Node i is described by the i-th entry of every array.
+    Nodes are stored in level order: all nodes of depth d are contiguous and precede the nodes of depth d + 1, and the
+    children of a node are contiguous, starting at first_child. Roots have parent -1, leaves have first_child -1.
+    """
+    corners: np.ndarray  # (N, 4, 2) float64
+    width: np.ndarray  # (N,) float64
+    height: np.ndarray  # (N,) float64
+    depth: np.ndarray  # (N,) int32
+    parent: np.ndarray  # (N,) int32
+    first_child: np.ndarray  # (N,) int32
+    child_count: np.ndarray  # (N,) int32
+    segment: np.ndarray  # (N,) int32, label of the segment the node belongs to
+    count: np.ndarray  # (N,) int64, number of pixels in the node, -1 if unknown
+
+    @classmethod
+    def empty(cls):
+        return cls(corners=np.zeros((0, 4, 2)), width=np.zeros(0), height=np.zeros(0),
+                   depth=np.zeros(0, dtype=np.int32), parent=np.zeros(0, dtype=np.int32),
+                   first_child=np.zeros(0, dtype=np.int32), child_count=np.zeros(0, dtype=np.int32),
+                   segment=np.zeros(0, dtype=np.int32), count=np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.depth)
+
+    @property
+    def num_nodes(self):
+        return len(self.depth)
+
+    @property
+    def max_depth(self):
+        return int(self.depth[-1]) if len(self.depth) > 0 else -1
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__dataclass_fields__)
+
+    @property
+    def is_leaf(self):
+        return self.child_count == 0
+
+    def level(self, depth):
+        """
+        Returns the slice of all nodes at the given depth. Indexing the node arrays with it yields views.
+        """
+        start, end = np.searchsorted(self.depth, (depth, depth + 1))
+        return slice(int(start), int(end))
+
+    def roots(self):
+        return self.level(self.depth[0] if len(self.depth) > 0 else 0)
+
+    def children(self, node):
+        start = int(self.first_child[node])
+        return slice(start, start + int(self.child_count[node])) if start >= 0 else slice(0, 0)
+
+    def leaves(self):
+        # leaves of different depths are not contiguous, so their indices are returned instead of a slice
+        return np.flatnonzero(self.child_count == 0)
+
+    def obb(self, node):
+        return OBB(corners=self.corners[node], width=self.width[node], height=self.height[node],
+                   depth=int(self.depth[node]))
+
+    def select(self, keep):
+        """
+        Returns the forest of the selected nodes, e.g. select(~np.isin(tree.segment, labels)) to drop the trees of some
+        segments. The selection must consist of whole trees so that no kept node refers to a dropped one.
+        :param keep: (N,) boolean node mask.
+        """
+        new_index = (np.cumsum(keep) - 1).astype(np.int32)
+        fields = {name: getattr(self, name)[keep] for name in self.__dataclass_fields__}
+        for name in ("parent", "first_child"):
+            fields[name] = np.where(fields[name] >= 0, new_index[np.maximum(fields[name], 0)], -1).astype(np.int32)
+        return OBBTree(**fields)
+
+    def truncate(self, depth):
+        """
+        Returns the tree cut off below the given depth. Equals the tree built with max_depth=depth.
+        """
+        end = self.level(depth).stop
+        fields = {name: getattr(self, name)[:end] for name in self.__dataclass_fields__}
+        leaves = fields["depth"] == depth
+        fields["first_child"] = np.where(leaves, -1, fields["first_child"]).astype(np.int32)
+        fields["child_count"] = np.where(leaves, 0, fields["child_count"]).astype(np.int32)
+        return OBBTree(**fields)
+
+    def segment_trees(self):
+        """
+        Splits a forest into the trees of its segments.
+        :return: sorted segment labels and a list with the OBBTree of each label.
+        """
+        # a stable sort by segment keeps the level order within each segment
+        order = np.argsort(self.segment, kind="stable")
+        labels, starts = np.unique(self.segment[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        new_index = np.empty(len(order), dtype=np.int32)
+        new_index[order] = np.arange(len(order)) - np.repeat(starts, ends - starts)
+
+        fields = {name: getattr(self, name)[order] for name in self.__dataclass_fields__}
+        for name in ("parent", "first_child"):
+            fields[name] = np.where(fields[name] >= 0, new_index[np.maximum(fields[name], 0)], -1).astype(np.int32)
+        trees = [OBBTree(**{name: values[start:end] for name, values in fields.items()})
+                 for start, end in zip(starts, ends)]
+        return labels, trees
+
+    @classmethod
+    def concatenate(cls, trees):
+        """
+        Merges several trees or forests into one forest. The result is in level order again: the nodes of each depth
+        are taken from the inputs in the given order, so concatenating the forests of consecutive label ranges gives
+        the same forest as building all labels at once.
+        """
+        trees = [tree for tree in trees if len(tree) > 0]
+        if len(trees) == 0:
+            return cls.empty()
+        if len(trees) == 1:
+            return trees[0]
+
+        # stack the trees, shifting their node references by the offset of each tree
+        offsets = np.repeat(np.cumsum([0] + [len(tree) for tree in trees[:-1]]), [len(tree) for tree in trees])
+        fields = {name: np.concatenate([getattr(tree, name) for tree in trees]) for name in cls.__dataclass_fields__}
+        # a stable sort by depth restores the level order and keeps the tree order within each level
+        order = np.argsort(fields["depth"], kind="stable")
+        new_index = np.empty(len(order), dtype=np.int32)
+        new_index[order] = np.arange(len(order))
+        for name in ("parent", "first_child"):
+            fields[name] = np.where(fields[name] >= 0, new_index[np.maximum(fields[name] + offsets, 0)], -1)
+        return cls(**{name: values[order].astype(getattr(trees[0], name).dtype, copy=False)
+                      for name, values in fields.items()})
+
+    @classmethod
+    def from_nested(cls, trees, segments=None):
+        """
+        Converts trees in the nested form returned by create_obb_tree into the flat representation. The nested form does
+        not record pixel counts, so count is -1 for all nodes.
+        :param trees: A single (obb, sub_trees) tuple or a list of them, one per segment.
+        :param segments: Optional segment label per tree. Defaults to 0 for a single tree and to 1, 2, ... for a list.
+        :return: OBBTree with all trees as one forest.
+        """
+        if isinstance(trees, tuple):
+            trees = [trees]
+            segments = [0] if segments is None else segments
+        elif segments is None:
+            segments = range(1, len(trees) + 1)
+
+        # breadth first traversal, node i of the flat tree is queue[i]
+        queue = [(tree, -1, -1, segment) for tree, segment in zip(trees, segments)]
+        first_child = []
+        child_count = []
+        depth = []
+        i = 0
+        while i < len(queue):
+            (obb, sub_trees), parent, parent_depth, _ = queue[i]
+            depth.append(obb.depth if obb.depth is not None else parent_depth + 1)
+            first_child.append(len(queue) if len(sub_trees) > 0 else -1)
+            child_count.append(len(sub_trees))
+            queue.extend((sub_tree, i, depth[-1], queue[i][3]) for sub_tree in sub_trees)
+            i += 1
+
+        if len(queue) == 0:
+            return cls.empty()
+        return cls(corners=np.array([node[0][0].corners for node in queue], dtype=np.float64),
+                   width=np.array([node[0][0].width for node in queue], dtype=np.float64),
+                   height=np.array([node[0][0].height for node in queue], dtype=np.float64),
+                   depth=np.array(depth, dtype=np.int32),
+                   parent=np.array([node[1] for node in queue], dtype=np.int32),
+                   first_child=np.array(first_child, dtype=np.int32),
+                   child_count=np.array(child_count, dtype=np.int32),
+                   segment=np.array([node[3] for node in queue], dtype=np.int32),
+                   count=np.full(len(queue), -1, dtype=np.int64))
+
+    @classmethod
+    def from_parents(cls, corners, width, height, depth, parent, segment, count):
+        """
+        Builds the flat representation from nodes given in any order, as long as the children of every node appear in
+        their order and the depth of a child is the depth of its parent plus one. The nodes are sorted into level order
+        with the children of each node contiguous and the sibling groups of a level in the order of their parents.
+        :param parent: (N,) index of the parent of every node in the given order, -1 for roots.
+        :param segment: (N,) segment label of every node, or a single label for all nodes.
+        :return: OBBTree, node first_child and child_count are derived from the parents.
+        """
+        depth, parent = np.asarray(depth), np.asarray(parent)
+        if len(depth) == 0:
+            return cls.empty()
+        order, new_index = _level_order(depth, parent)
+        parent = np.where(parent[order] >= 0, new_index[np.maximum(parent[order], 0)], -1).astype(np.int32)
+        child_count = np.bincount(parent[parent >= 0], minlength=len(order)).astype(np.int32)
+        # parents precede their children, so the parent indices are sorted along the level order
+        first_child = np.where(child_count > 0, np.searchsorted(parent, np.arange(len(order))), -1).astype(np.int32)
+        segment = np.broadcast_to(np.asarray(segment, dtype=np.int32), depth.shape)
+        return cls(corners=np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)[order],
+                   width=np.asarray(width, dtype=np.float64)[order], height=np.asarray(height, dtype=np.float64)[order],
+                   depth=depth[order].astype(np.int32), parent=parent, first_child=first_child,
+                   child_count=child_count, segment=segment[order], count=np.asarray(count, dtype=np.int64)[order])
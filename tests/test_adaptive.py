@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from obb_tree.adaptive import build_adaptive_trees
+from obb_tree.obb import group_indices_by_label
+from obb_tree.tree import OBBTree
+
+
+def _segments(seed):
+    rng = np.random.default_rng(seed)
+    labels, _ = ndimage.label(ndimage.gaussian_filter(rng.random((150, 170)), 3) > 0.52)
+    return group_indices_by_label(labels)
+
+
+def _assert_level_order(tree):
+    # levels follow each other, the nodes of a level are grouped by parent in parent order, and the children of
+    # every node are the contiguous range at first_child
+    assert np.all(np.diff(tree.depth) >= 0)
+    children = np.flatnonzero(tree.parent >= 0)
+    assert np.all(tree.parent[children] < children)
+    assert np.all(np.diff(tree.parent[children]) >= 0)
+    assert np.array_equal(np.bincount(tree.parent[children], minlength=len(tree)), tree.child_count)
+    internal = np.flatnonzero(tree.child_count > 0)
+    num_roots = len(tree) - len(children)
+    assert np.array_equal(tree.first_child[internal], np.searchsorted(tree.parent[children], internal) + num_roots)
+    assert np.all(tree.first_child[tree.child_count == 0] == -1)
+    assert np.all(tree.depth[children] == tree.depth[tree.parent[children]] + 1)
+
+
+@pytest.mark.parametrize("metric, max_error", [("fill", 0.3), ("boundary", 1.0)])
+@pytest.mark.parametrize("max_nodes", [50, 120, 301, 2000])
+def test_budget_trees_are_in_level_order(metric, max_error, max_nodes):
+    segments = _segments(0)
+    tree, errors = build_adaptive_trees(segments, max_error=max_error, max_nodes=max_nodes, metric=metric)
+    _assert_level_order(tree)
+    assert len(errors) == len(tree)
+    num_roots = np.count_nonzero(tree.parent == -1)
+    assert len(tree) <= max(max_nodes, num_roots)
+
+    # every node holds the pixels of its children
+    children = np.flatnonzero(tree.parent >= 0)
+    sums = np.bincount(tree.parent[children], weights=tree.count[children], minlength=len(tree))
+    assert np.array_equal(sums[tree.child_count > 0], tree.count[tree.child_count > 0])
+
+
+@pytest.mark.parametrize("metric, max_error", [("fill", 0.3), ("boundary", 1.0)])
+def test_unlimited_budget_equals_error_threshold(metric, max_error):
+    segments = _segments(1)
+    expected, expected_errors = build_adaptive_trees(segments, max_error=max_error, metric=metric, max_depth=10)
+    tree, errors = build_adaptive_trees(segments, max_error=max_error, metric=metric, max_depth=10,
+                                        max_nodes=10 ** 6)
+    for name in OBBTree.__dataclass_fields__:
+        assert np.array_equal(getattr(tree, name), getattr(expected, name)), name
+    np.testing.assert_allclose(errors, expected_errors)
+
+
+def test_from_parents_sorts_into_level_order():
+    tree, _ = build_adaptive_trees(_segments(2), max_error=0.3, max_nodes=400)
+    # shuffle the nodes, keeping the parent references valid
+    order = np.random.default_rng(0).permutation(len(tree))
+    new_index = np.empty(len(tree), dtype=np.int64)
+    new_index[order] = np.arange(len(tree))
+    parent = np.where(tree.parent >= 0, new_index[np.maximum(tree.parent, 0)], -1)[order]
+    shuffled = OBBTree.from_parents(tree.corners[order], tree.width[order], tree.height[order], tree.depth[order],
+                                    parent, tree.segment[order], tree.count[order])
+    _assert_level_order(shuffled)
+    assert np.array_equal(np.sort(shuffled.count), np.sort(tree.count))
+    assert np.array_equal(np.bincount(shuffled.depth), np.bincount(tree.depth))
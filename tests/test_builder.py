@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from obb_tree import builder
+from obb_tree.builder import build_obb_trees, build_root_obbs, extend_obb_tree
+from obb_tree.jit import NUMBA_AVAILABLE, create_sub_parts_jit, oriented_bounding_box_jit
+from obb_tree.obb import (boundary_pixels, compute_moments, create_obb_tree, create_sub_parts, group_indices_by_label,
+                          oriented_bounding_box_from_moments)
+from obb_tree.tree import OBBTree
+
+needs_numba = pytest.mark.skipif(not NUMBA_AVAILABLE, reason="numba not installed")
+BACKENDS = ["numpy", pytest.param("numba", marks=needs_numba)]
+
+
+def _labels(shape, seed):
+    # blobs of all sizes plus scattered single pixels
+    rng = np.random.default_rng(seed)
+    labels, _ = ndimage.label(ndimage.gaussian_filter(rng.random(shape), 3) > 0.52)
+    noise = rng.random(shape) < 0.002
+    labels[noise & (labels == 0)] = labels.max() + 1 + np.arange(np.count_nonzero(noise & (labels == 0)))
+    return labels
+
+
+def _reference(segments, max_depth, min_pixels):
+    labels = segments.labels()
+    labels = labels[labels > 0]
+    trees = [create_obb_tree(segments.segment(label), max_depth=max_depth, min_pixels=min_pixels) for label in labels]
+    return OBBTree.from_nested(trees, segments=labels)
+
+
+def _assert_same_trees(tree, reference):
+    # the nested trees do not record pixel counts
+    for name in ("depth", "parent", "first_child", "child_count", "segment"):
+        assert np.array_equal(getattr(tree, name), getattr(reference, name)), name
+    np.testing.assert_allclose(tree.corners, reference.corners, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(tree.width, reference.width, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(tree.height, reference.height, rtol=0, atol=1e-9)
+
+
+def _assert_counts(tree, segments):
+    roots = tree.parent == -1
+    assert np.array_equal(tree.count[roots], np.diff(segments.offsets)[tree.segment[roots]])
+    children = np.flatnonzero(~roots)
+    sums = np.bincount(tree.parent[children], weights=tree.count[children], minlength=len(tree))
+    assert np.array_equal(sums[tree.child_count > 0], tree.count[tree.child_count > 0])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("mode", ["full", "boundary"])
+@pytest.mark.parametrize("max_depth, min_pixels", [(0, 10), (3, 10), (8, 1)])
+def test_levels_match_recursive_trees(backend, seed, mode, max_depth, min_pixels):
+    labels = _labels((120 + 17 * seed, 150), seed)
+    segments = group_indices_by_label(labels if mode == "full" else boundary_pixels(labels))
+    tree = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels, backend=backend)
+    _assert_same_trees(tree, _reference(segments, max_depth, min_pixels))
+    _assert_counts(tree, segments)
+
+
+@pytest.mark.parametrize("window", [1, 7, 64])
+def test_windows_smaller_than_nodes(monkeypatch, window):
+    # the passes over a level and the in-place partition give the same trees for any window size
+    segments = group_indices_by_label(_labels((80, 90), 4))
+    expected = build_obb_trees(segments, max_depth=6, min_pixels=2, backend="numpy")
+    monkeypatch.setattr(builder, "_WINDOW", window)
+    tree = build_obb_trees(segments, max_depth=6, min_pixels=2, backend="numpy")
+    for name in OBBTree.__dataclass_fields__:
+        assert np.array_equal(getattr(tree, name), getattr(expected, name)), name
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_large_segment_matches_recursive_tree(backend):
+    # one segment much larger than a window, with pixels on the cut lines of its boxes
+    labels = np.zeros((300, 301), dtype=np.int32)
+    labels[10:290, 20:281] = 1
+    segments = group_indices_by_label(labels)
+    tree = build_obb_trees(segments, max_depth=6, min_pixels=10, backend=backend)
+    _assert_same_trees(tree, _reference(segments, 6, 10))
+    _assert_counts(tree, segments)
+
+
+def test_root_boxes_match_level_build():
+    labels = _labels((150, 130), 5)
+    segments = group_indices_by_label(labels)
+    roots = build_root_obbs(labels)
+    _assert_same_trees(roots, _reference(segments, 0, 10))
+    assert np.array_equal(roots.count, build_obb_trees(segments, max_depth=0).count)
+
+
+def test_extended_trees_match_deeper_build():
+    segments = group_indices_by_label(_labels((140, 140), 6))
+    points, _, _ = builder._gather_segments(segments)
+    tree = build_obb_trees(segments, max_depth=2, min_pixels=4, backend="numpy")
+    extended = extend_obb_tree(tree, points, max_depth=7, min_pixels=4)
+    expected = build_obb_trees(segments, max_depth=7, min_pixels=4, backend="numpy")
+    for name in OBBTree.__dataclass_fields__:
+        assert np.array_equal(getattr(extended, name), getattr(expected, name)), name
+
+
+def test_parallel_build_matches_single_process():
+    from obb_tree.parallel import build_obb_forest
+
+    labels = _labels((160, 160), 7)
+    tree = build_obb_forest(labels, max_depth=4, min_pixels=10, workers=2, chunk_pixels=1000)
+    expected = build_obb_trees(group_indices_by_label(labels), max_depth=4, min_pixels=10)
+    for name in OBBTree.__dataclass_fields__:
+        assert np.array_equal(getattr(tree, name), getattr(expected, name)), name
+
+
+@needs_numba
+@pytest.mark.parametrize("offset", [0, 40000])
+def test_compiled_build_matches_numpy(offset):
+    # the offsets select int16 and int32 buffers
+    segments = group_indices_by_label(_labels((130, 110), 8))
+    segments.indices[:] += offset
+    for max_depth, min_pixels in [(0, 10), (4, 10), (12, 1)]:
+        expected = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels, backend="numpy")
+        tree = build_obb_trees(segments, max_depth=max_depth, min_pixels=min_pixels, backend="numba")
+        for name in OBBTree.__dataclass_fields__:
+            assert np.array_equal(getattr(tree, name), getattr(expected, name)), name
+
+
+@needs_numba
+def test_compiled_kernels_match_numpy():
+    segments = group_indices_by_label(_labels((100, 100), 9))
+    for label in segments.labels()[1:]:
+        indices = segments.segment(label)
+        obb = oriented_bounding_box_from_moments(indices, compute_moments(indices))
+        compiled = oriented_bounding_box_jit(indices)
+        np.testing.assert_allclose(compiled.corners, obb.corners, rtol=0, atol=1e-9)
+        for part, compiled_part in zip(create_sub_parts(indices, obb.corners),
+                                       create_sub_parts_jit(indices, obb.corners)):
+            # the compiled partition does not keep the order of the points
+            assert np.array_equal(np.unique(part, axis=0), np.unique(compiled_part, axis=0))
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from obb_tree.obb import compute_moments, create_obb_tree, create_sub_parts, oriented_bounding_box_from_moments
+from obb_tree.tree import OBBTree
+
+
+def _rectangle(rows, cols):
+    return np.argwhere(np.ones((rows, cols), dtype=bool))
+
+
+def _disk(radius):
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return np.argwhere(x * x + y * y <= radius * radius)
+
+
+def _split(indices):
+    obb = oriented_bounding_box_from_moments(indices, compute_moments(indices))
+    return create_sub_parts(indices, obb.corners)
+
+
+@pytest.mark.parametrize("shape, sizes", [((5, 9), (20, 25)), ((9, 5), (20, 25)), ((3, 7), (9, 12))])
+def test_pixels_on_the_cut_line_go_to_the_second_part(shape, sizes):
+    indices = _rectangle(*shape)
+    part1, part2 = _split(indices)
+    assert (len(part1), len(part2)) == sizes
+
+    # the middle column or row of the longer side lies on the cut line
+    axis = int(np.argmax(shape))
+    middle = shape[axis] // 2
+    assert not np.any(part1[:, axis] == middle)
+    assert np.sum(part2[:, axis] == middle) == shape[1 - axis]
+
+
+@pytest.mark.parametrize("indices", [_rectangle(7, 7), _rectangle(5, 9), _disk(6), _disk(10)],
+                         ids=["square", "rectangle", "disk6", "disk10"])
+def test_splits_do_not_depend_on_the_position(indices):
+    # near-square boxes and on-line pixels are decided by the tolerance, not by rounding errors of the corners
+    part1, part2 = _split(indices)
+    for offset in [(1000, 2000), (12345, 321), (4097, 65535)]:
+        moved1, moved2 = _split(indices + np.array(offset))
+        assert np.array_equal(moved1 - offset, part1)
+        assert np.array_equal(moved2 - offset, part2)
+
+
+def test_near_square_trees_do_not_depend_on_the_position():
+    indices = _disk(12)
+    tree = OBBTree.from_nested(create_obb_tree(indices, max_depth=4, min_pixels=2))
+    for offset in [(1000, 2000), (12345, 321)]:
+        moved = OBBTree.from_nested(create_obb_tree(indices + np.array(offset), max_depth=4, min_pixels=2))
+        assert np.array_equal(moved.parent, tree.parent)
+        np.testing.assert_allclose(moved.corners - offset, tree.corners, atol=1e-6)
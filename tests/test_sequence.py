@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import ndimage
+
+from obb_tree.query import query_points
+from obb_tree.sequence import SequenceForest
+
+
+def _blobs(shape, seed):
+    rng = np.random.default_rng(seed)
+    labels, _ = ndimage.label(ndimage.gaussian_filter(rng.random(shape), 4) > 0.52)
+    return labels
+
+
+def _jitter(labels, rng, num_pixels):
+    # noisy segmentation: random pixels take the label of a random 4-neighbour
+    labels = labels.copy()
+    rows = rng.integers(1, labels.shape[0] - 1, num_pixels)
+    cols = rng.integers(1, labels.shape[1] - 1, num_pixels)
+    step = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])[rng.integers(0, 4, num_pixels)]
+    labels[rows, cols] = labels[rows + step[:, 0], cols + step[:, 1]]
+    return labels
+
+
+def _check_forest(forest, labels):
+    # every node holds exactly the pixels of its children
+    children = np.flatnonzero(forest.parent >= 0)
+    assert np.array_equal(np.bincount(forest.parent[children], minlength=len(forest)), forest.child_count)
+    assert np.all(forest.parent[forest.first_child[forest.parent[children]]] == forest.parent[children])
+    internal = forest.child_count > 0
+    sums = np.bincount(forest.parent[children], weights=forest.count[children], minlength=len(forest))
+    assert np.array_equal(sums[internal], forest.count[internal])
+
+    # the roots hold all pixels of their segment, and every pixel lies in a leaf of its segment
+    roots = np.flatnonzero(forest.parent == -1)
+    present = np.flatnonzero(np.bincount(labels.ravel()))
+    present = present[present > 0]
+    assert np.array_equal(np.sort(forest.segment[roots]), present)
+    assert np.array_equal(forest.count[roots], np.bincount(labels.ravel())[forest.segment[roots]])
+    pixels = np.argwhere(labels > 0)
+    points, leaves = query_points(forest, pixels, margin=1e-6)
+    own = forest.segment[leaves] == labels[tuple(pixels[points].T)]
+    assert np.all(np.bincount(points[own], minlength=len(pixels)) > 0)
+
+
+def test_refit_over_many_frames():
+    rng = np.random.default_rng(1)
+    labels = _blobs((160, 160), seed=0)
+    sequence = SequenceForest(max_depth=6, min_pixels=4, max_change=0.5)
+    refit = 0
+    for _ in range(12):
+        forest = sequence.update(labels)
+        _check_forest(forest, labels)
+        refit += sequence.stats.refit
+        labels = _jitter(labels, rng, 150)
+    # the frames must exercise the refit path repeatedly for the test to be meaningful
+    assert refit > 50
+
+
+def test_moved_and_relabeled_segments():
+    labels = _blobs((120, 120), seed=3)
+    sequence = SequenceForest(max_depth=5, min_pixels=4)
+    sequence.update(labels)
+    # shift the whole image and relabel it in reverse order
+    shifted = np.roll(labels, (3, -2), axis=(0, 1))
+    shifted[:3], shifted[:, -2:] = 0, 0
+    shifted = ndimage.label(shifted > 0)[0]
+    shifted = np.where(shifted > 0, shifted.max() + 1 - shifted, 0)
+    forest = sequence.update(shifted)
+    _check_forest(forest, shifted)
+    assert sequence.stats.moved > 0
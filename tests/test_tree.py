@@ -0,0 +1,53 @@
+import numpy as np
+from scipy import ndimage
+
+from obb_tree.builder import build_obb_trees
+from obb_tree.obb import group_indices_by_label
+from obb_tree.tree import OBBTree
+
+
+def _segments(seed):
+    rng = np.random.default_rng(seed)
+    labels, _ = ndimage.label(ndimage.gaussian_filter(rng.random((150, 170)), 3) > 0.52)
+    return group_indices_by_label(labels)
+
+
+def _assert_equal(tree, expected):
+    for name in OBBTree.__dataclass_fields__:
+        assert np.array_equal(getattr(tree, name), getattr(expected, name)), name
+
+
+def test_truncate_equals_shallower_build():
+    segments = _segments(0)
+    tree = build_obb_trees(segments, max_depth=6, min_pixels=5)
+    for depth in range(7):
+        _assert_equal(tree.truncate(depth), build_obb_trees(segments, max_depth=depth, min_pixels=5))
+
+
+def test_select_equals_build_of_the_kept_segments():
+    segments = _segments(1)
+    tree = build_obb_trees(segments, max_depth=4)
+    labels = segments.labels()
+    kept = labels[(labels > 0) & (labels % 3 != 0)]
+    _assert_equal(tree.select(np.isin(tree.segment, kept)), build_obb_trees(segments, max_depth=4, labels=kept))
+
+
+def test_segment_trees_concatenate_to_the_forest():
+    segments = _segments(2)
+    tree = build_obb_trees(segments, max_depth=5)
+    labels, trees = tree.segment_trees()
+    assert np.array_equal(labels, np.unique(tree.segment))
+    for label, segment_tree in zip(labels, trees):
+        assert np.all(segment_tree.segment == label)
+        assert np.sum(segment_tree.parent == -1) == 1
+    _assert_equal(OBBTree.concatenate(trees), tree)
+
+
+def test_concatenate_label_ranges_equals_one_build():
+    segments = _segments(3)
+    labels = segments.labels()
+    labels = labels[labels > 0]
+    ranges = np.array_split(labels, 4)
+    forests = [build_obb_trees(segments, max_depth=4, labels=part) for part in ranges]
+    _assert_equal(OBBTree.concatenate(forests), build_obb_trees(segments, max_depth=4))
+